@@ -1,3 +1,4 @@
+import functools
 import contextlib
 from . import reportcore
 from . import serialization
@@ -9,6 +10,25 @@ def simple_table(columns, column_map=None):
     return ClientTable([(c, column_map.get(c, None)) for c in columns], [])
 
 
+def _positional_rows(columns, rows):
+    # Yenot data rows are objects keyed by column name or, in the compact
+    # format, positional arrays.
+    if len(rows) > 0 and isinstance(rows[0], dict):
+        names = [c[0] for c in columns]
+        return [tuple(r[n] for n in names) for r in rows]
+    return rows
+
+
+@functools.lru_cache(maxsize=reportcore.FIXEDRECORD_CACHE_SIZE)
+def _model_row_class(base, columns_key):
+    # A subclass of the shared fixedrecord class carrying the model_columns;
+    # memoized by the serialized columns so that tables of the same columns
+    # share it.  It inherits __slots__, the field list.
+    columns = serialization.deserialize(columns_key)
+    model_columns = {c.attr: c for c in reportcore.parse_columns(columns)}
+    return type(base.__name__, (base,), {"model_columns": model_columns})
+
+
 class ClientTable:
     """
     Tabular API from a Yenot serialized table structure with rich type
@@ -18,12 +38,12 @@ class ClientTable:
     def __init__(self, columns, rows, mixin=None, to_localtime=True):
         self.to_localtime = to_localtime
         f = self.row_factory(columns, mixin=mixin)
-        self.rows = [f(x) for x in rows]
+        self.rows = [f(x) for x in _positional_rows(columns, rows)]
 
         # initialize pkey for deletion
         self.columns = reportcore.parse_columns(columns)
         self.columns_full = reportcore.parse_columns_full(columns)
-        self.DataRow.model_columns = {c.attr: c for c in self.columns}
+        self.model_columns = self.DataRow.model_columns
 
         self.deleted_rows = []
 
@@ -31,9 +51,11 @@ class ClientTable:
         return reportcore.as_python(row_field_list, to_localtime=self.to_localtime)
 
     def row_factory(self, row_field_list, mixin):
-        self.DataRow = reportcore.fixedrecord(
+        shared = reportcore.fixedrecord(
             "DataRow", [r[0] for r in row_field_list], mixin=mixin
         )
+        key = serialization.serialize([list(r) for r in row_field_list])
+        self.DataRow = _model_row_class(shared, key)
         to_python = self.converter(row_field_list)
 
         def init_bare(r):
@@ -107,7 +129,12 @@ class ClientTable:
         return (keys, attrs, slimrows)
 
     def as_http_post_file(self, *args, **kwargs):
-        tab3 = self.as_writable(*args, **kwargs)
+        keys, attrs, slimrows = self.as_writable(*args, **kwargs)
+        # compact tab3 -- rows are positional arrays matching columns; the
+        # keys go ahead of the data for servers reading it as a stream
+        tab3 = {"columns": attrs}
+        tab3.update(keys)
+        tab3["data"] = slimrows
         return serialization.to_json(tab3)
 
     def as_tab2(self, column_map=None):
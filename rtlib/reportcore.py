@@ -41,10 +41,71 @@ class SlottedRow:
         return f"{self.__class__.__name__}({', '.join(values)})"
 
 
+def _slotted_methods(members):
+    """
+    Compile `__init__`, `_as_tuple` and `_as_dict` specialized to members
+    (as collections.namedtuple does) to replace the generic loops of
+    SlottedRow.  The common cases -- every slot given positionally, every
+    slot assigned -- are straight-line code and anything else falls back to
+    the SlottedRow methods so that the semantics are the same.
+    """
+    attrs = [f"self.{m}" for m in members]
+    if members:
+        assign = f"{', '.join(attrs)}, = args"
+        values = f"{', '.join(attrs)},"
+    else:
+        assign = "pass"
+        values = ""
+    items = ", ".join(f"{m!r}: self.{m}" for m in members)
+
+    source = f"""\
+def __init__(self, *args, **kwargs):
+    if len(args) == {len(members)}:
+        {assign}
+    else:
+        for k, v in zip(_members, args):
+            _setattr(self, k, v)
+    if kwargs:
+        for k, v in kwargs.items():
+            _setattr(self, k, v)
+
+def _as_tuple(self):
+    try:
+        return ({values})
+    except AttributeError:
+        return _SlottedRow._as_tuple(self)
+
+def _as_dict(self):
+    try:
+        return {{{items}}}
+    except AttributeError:
+        return _SlottedRow._as_dict(self)
+"""
+    namespace = {"_members": members, "_setattr": setattr, "_SlottedRow": SlottedRow}
+    exec(source, namespace)
+    return {k: namespace[k] for k in ("__init__", "_as_tuple", "_as_dict")}
+
+
+# number of distinct fixedrecord classes kept by fixedrecord
+FIXEDRECORD_CACHE_SIZE = 512
+
+
 def fixedrecord(name, members, mixin=None):
     """
     This is a namedtuple only better.
+
+    The classes are memoized by (name, members, mixin) so that tables of the
+    same shape share one class; `fixedrecord.cache_info()` reports the hits
+    and misses.  Since the class is shared, give it per-use class attributes
+    in a subclass rather than on the class itself.
     """
+    if isinstance(mixin, list):
+        mixin = tuple(mixin)
+    return _fixedrecord(name, tuple(members), mixin)
+
+
+@functools.lru_cache(maxsize=FIXEDRECORD_CACHE_SIZE)
+def _fixedrecord(name, members, mixin):
     kw_clash = KEYWORD_SET.intersection(members)
     if len(kw_clash) > 0:
         raise RuntimeError(
@@ -60,15 +121,21 @@ def fixedrecord(name, members, mixin=None):
             )
         )
 
-    Kls1 = type(name, (SlottedRow,), {"__slots__": members})
+    namespace = {"__slots__": list(members)}
+    namespace.update(_slotted_methods(members))
+    Kls1 = type(name, (SlottedRow,), namespace)
     if mixin == None:
         return Kls1
-    elif isinstance(mixin, (list, tuple)):
-        return type(name, (Kls1,) + tuple(mixin), {})
+    elif isinstance(mixin, tuple):
+        return type(name, (Kls1,) + mixin, {})
     else:
         return type(name, (Kls1, mixin), {})
 
 
+fixedrecord.cache_info = _fixedrecord.cache_info
+fixedrecord.cache_clear = _fixedrecord.cache_clear
+
+
 class ColumnAction:
     def __init__(self, label, callback, scope="global", defaulted=False, reloads=False):
         self.label = label
@@ -173,8 +240,8 @@ def attr_to_label(attr):
 
 
 def api_to_model(attr, meta):
-    if meta == None:
-        meta = {}
+    # work on a copy; the declaration may be shared
+    meta = {} if meta == None else dict(meta)
 
     if "label" not in meta:
         meta["label"] = attr_to_label(attr)
@@ -1,7 +1,10 @@
 import io
+import os
 import json
 import datetime
+import math
 import decimal
+import functools
 
 # other places as well, but this is canonical and the others should be swallowed
 
@@ -20,12 +23,270 @@ class DateTimeEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, o)
 
 
+def _finite(thing):
+    # a copy of thing with NaN & infinite numbers replaced by None
+    if isinstance(thing, float):
+        return thing if math.isfinite(thing) else None
+    if isinstance(thing, decimal.Decimal):
+        return thing if thing.is_finite() else None
+    if isinstance(thing, dict):
+        return {k: _finite(v) for k, v in thing.items()}
+    if isinstance(thing, (list, tuple)):
+        return [_finite(v) for v in thing]
+    return thing
+
+
+class StdlibJsonBackend:
+    """
+    JSON encoding through the Python standard library json module.
+    """
+
+    name = "json"
+    # member separator of the encoded objects and arrays
+    separator = ", "
+
+    def __init__(self):
+        self._encode = DateTimeEncoder().encode
+
+    def dumps(self, thing):
+        return self._encode(thing)
+
+    def dumpb(self, thing):
+        return self._encode(thing).encode("utf-8")
+
+    def loads(self, text):
+        return json.loads(text)
+
+
+class OrjsonBackend:
+    """
+    JSON encoding through the native orjson package.  Dates and decimals are
+    passed to the same conversions as :class:`DateTimeEncoder`; values orjson
+    refuses (e.g. integers beyond 64 bits) fall back to the standard library.
+
+    The output decodes to the same values as :class:`StdlibJsonBackend`
+    except for NaN and infinite numbers which orjson writes as null rather
+    than the non-standard NaN & Infinity.  The bytes differ as well:  members
+    are separated by "," rather than ", " and non-ASCII characters are
+    written as utf-8 rather than \\u escapes.  The standard library fallback
+    writes the same so that one response never mixes the two.
+    """
+
+    name = "orjson"
+    separator = ","
+
+    def __init__(self):
+        import orjson
+
+        self._orjson = orjson
+        self._options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        self._fallback = DateTimeEncoder(
+            separators=(",", ":"), ensure_ascii=False, allow_nan=False
+        ).encode
+
+    @staticmethod
+    def _default(o):
+        if isinstance(o, (datetime.date, datetime.time)):
+            return o.isoformat()
+        if isinstance(o, decimal.Decimal):
+            return float(o)
+        if isinstance(o, tuple):
+            # namedtuple rows
+            return list(o)
+        raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+    def dumpb(self, thing):
+        try:
+            return self._orjson.dumps(
+                thing, default=self._default, option=self._options
+            )
+        except TypeError:
+            try:
+                text = self._fallback(thing)
+            except ValueError:
+                # non-finite numbers; null as written by orjson
+                text = self._fallback(_finite(thing))
+            return text.encode("utf-8")
+
+    def dumps(self, thing):
+        return self.dumpb(thing).decode("utf-8")
+
+    def loads(self, text):
+        return self._orjson.loads(text)
+
+
+JSON_BACKENDS = {}
+
+# backends tried in order for "auto"
+JSON_BACKEND_PREFERENCE = ["orjson", "json"]
+
+_json_backend = None
+
+
+def register_json_backend(name, factory):
+    """
+    Register a JSON backend factory; the factory raises ImportError if the
+    backend is not installed.
+    """
+    JSON_BACKENDS[name] = factory
+
+
+register_json_backend("json", StdlibJsonBackend)
+register_json_backend("orjson", OrjsonBackend)
+
+
+def set_json_backend(name=None):
+    """
+    Select the JSON backend by name; the standard library "json" by default.
+    With "auto" the first installed backend in JSON_BACKEND_PREFERENCE is
+    used.
+    """
+    global _json_backend
+
+    if name in (None, ""):
+        name = "json"
+    if name == "auto":
+        for candidate in JSON_BACKEND_PREFERENCE:
+            try:
+                _json_backend = JSON_BACKENDS[candidate]()
+                break
+            except ImportError:
+                continue
+    elif name in JSON_BACKENDS:
+        _json_backend = JSON_BACKENDS[name]()
+    else:
+        raise ValueError(f"unknown json backend {name}")
+    return _json_backend
+
+
+def json_backend():
+    """
+    Return the current JSON backend; initially chosen by the environment
+    variable RTLIB_JSON_BACKEND (json -- the default, orjson or auto).
+    """
+    if _json_backend == None:
+        set_json_backend(os.environ.get("RTLIB_JSON_BACKEND"))
+    return _json_backend
+
+
 def serialize(thing, pprint=False):
     if pprint:
         return json.dumps(thing, cls=DateTimeEncoder, indent=4)
     else:
-        return json.dumps(thing, cls=DateTimeEncoder)
+        return json_backend().dumps(thing)
+
+
+def serialize_bytes(thing):
+    return json_backend().dumpb(thing)
+
+
+def deserialize(text):
+    return json_backend().loads(text)
 
 
 def to_json(thing):
-    return io.BytesIO(serialize(thing).encode("utf8"))
+    return io.BytesIO(serialize_bytes(thing))
+
+
+# Compiled row encoders for rtlib tables
+#
+# A table's column types are known before its rows are encoded, so the
+# conversion of each row to JSON native values is generated once per shape
+# (as collections.namedtuple generates code) and the converted batch goes
+# through the JSON backend in one call.  Only date and numeric columns are
+# converted and only for values of exactly the expected type; anything else
+# still reaches the backend's default conversion so the output matches
+# serialize.
+
+_CONVERSIONS = {
+    "date": "({v}.isoformat() if type({v}) in _dates else {v})",
+    "datetime": "({v}.isoformat() if type({v}) in _dates else {v})",
+    "numeric": "(_float({v}) if type({v}) is _Decimal else {v})",
+}
+
+_CONVERTER_NAMESPACE = {
+    "_dates": frozenset([datetime.date, datetime.datetime, datetime.time]),
+    "_Decimal": decimal.Decimal,
+    "_float": float,
+}
+
+
+def _column_type(meta):
+    return meta.get("type", None) if meta else None
+
+
+@functools.lru_cache(maxsize=256)
+def _compiled_row_converter(names, types, compact):
+    cells = [_CONVERSIONS.get(t, "{v}").format(v=f"_{i}") for i, t in enumerate(types)]
+    if compact:
+        if all(t not in _CONVERSIONS for t in types):
+            # the C encoder takes the row tuples as they are
+            return None
+        body = "[" + ", ".join(cells) + "]"
+    else:
+        # A dict display keeps the first position of a repeated name with the
+        # last value just as dict(zip(names, row)).
+        body = "{" + ", ".join(f"{n!r}: {c}" for n, c in zip(names, cells)) + "}"
+
+    unpack = "".join(f"_{i}, " for i in range(len(names)))
+    if unpack:
+        source = f"def convert_row(row):\n    {unpack}= row\n    return {body}\n"
+    else:
+        source = f"def convert_row(row):\n    return {body}\n"
+    namespace = dict(_CONVERTER_NAMESPACE)
+    exec(source, namespace)
+    return namespace["convert_row"]
+
+
+def _row_converter(columns, compact):
+    names = tuple(c[0] for c in columns)
+    types = tuple(_column_type(c[1]) for c in columns)
+    convert = _compiled_row_converter(names, types, compact)
+
+    def generic(row):
+        return list(row) if compact else dict(zip(names, row))
+
+    return convert, generic
+
+
+def row_encoder(columns, compact=False):
+    """
+    Return a function encoding one row of a table with the given rtlib
+    columns to JSON text -- an object keyed by column name or, if compact, a
+    positional array.  The result matches serialize of the same row.
+    """
+    convert, generic = _row_converter(columns, compact)
+    dumps = json_backend().dumps
+
+    def encode_row(row):
+        if convert == None:
+            return dumps(row)
+        try:
+            return dumps(convert(row))
+        except ValueError:
+            # row length differs from the columns
+            return dumps(generic(row))
+
+    return encode_row
+
+
+def rows_encoder(columns, compact=False):
+    """
+    Return a function encoding a batch of rows as the utf-8 bytes of the
+    separated members of a JSON array (without the brackets).
+    """
+    convert, generic = _row_converter(columns, compact)
+    dumpb = json_backend().dumpb
+
+    def encode_rows(rows):
+        if convert == None:
+            data = rows
+        else:
+            try:
+                data = list(map(convert, rows))
+            except ValueError:
+                # some row length differs from the columns
+                data = list(map(generic, rows))
+        return dumpb(data)[1:-1]
+
+    return encode_rows
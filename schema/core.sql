@@ -99,3 +99,32 @@ language sql
 security definer
 -- Limit to trusted schema(s)
 set search_path=pg_catalog, pg_temp;
+
+-- Announce schema changes on channel yenotsys_ddl so that servers can drop
+-- cached table metadata (see yenot/backend/sqlwrite.py).  Event triggers can
+-- only be created by a superuser; without it the cache is not used.
+create function yenotsys.notify_ddl() returns event_trigger
+as $$
+begin
+    -- temporary tables (e.g. the COPY staging of sqlwrite) are not news
+    if not exists (
+            select 1 from pg_event_trigger_ddl_commands()
+            where schema_name='pg_temp'
+        ) or exists (
+            select 1 from pg_event_trigger_ddl_commands()
+            where schema_name is distinct from 'pg_temp'
+        ) then
+        perform pg_notify('yenotsys_ddl', tg_tag);
+    end if;
+end;
+$$
+language plpgsql;
+
+do $$
+begin
+    create event trigger yenotsys_ddl_notify on ddl_command_end
+        execute function yenotsys.notify_ddl();
+exception when insufficient_privilege then
+    raise notice 'yenotsys_ddl_notify not created; table metadata will not be cached';
+end;
+$$;
@@ -19,10 +19,40 @@ if __name__ == "__main__":
     parse.add_argument(
         "--sitevar", action="append", default=[], help="add site variable"
     )
+    parse.add_argument(
+        "--pool-min",
+        type=int,
+        default=None,
+        help="database connections opened at start (default YENOT_POOL_MIN or 3)",
+    )
+    parse.add_argument(
+        "--pool-max",
+        type=int,
+        default=None,
+        help="most database connections open at once (default YENOT_POOL_MAX or 6)",
+    )
+    parse.add_argument(
+        "--pool-timeout",
+        type=float,
+        default=None,
+        help="seconds a request waits for a database connection (default YENOT_POOL_TIMEOUT or 5)",
+    )
+    parse.add_argument(
+        "--replica",
+        action="append",
+        default=[],
+        help="read replica database url for read-only requests (may be repeated)",
+    )
 
     args = parse.parse_args()
 
-    app = yenot.backend.init_application(args.dburl)
+    app = yenot.backend.init_application(
+        args.dburl,
+        pool_min=args.pool_min,
+        pool_max=args.pool_max,
+        pool_timeout=args.pool_timeout,
+        replica_urls=args.replica,
+    )
 
     app.add_sitevars(args.sitevar)
 
@@ -0,0 +1,52 @@
+"""
+Measure the generated __init__, _as_tuple and _as_dict of fixedrecord
+classes against the generic SlottedRow loops.
+
+    python tests/bench_fixedrecord.py --rows 1000000
+"""
+
+import gc
+import time
+import argparse
+import rtlib.reportcore as reportcore
+
+MEMBERS = ["id", "name", "amount", "day", "flag", "memo"]
+
+
+def timed(func, repeat=3):
+    # best of a few runs with the garbage collector held off as timeit does
+    elapsed = []
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            t1 = time.perf_counter()
+            result = func()
+            elapsed.append(time.perf_counter() - t1)
+        finally:
+            gc.enable()
+    return min(elapsed), result
+
+
+if __name__ == "__main__":
+    parse = argparse.ArgumentParser("benchmark generated fixedrecord methods")
+    parse.add_argument("--rows", type=int, default=1000000)
+    args = parse.parse_args()
+
+    Generic = type("Generic", (reportcore.SlottedRow,), {"__slots__": MEMBERS})
+    Generated = reportcore.fixedrecord("Generated", MEMBERS)
+    values = [
+        (i, f"name {i}", i * 1.25, None, i % 2 == 0, "memo") for i in range(args.rows)
+    ]
+
+    print(f"{args.rows} rows x {len(MEMBERS)} columns")
+    for label, Kls in [("generic", Generic), ("generated", Generated)]:
+        init, rows = timed(lambda: [Kls(*v) for v in values])
+        partial, _ = timed(lambda: [Kls(*v[:3], memo="x") for v in values])
+        astuple, tuples = timed(lambda: [r._as_tuple() for r in rows])
+        asdict, _ = timed(lambda: [r._as_dict() for r in rows])
+        assert tuples == values
+        print(
+            f"{label:<10} __init__ {init:6.3f}s  partial __init__ {partial:6.3f}s  "
+            f"_as_tuple {astuple:6.3f}s  _as_dict {asdict:6.3f}s"
+        )
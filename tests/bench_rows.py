@@ -0,0 +1,63 @@
+"""
+Measure the per-row cost of namedtuple rows (NamedTupleCursor) against the
+plain tuple rows of sql_tab2(..., lean=True) on a large select.
+
+    YENOT_DB_URL=postgresql://... python tests/bench_rows.py --rows 200000
+"""
+
+import os
+import gc
+import time
+import argparse
+import yenot.backend
+import yenot.backend.api as api
+
+SELECT = """
+select g as id, 'name ' || g as name, g * 1.25 as amount,
+    current_date - (g %% 1000) as day, g %% 2 = 0 as flag, 'memo' as memo
+from generate_series(1, %(n)s) g
+"""
+
+
+def timed(func, repeat=5):
+    # best of a few runs with the garbage collector held off as timeit does
+    elapsed = []
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            t1 = time.perf_counter()
+            result = func()
+            elapsed.append(time.perf_counter() - t1)
+        finally:
+            gc.enable()
+    return min(elapsed), result
+
+
+if __name__ == "__main__":
+    parse = argparse.ArgumentParser("benchmark namedtuple versus lean tuple rows")
+    parse.add_argument("--rows", type=int, default=200000)
+    args = parse.parse_args()
+
+    conn = yenot.backend.create_connection(os.environ["YENOT_DB_URL"])
+    params = {"n": args.rows}
+
+    def fetch(lean):
+        return api.sql_tab2(conn, SELECT, params, lean=lean)
+
+    def fetch_and_encode(lean):
+        results = api.Results()
+        results.tables["data", True] = fetch(lean)
+        return results.json_out(compact=False)
+
+    print(f"{args.rows} rows x 6 columns")
+    for label, func in [("sql_tab2", fetch), ("sql_tab2 + json_out", fetch_and_encode)]:
+        named, named_result = timed(lambda: func(False))
+        lean, lean_result = timed(lambda: func(True))
+        assert named_result == lean_result
+        saved = (named - lean) / args.rows * 1e6
+        print(
+            f"{label:<22} named {named:7.3f}s  lean {lean:7.3f}s  "
+            f"saved {saved:6.3f} us/row ({(named - lean) / named:5.1%})"
+        )
+    conn.close()
@@ -0,0 +1,88 @@
+"""
+Compare the generic rtlib.serialize of tab2 data with the column-typed
+encoders of rtlib.rows_encoder.
+
+    python tests/bench_serialization.py --rows 100000 --backend orjson
+"""
+
+import gc
+import time
+import random
+import decimal
+import datetime
+import argparse
+import rtlib
+
+
+def sample_table(nrows):
+    kinds = ["integer", "numeric", "date", "datetime", "boolean", None] * 4
+    columns = [
+        (f"col{i:02d}", {"type": kind} if kind else {"max_length": 30})
+        for i, kind in enumerate(kinds[:20])
+    ]
+
+    today = datetime.date.today()
+    now = datetime.datetime.now()
+    makers = {
+        "integer": lambda i: random.randint(0, 10**6),
+        "numeric": lambda i: decimal.Decimal(random.randint(0, 10**6)) / 100,
+        "date": lambda i: today - datetime.timedelta(days=i % 1000),
+        "datetime": lambda i: now - datetime.timedelta(seconds=i),
+        "boolean": lambda i: i % 2 == 0,
+        None: lambda i: f"text value {i}",
+    }
+    funcs = [makers[kind] for kind in kinds[:20]]
+    rows = [tuple(f(i) for f in funcs) for i in range(nrows)]
+    return columns, rows
+
+
+def timed(label, func, repeat=3):
+    # report the best of a few runs to damp machine noise; like timeit, the
+    # garbage collector is held off while timing
+    elapsed = []
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            t1 = time.perf_counter()
+            result = func()
+            elapsed.append(time.perf_counter() - t1)
+        finally:
+            gc.enable()
+    print(f"{label:<40} {min(elapsed):8.3f}s")
+    return result
+
+
+if __name__ == "__main__":
+    parse = argparse.ArgumentParser("benchmark tab2 json encoding")
+    parse.add_argument("--rows", type=int, default=100000)
+    parse.add_argument("--backend", default="json", help="json, orjson or auto")
+    args = parse.parse_args()
+
+    backend = rtlib.set_json_backend(args.backend)
+    print(f"json backend:  {backend.name}")
+
+    columns, rows = sample_table(args.rows)
+    names = [c for c, _ in columns]
+    print(f"{len(rows)} rows x {len(columns)} columns")
+
+    def generic():
+        data = [dict(zip(names, row)) for row in rows]
+        return rtlib.serialize(data)
+
+    def compiled():
+        return "[" + rtlib.rows_encoder(columns)(rows).decode("utf-8") + "]"
+
+    def generic_compact():
+        return rtlib.serialize(rows)
+
+    def compiled_compact():
+        encoded = rtlib.rows_encoder(columns, compact=True)(rows)
+        return "[" + encoded.decode("utf-8") + "]"
+
+    a = timed("serialize (dict rows)", generic)
+    b = timed("rows_encoder (dict rows)", compiled)
+    assert a == b
+    a = timed("serialize (compact rows)", generic_compact)
+    b = timed("rows_encoder (compact rows)", compiled_compact)
+    assert a == b
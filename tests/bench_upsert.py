@@ -0,0 +1,74 @@
+"""
+Compare the single statement INSERT ... ON CONFLICT upsert of
+TableSaveMogrification.persist with the update & insert pair.  Half of each
+save updates existing rows and half inserts new ones.
+
+    YENOT_DB_URL=postgresql://... python tests/bench_upsert.py --copy
+"""
+
+import os
+import time
+import argparse
+import rtlib
+import yenot.backend
+import yenot.backend.api as api
+from yenot.backend import sqlwrite
+
+CREATE = """
+create temporary table bench_upsert (
+    id integer primary key, name text, amount numeric(12, 2), day date, flag boolean
+)"""
+
+EXISTING = """
+insert into bench_upsert (id, name)
+select g, 'old' from generate_series(1, %(n)s) g"""
+
+
+def save(conn, rows, upsert, copy):
+    api.sql_void(conn, CREATE)
+    api.sql_void(conn, EXISTING, {"n": len(rows) // 2})
+
+    table = rtlib.simple_table(["id", "name", "amount", "day", "flag"])
+    table.rows = [table.DataRow(*row) for row in rows]
+    table.deleted_keys = []
+
+    mog = sqlwrite.TableSaveMogrification()
+    mog.table = "bench_upsert"
+    mog.primary_key = ["id"]
+    mog.column_types = {"amount": "numeric(12, 2)", "day": "date"}
+    mog.upsert = upsert
+    if not copy:
+        mog.copy_threshold = len(rows) + 1
+
+    t1 = time.perf_counter()
+    written = mog.persist(conn, table)
+    elapsed = time.perf_counter() - t1
+    conn.rollback()
+    assert written == len(rows)
+    return elapsed
+
+
+if __name__ == "__main__":
+    parse = argparse.ArgumentParser(
+        "benchmark ON CONFLICT upsert versus update & insert"
+    )
+    parse.add_argument("--sizes", default="1000,10000,100000")
+    parse.add_argument("--repeat", type=int, default=3)
+    parse.add_argument(
+        "--copy", action="store_true", help="stage the rows with COPY (see stage)"
+    )
+    args = parse.parse_args()
+
+    conn = yenot.backend.create_connection(os.environ["YENOT_DB_URL"])
+    for n in [int(x) for x in args.sizes.split(",")]:
+        rows = [
+            (i, f"name {i}", i * 1.25, "2024-01-01", i % 2 == 0)
+            for i in range(1, n + 1)
+        ]
+        two = min(save(conn, rows, False, args.copy) for _ in range(args.repeat))
+        one = min(save(conn, rows, True, args.copy) for _ in range(args.repeat))
+        print(
+            f"{n:>7} rows  update & insert {two:7.3f}s  on conflict {one:7.3f}s  "
+            f"({(two - one) / two:5.1%} saved)"
+        )
+    conn.close()
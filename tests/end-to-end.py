@@ -28,6 +28,22 @@ def test_server_info(dburl):
         client.put("api/test/http-method-put")
         client.delete("api/test/http-method-delete")
 
+        streamed = session.json_client().get("api/test/stream-table", count=1200)
+        assert len(streamed["data"]["data"]) == 1200
+        assert streamed["data"]["data"][-1]["label"] == "row 1200"
+
+        aggregated = session.json_client().get("api/test/json-table", count=300)
+        assert aggregated["data"]["data"][-1]["label"] == "row 300"
+
+        r = session.get(session.prefix("api/test/stream-table"), params={"count": 1200})
+        assert r.headers["Content-Encoding"] == "gzip"
+        assert len(r.json()["data"]["data"]) == 1200
+
+        r = session.get(session.prefix("api/metrics"))
+        assert r.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        assert 'yenot_request_seconds_count{route="api_test_stream_table"' in r.text
+        assert 'yenot_pool_connections{state="in_use"}' in r.text
+
         client = session.std_client()
 
         client.get(
@@ -41,10 +57,32 @@ def test_server_info(dburl):
         something = client.get("api/test/prototype")
         assert something.keys["scalar"] == 23
         assert something.named_table("data").rows[0].name == "Fred"
+        # the second request is conditional and answered from the kept body
+        assert len(session.validators.entries) > 0
+        something = client.get("api/test/prototype")
+        assert something.named_table("data").rows[0].name == "Fred"
+        # another representation of the url is kept apart
+        session.headers["X-Yenot-Format"] = "compact"
+        something = client.get("api/test/prototype")
+        assert something.named_table("data").rows[0].name == "Fred"
+        del session.headers["X-Yenot-Format"]
+        prototype = [k for k in session.validators.entries if "prototype" in k[0]]
+        assert len(prototype) == 2
+        r = session.get(session.prefix("api/test/prototype"))
+        r = session.get(
+            session.prefix("api/test/prototype"),
+            headers={"If-None-Match": r.headers["ETag"]},
+        )
+        assert r.status_code == 304
+        compact = yclient.YenotSession(server.url, compact=True).std_client()
+        something = compact.get("api/test/prototype")
+        assert something.named_table("data").rows[0].name == "Fred"
         something = client.get("api/test/date-columns")
         something.named_table("data")
         something = client.get("api/test/modify-table")
-        something.named_table("data")
+        assert something.named_table("data").rows[0].age == 41
+        something = client.get("api/test/modify-table-lean")
+        assert something.named_table("data").rows[0].age == 41
 
         try:
             client.get("api/test/sql-exception01")
@@ -92,6 +130,21 @@ def test_server_info(dburl):
         except Exception as e:
             assert str(e).find("fields not given")
 
+        out = client.post(
+            "api/test/receive-table-stream",
+            files={"inbound": inbound.as_http_post_file()},
+        )
+        assert [r.xint for r in out.named_table("outbound").rows] == [2, 3]
+        try:
+            t = rtlib.simple_table(["id"])
+            out = client.post(
+                "api/test/receive-table-stream",
+                files={"inbound": t.as_http_post_file()},
+            )
+            assert False, "expected a missing field error"
+        except yclient.YenotError as e:
+            assert str(e).find("fields not given") > 0
+
         # for sake of coverage, quick call
         t1 = time.time()
         with futures.ThreadPoolExecutor(max_workers=1) as executor:
@@ -300,6 +353,28 @@ def test_changequeue(dburl):
         assert len(content2.main_table().rows) == 0
 
 
+def test_response_cache(dburl):
+    with yenot.tests.server_running(dburl) as server:
+        session = yclient.YenotSession(server.url)
+        client = session.std_client()
+
+        def cached_get():
+            r = session.get(session.prefix("api/test/cached-sequence"))
+            return r.headers["X-Yenot-Cache"], r.json()["value"]
+
+        # the first request waits for the listener and is cached
+        status, value1 = cached_get()
+        assert status == "miss"
+        status, value2 = cached_get()
+        assert (status, value2) == ("hit", value1)
+
+        client.post("api/test/changequeue", channel="test_cache")
+        time.sleep(1)
+
+        status, value3 = cached_get()
+        assert status == "miss" and value3 != value1
+
+
 if __name__ == "__main__":
     dburl = os.environ["YENOT_DB_URL"]
     init_database(dburl)
@@ -309,3 +384,4 @@ if __name__ == "__main__":
     test_read_write(dburl)
     test_sitevar_reads(dburl)
     test_changequeue(dburl)
+    test_response_cache(dburl)
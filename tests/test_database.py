@@ -1,7 +1,14 @@
+import io
 import os
+import copy
+import datetime
 import pytest
+import psycopg2.errors
+import rtlib
 import yenot.backend
 import yenot.backend.api as api
+from yenot.backend import sqlprepare
+from yenot.backend import sqlwrite
 
 
 @pytest.fixture
@@ -24,3 +31,362 @@ def test_sql_readers(conn):
     obj = api.sql_1object(conn, "select %(x)s as col1, %(y)s as col2", params)
     assert obj.col1 == "ex"
     assert obj.col2 == "why"
+
+
+def test_sql_tab2_stream(conn):
+    select = "select g as num, 'x' || g as label from generate_series(1, 25) g"
+    columns, rows = api.sql_tab2_stream(conn, select, itersize=10)
+    assert [c for c, _ in columns] == ["num", "label"]
+    assert columns[0][1]["type"] == "integer"
+
+    batches = list(rows.batches())
+    assert [len(b) for b in batches] == [10, 10, 5]
+    assert batches[2][-1].label == "x25"
+    assert rows.cursor.closed
+
+
+def test_sql_tab2_json(conn):
+    select = """
+select g as num, 'x%%' || g as label, date '2020-01-01' + g as day
+from generate_series(1, 5) g
+where g > %(low)s
+order by g desc"""
+    params = {"low": 2}
+
+    columns, rows = api.sql_tab2(conn, select, params)
+    for compact in [False, True]:
+        jcolumns, jrows = api.sql_tab2_json(conn, select, params, compact=compact)
+        assert jcolumns == columns
+        assert len(jrows) == 3
+        # iterating decodes the JSON; dates remain strings
+        assert list(jrows) == [(r.num, r.label, r.day.isoformat()) for r in rows]
+
+        results = api.Results()
+        results.tables["t", True] = jcolumns, jrows
+        expected = api.Results()
+        expected.tables["t", True] = columns, rows
+        for out_compact in [False, True]:
+            before = api.metrics.ROWS_SERIALIZED.values[()]
+            assert rtlib.deserialize(
+                results.json_out(compact=out_compact)
+            ) == rtlib.deserialize(expected.json_out(compact=out_compact))
+            # the rows count whether written verbatim or encoded
+            assert api.metrics.ROWS_SERIALIZED.values[()] == before + 6
+
+    columns, rows = api.sql_tab2_json(conn, "select 1 as x where false", compact=False)
+    assert len(rows) == 0 and list(rows) == []
+
+    # duplicate names fall back to building arrays from row_to_json
+    columns, rows = api.sql_tab2_json(conn, "select 1 as x, 2 as x", compact=True)
+    assert list(rows) == [(1, 2)]
+
+
+def test_sql_lean_rows(conn):
+    select = "select g as num, 'x' || g as label from generate_series(1, 3) g"
+    columns, rows = api.sql_tab2(conn, select)
+    lcolumns, lrows = api.sql_tab2(conn, select, lean=True)
+    assert lcolumns == columns
+    assert all(type(row) is tuple for row in lrows)
+    assert lrows == [tuple(row) for row in rows]
+    assert api.named_rows(lcolumns, lrows)[2].label == "x3"
+
+    assert api.sql_rows(conn, select, lean=True) == lrows
+
+    # names sanitized as by NamedTupleCursor
+    row = api.sql_1object(conn, 'select 1 as "foo bar", 2 as "2x", 3 as x, 4 as x')
+    assert (row.foo_bar, row.f2x, row.x) == (1, 2, 3)
+
+    def xform(oldrow, row):
+        row.num = oldrow.num * 10
+
+    transformed = api.tab2_rows_transform((lcolumns, lrows), lcolumns, xform)
+    assert transformed == [(10, "x1"), (20, "x2"), (30, "x3")]
+    assert type(transformed[0]) is tuple
+    transformed = api.tab2_rows_transform((columns, rows), columns, xform)
+    assert transformed[0].num == 10
+
+
+def test_sql_tab2_column_cache(conn):
+    select = "select 1 as id, 'x'::varchar(20) as name, current_date as day"
+    cm = api.ColumnMap(id=api.cgen.item.surrogate(), day=api.cgen.auto(label="D"))
+    snapshot = copy.deepcopy(cm)
+
+    columns1, _ = api.sql_tab2(conn, select, column_map=cm)
+    columns2, _ = api.sql_tab2(conn, select, column_map=cm, lean=True)
+    assert cm == snapshot
+    assert columns1 == columns2 and columns1 is not columns2
+    assert columns1[0][1] is columns2[0][1]
+    assert dict(columns1[1][1]) == {"max_length": 20}
+    assert dict(columns1[2][1]) == {"label": "D", "type": "date"}
+
+    with pytest.raises(TypeError):
+        columns1[0][1]["label"] = "changed"
+    meta = columns1[0][1].copy()
+    meta["label"] = "changed"
+
+    # a changed column map is a new declaration
+    cm["id"] = api.cgen.auto(hidden=True)
+    columns3, _ = api.sql_tab2(conn, select, column_map=cm)
+    assert dict(columns3[0][1]) == {"hidden": True, "type": "integer"}
+
+
+def test_prepared_statements(conn):
+    select = "select %(x)s::integer + 1 as y, '100%%' as pct where %(x)s > 0"
+    for x in [1, 2, 3]:
+        assert api.sql_1row(conn, select, {"x": x}, prepare=True) == (x + 1, "100%")
+    prepared = sqlprepare.prepared_statements(conn)
+    assert (prepared.misses, prepared.hits) == (1, 2)
+
+    columns, rows = api.sql_tab2(conn, "select 5 as five", prepare=True)
+    assert rows[0].five == 5
+    rows = api.sql_rows(
+        conn, "select %s::text as a, %s::int as b", ["q", 7], True, True
+    )
+    assert rows == [("q", 7)]
+    obj = api.sql_1object(conn, "select %s::text as a", ("z",), prepare=True)
+    assert obj.a == "z"
+    # tuple values (in %s) are not prepared
+    assert api.sql_1row(conn, "select 2 in %s", [(1, 2)], prepare=True)
+
+    # a fresh session prepares again
+    conn.rollback()
+    api.sql_void(conn, "deallocate all")
+    conn.commit()
+    assert api.sql_1row(conn, select, {"x": 1}, prepare=True) == (2, "100%")
+    prepared = sqlprepare.prepared_statements(conn)
+    assert (prepared.misses, prepared.hits) == (1, 0)
+
+    # except in a transaction aborted with earlier work
+    api.sql_void(conn, "deallocate all")
+    with pytest.raises(psycopg2.errors.InvalidSqlStatementName):
+        api.sql_1row(conn, select, {"x": 1}, prepare=True)
+    conn.rollback()
+    assert api.sql_1row(conn, select, {"x": 1}, prepare=True) == (2, "100%")
+
+    # least recently used statements are deallocated
+    prepared = sqlprepare.prepared_statements(conn)
+    prepared.size = 2
+    for n in range(4):
+        assert api.sql_1row(conn, f"select {n}", prepare=True) == n
+    assert len(prepared.statements) == 2
+    assert api.sql_1row(conn, "select count(*) from pg_prepared_statements") == 2
+
+
+def test_table_metadata_cache(conn, monkeypatch):
+    # created in the transaction rolled back at the end
+    api.sql_void(conn, "create table meta_test (id integer primary key, x text)")
+    metadata = sqlwrite.TableMetadata()
+    # without a running server nothing is cached
+    assert metadata.primary_key(conn, "public", "meta_test") == ["id"]
+    assert len(metadata.entries) == 0
+
+    monkeypatch.setattr(metadata, "_listening", lambda conn: True)
+    columns = metadata.columns(conn, "public", "meta_test")
+    assert [c.column_name for c in columns] == ["id", "x"]
+    assert metadata.columns(conn, "public", "meta_test") is columns
+    assert metadata.primary_key(conn, "public", "meta_test") == ["id"]
+    assert metadata.hits == 1
+
+    api.sql_void(conn, "alter table meta_test add column y integer")
+    metadata.flush()
+    columns = metadata.columns(conn, "public", "meta_test")
+    assert [c.column_name for c in columns] == ["id", "x", "y"]
+    conn.rollback()
+
+
+def test_copy_staged_upsert(conn, monkeypatch):
+    awkward = "tab\there\nnewline \\ backslash"
+    day = datetime.date(2024, 2, 29)
+    rows = [(2, awkward, 1.5, day, True), (None, "new 1", None, None, None)]
+    rows += [(None, f"new {i}", i, day, False) for i in range(2, 5)]
+
+    def save(threshold):
+        # created in the transaction rolled back at the end
+        create = """
+create table copy_test (
+    id serial primary key, name text, amount numeric(12, 2), day date, flag boolean
+)"""
+        api.sql_void(conn, create)
+        api.sql_void(
+            conn, "insert into copy_test (name) select 'old' from generate_series(1, 3)"
+        )
+
+        table = rtlib.simple_table(["id", "name", "amount", "day", "flag"])
+        table.rows = [table.DataRow(*row) for row in rows]
+        monkeypatch.setattr(sqlwrite, "COPY_THRESHOLD", threshold)
+        with api.writeblock(conn) as w:
+            assert w.upsert_rows("copy_test", table) == len(rows)
+        saved = api.sql_rows(conn, "select * from copy_test order by id")
+        conn.rollback()
+        return [r.id for r in table.rows], saved
+
+    keys, staged = save(threshold=1)
+    assert keys == [2, 4, 5, 6, 7]
+    assert staged[1] == (2, awkward, 1.5, day, True)
+    assert save(threshold=1000) == (keys, staged)
+
+    # the single statement INSERT ... ON CONFLICT writes the same
+    monkeypatch.setattr(sqlwrite.WriteChunk, "upsert", True)
+    assert save(threshold=1) == (keys, staged)
+    assert save(threshold=1000) == (keys, staged)
+
+
+@pytest.mark.parametrize("threshold", [1, 1000])
+def test_partial_column_upsert(conn, monkeypatch, threshold):
+    monkeypatch.setattr(sqlwrite, "COPY_THRESHOLD", threshold)
+    monkeypatch.setattr(sqlwrite.WriteChunk, "upsert", True)
+    # created in the transaction rolled back at the end
+    create = "create table part_test (id integer primary key, a text not null, b text not null)"
+    api.sql_void(conn, create)
+    api.sql_void(conn, "insert into part_test values (1, 'old', 'kept')")
+
+    # b is not saved so ON CONFLICT would fail its not null check
+    table = rtlib.simple_table(["id", "a"])
+    table.rows = [table.DataRow(1, "new")]
+    with api.writeblock(conn) as w:
+        assert w.update_rows("part_test", table) == 1
+    assert api.sql_rows(conn, "select * from part_test") == [(1, "new", "kept")]
+    conn.rollback()
+
+
+def test_paged_writes(conn, monkeypatch):
+    monkeypatch.setattr(sqlwrite, "COPY_THRESHOLD", 1000)
+    monkeypatch.setattr(sqlwrite, "PAGE_ROWS", 2)
+    # created in the transaction rolled back at the end
+    api.sql_void(conn, "create table page_test (id serial primary key, name text)")
+
+    table = rtlib.simple_table(["id", "name"])
+    table.rows = [table.DataRow(i, f"row {i}") for i in range(1, 6)]
+    with conn.cursor() as cursor:
+        pages = list(sqlwrite.mogrify_pages(cursor, table.rows, ["id", "name"]))
+        assert len(pages) == 3
+        assert ",\n\t".join(pages) == sqlwrite.mogrify_values(
+            cursor, table.rows, ["id", "name"]
+        )
+        # a row to a page when each is over the bytes
+        monkeypatch.setattr(sqlwrite, "PAGE_BYTES", 1)
+        assert len(list(sqlwrite.mogrify_pages(cursor, table.rows, ["id"]))) == 5
+        monkeypatch.setattr(sqlwrite, "PAGE_BYTES", 1024 * 1024)
+
+    api.sql_void(conn, "select setval('page_test_id_seq', 5)")
+    with api.writeblock(conn) as w:
+        w.insert_rows("page_test", table)
+
+        table = rtlib.simple_table(["id", "name"])
+        table.rows = [table.DataRow(None, f"new {i}") for i in range(5)]
+        table.rows.append(table.DataRow(1, "one"))
+        table.deleted_keys = [(2,), (3,), (4,)]
+        assert w.upsert_rows("page_test", table) == 6
+        assert [r.id for r in table.rows] == [6, 7, 8, 9, 10, 1]
+
+        table = rtlib.simple_table(["id"])
+        table.rows = [table.DataRow(i) for i in (5, 6, 7)]
+        w.delete_rows("page_test", table)
+
+    select = "select id, name from page_test order by id"
+    assert api.sql_rows(conn, select) == [
+        (1, "one"),
+        (8, "new 2"),
+        (9, "new 3"),
+        (10, "new 4"),
+    ]
+    conn.rollback()
+
+
+def test_upsert_batches(conn):
+    # created in the transaction rolled back at the end
+    api.sql_void(conn, "create table batch_test (id serial primary key, name text)")
+    api.sql_void(conn, "insert into batch_test (name) values ('old'), ('gone')")
+
+    payload = {
+        "columns": ["id", "name"],
+        "deleted": [[2]],
+        "data": [[1, "one"]] + [[None, f"new {i}"] for i in range(4)],
+    }
+    file = io.BytesIO(rtlib.serialize(payload).encode("utf8"))
+    stream = api.InboundStream(file, required=["id", "name"], batch_rows=2)
+    with api.writeblock(conn) as w:
+        assert w.upsert_batches("batch_test", stream.batches()) == 5
+
+    select = "select id, name from batch_test order by id"
+    assert api.sql_rows(conn, select) == [
+        (1, "one"),
+        (3, "new 0"),
+        (4, "new 1"),
+        (5, "new 2"),
+        (6, "new 3"),
+    ]
+    conn.rollback()
+
+
+def test_matrix_writes(conn):
+    # created in the transaction rolled back at the end
+    api.sql_void(
+        conn,
+        """
+create table mx_base (id serial primary key, name text);
+create table mx_tag (id integer primary key);
+create table mx_base_tag (
+    base_id integer references mx_base, tag_id integer references mx_tag,
+    primary key (base_id, tag_id)
+);
+insert into mx_base (name) values ('one'), ('two'), ('three');
+insert into mx_tag values (10), (11), (12);
+insert into mx_base_tag values (1, 10), (1, 11), (2, 10), (3, 12);
+""",
+    )
+
+    table = rtlib.simple_table(["id", "name", "tags"])
+    table.rows = [
+        table.DataRow(1, "one", {"set": [11, 12]}),
+        table.DataRow(2, "two", {"add": [12], "remove": [10]}),
+        table.DataRow(3, "three", None),
+        table.DataRow(None, "four", {"set": [10]}),
+    ]
+    table.matrices = {"tags": {"scope": [10, 11, 12]}}
+    with api.writeblock(conn) as w:
+        w.upsert_rows("mx_base", table, matrix={"tags": "mx_base_tag"})
+
+    select = "select base_id, tag_id from mx_base_tag order by 1, 2"
+    assert api.sql_rows(conn, select) == [(1, 11), (1, 12), (2, 12), (3, 12), (4, 10)]
+
+    table.rows = [table.DataRow(4, "four", {"remove": [10]})]
+    table.matrices = {"tags": {}}
+    with api.writeblock(conn) as w:
+        w.upsert_rows("mx_base", table, matrix={"tags": "mx_base_tag"})
+        table.rows = [table.DataRow(4, "four", {"set": []})]
+        with pytest.raises(RuntimeError, match="scope"):
+            w.upsert_rows("mx_base", table, matrix={"tags": "mx_base_tag"})
+    assert api.sql_rows(conn, select)[-1] == (3, 12)
+    conn.rollback()
+
+
+def test_matrix_writes_bigint(conn):
+    api.sql_void(
+        conn,
+        """
+create table mxb_base (id bigserial primary key, name text);
+create table mxb_tag (id bigint primary key);
+create table mxb_base_tag (
+    base_id bigint references mxb_base, tag_id bigint references mxb_tag,
+    primary key (base_id, tag_id)
+);
+insert into mxb_base (name) values ('one'), ('two');
+insert into mxb_tag values (10), (11), (12);
+insert into mxb_base_tag values (1, 10), (2, 11);
+""",
+    )
+
+    table = rtlib.simple_table(["id", "name", "tags"])
+    table.rows = [
+        table.DataRow(1, "one", {"set": [11]}),
+        # removed and added again stays
+        table.DataRow(2, "two", {"remove": [11, 12], "add": [11, 12]}),
+    ]
+    table.matrices = {"tags": {"scope": [10, 11, 12]}}
+    with api.writeblock(conn) as w:
+        w.upsert_rows("mxb_base", table, matrix={"tags": "mxb_base_tag"})
+
+    select = "select base_id, tag_id from mxb_base_tag order by 1, 2"
+    assert api.sql_rows(conn, select) == [(1, 11), (2, 11), (2, 12)]
+    conn.rollback()
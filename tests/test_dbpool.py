@@ -0,0 +1,199 @@
+import os
+import time
+import threading
+import types
+import urllib.parse
+import pytest
+import psycopg2.errors
+from yenot.backend import dbpool
+
+
+def make_pool(**kwargs):
+    result = urllib.parse.urlsplit(os.environ["YENOT_DB_URL"])
+    params = {"dbname": result.path[1:], "host": result.hostname}
+    if result.username != None:
+        params["user"] = result.username
+    return dbpool.ConnectionPool(**kwargs, **params)
+
+
+def test_pool_bounds():
+    pool = make_pool(minconn=1, maxconn=2, timeout=0.05)
+    assert pool.stats() == {"in_use": 0, "idle": 1, "waiting": 0}
+    c1 = pool.getconn()
+    c2 = pool.getconn()
+    assert c1 is not c2
+    with pytest.raises(dbpool.PoolError, match="exhausted"):
+        pool.getconn()
+
+    # a lost connection is closed and its slot opened again
+    c1.close()
+    pool.putconn(c1)
+    c3 = pool.getconn()
+    assert not c3.closed
+    pool.putconn(c2)
+    pool.putconn(c3)
+    assert pool.stats() == {"in_use": 0, "idle": 2, "waiting": 0}
+    pool.closeall()
+    with pytest.raises(dbpool.PoolError, match="closed"):
+        pool.getconn()
+
+
+def test_pool_fifo():
+    pool = make_pool(minconn=1, maxconn=1, timeout=5)
+    held = pool.getconn()
+    served = []
+
+    def wait(name):
+        conn = pool.getconn()
+        served.append((name, time.monotonic()))
+        pool.putconn(conn)
+
+    threads = []
+    for name in range(4):
+        threads.append(threading.Thread(target=wait, args=(name,)))
+        threads[-1].start()
+        while pool.stats()["waiting"] <= name:
+            time.sleep(0.001)
+
+    released = time.monotonic()
+    pool.putconn(held)
+    for t in threads:
+        t.join()
+    assert [name for name, _ in served] == [0, 1, 2, 3]
+    assert served[0][1] - released < 0.05
+    pool.closeall()
+
+
+def test_pool_lifecycle():
+    pool = make_pool(minconn=1, maxconn=3, max_lifetime=60, max_idle=60)
+
+    # a clean connection is only rolled back
+    conn = pool.getconn()
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("set application_name to 'clean'")
+    pool.putconn(conn)
+    conn = pool.getconn()
+    assert not conn.autocommit
+    with conn.cursor() as cursor:
+        cursor.execute("select current_setting('application_name')")
+        assert cursor.fetchone()[0] == "clean"
+    conn.rollback()
+
+    # the session of a marked connection is reset when it is returned
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("set application_name to 'lifecycle'")
+        cursor.execute("listen lifecycle")
+        cursor.execute("create temporary table lifecycle (x integer)")
+    dbpool.mark_dirty(conn)
+    pool.putconn(conn)
+    conn = pool.getconn()
+    assert not conn.autocommit
+    with conn.cursor() as cursor:
+        cursor.execute("select current_setting('application_name')")
+        assert cursor.fetchone()[0] != "lifecycle"
+        cursor.execute("select count(*) from pg_listening_channels()")
+        assert cursor.fetchone()[0] == 0
+        cursor.execute("select to_regclass('pg_temp.lifecycle')")
+        assert cursor.fetchone()[0] == None
+    pool.putconn(conn)
+
+    # a connection closed by the server is replaced on checkout
+    pool.ping_idle = 0
+    conn = pool.getconn()
+    other = pool.getconn()
+    with conn.cursor() as cursor:
+        cursor.execute("select pg_backend_pid()")
+        pid = cursor.fetchone()[0]
+    pool.putconn(conn)
+    with other.cursor() as cursor:
+        cursor.execute("select pg_terminate_backend(%s)", (pid,))
+    replaced = pool.getconn()
+    with replaced.cursor() as cursor:
+        cursor.execute("select pg_backend_pid()")
+        assert cursor.fetchone()[0] != pid
+    pool.putconn(replaced)
+    pool.putconn(other)
+
+    # old connections are replaced and idle ones beyond the minimum closed
+    conns = [pool.getconn() for _ in range(3)]
+    for conn in conns:
+        pool.putconn(conn)
+    assert pool.stats()["idle"] == 3
+    pool.max_lifetime = 0
+    conn = pool.getconn()
+    assert conn not in conns
+    pool.max_lifetime = 60
+    pool.max_idle = 0
+    pool.putconn(conn)
+    assert pool.stats() == {"in_use": 0, "idle": 1, "waiting": 0}
+    pool.closeall()
+
+
+def test_replica_pools():
+    first = make_pool(minconn=0, maxconn=2, timeout=0.05)
+    second = make_pool(minconn=0, maxconn=2, timeout=0.05)
+    replicas = dbpool.ReplicaPools([first, second], retry=60)
+
+    # in turn
+    c1 = replicas.getconn()
+    c2 = replicas.getconn()
+    assert first.stats()["in_use"] == 1 and second.stats()["in_use"] == 1
+    replicas.putconn(c1)
+    replicas.putconn(c2)
+    with pytest.raises(dbpool.PoolError, match="unkeyed"):
+        replicas.putconn(c1)
+
+    # a replica which cannot connect is left out
+    down = dbpool.ConnectionPool(0, 2, 0.05, host="127.0.0.1", port=1, dbname="x")
+    replicas = dbpool.ReplicaPools([down, first], retry=60)
+    for _ in range(3):
+        conn = replicas.getconn()
+        assert conn != None
+        replicas.putconn(conn)
+    assert [s["healthy"] for s in replicas.stats()] == [False, True]
+
+    # the caller falls back to the primary without any
+    replicas = dbpool.ReplicaPools([down], retry=60)
+    assert replicas.getconn() == None
+    assert replicas.fallbacks == 1
+
+    # or without waiting in line for a busy one
+    first.timeout = 5
+    replicas = dbpool.ReplicaPools([first], retry=60)
+    held = [replicas.getconn(), replicas.getconn()]
+    started = time.monotonic()
+    assert replicas.getconn() == None
+    assert time.monotonic() - started < 1
+    assert first.exhausted == 0
+    assert replicas.stats()[0]["healthy"]
+    for conn in held:
+        replicas.putconn(conn)
+    first.closeall()
+    second.closeall()
+
+
+def test_readonly_checkout():
+    from yenot.backend import plugins
+
+    primary = make_pool(minconn=1, maxconn=2)
+    replica = make_pool(minconn=0, maxconn=2)
+    app = types.SimpleNamespace(pool=primary, replicas=None)
+
+    pool, conn = plugins._checkout(app, readonly=True)
+    assert pool is primary and conn.readonly
+    with pytest.raises(psycopg2.errors.ReadOnlySqlTransaction):
+        with conn.cursor() as cursor:
+            cursor.execute("create temporary table readonly (x integer)")
+    pool.putconn(conn)
+
+    app.replicas = dbpool.ReplicaPools([replica])
+    pool, conn = plugins._checkout(app, readonly=True)
+    assert pool is app.replicas and replica.stats()["in_use"] == 1
+    pool.putconn(conn)
+    pool, conn = plugins._checkout(app)
+    assert pool is primary and not conn.readonly
+    pool.putconn(conn)
+    primary.closeall()
+    replica.closeall()
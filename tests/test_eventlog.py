@@ -0,0 +1,58 @@
+import os
+import time
+import threading
+import yenot.backend
+from yenot.backend import eventlog
+
+
+def connect():
+    return yenot.backend.create_connection(os.environ["YENOT_DB_URL"])
+
+
+def test_batched_writes():
+    writer = eventlog.EventLogWriter(connect, flush_seconds=0.05)
+    for i in range(5):
+        assert writer.put("Yenot Test Event", f"entry {i}", {"index": i})
+    assert writer.flush(timeout=5)
+    assert (writer.written, writer.dropped, writer.failed) == (5, 0, 0)
+
+    conn = connect()
+    with conn.cursor() as cursor:
+        select = (
+            "select descr, logdata from yenotsys.eventlog where logtype=%s order by id"
+        )
+        cursor.execute(select, ["Yenot Test Event"])
+        rows = cursor.fetchall()[-5:]
+        cursor.execute(
+            "delete from yenotsys.eventlog where logtype=%s", ["Yenot Test Event"]
+        )
+    conn.commit()
+    conn.close()
+    assert [(r.descr, r.logdata["index"]) for r in rows] == [
+        (f"entry {i}", i) for i in range(5)
+    ]
+    writer.stop(timeout=5)
+    assert not writer.thread.is_alive()
+
+
+def test_overflow_and_failure():
+    release = threading.Event()
+
+    def stalled():
+        release.wait(5)
+        raise RuntimeError("database unavailable")
+
+    writer = eventlog.EventLogWriter(stalled, queue_size=2, flush_seconds=0)
+    # the first is taken by the writer which then stalls in connect
+    assert writer.put("Yenot Test Event", "first", {})
+    while not writer.queue.empty():
+        time.sleep(0.01)
+    assert writer.put("Yenot Test Event", "second", {})
+    assert writer.put("Yenot Test Event", "third", {})
+    assert not writer.put("Yenot Test Event", "dropped", {})
+    assert writer.dropped == 1
+
+    release.set()
+    assert writer.flush(timeout=5)
+    assert (writer.written, writer.failed) == (0, 3)
+    writer.stop(timeout=5)
@@ -11,3 +11,72 @@ def test_mixin():
     x = MyClass("joel", 25)
     assert x.testing() == "hi"
     assert x.age == 25
+
+
+def test_memoized():
+    before = rtlib.fixedrecord.cache_info()
+    A = rtlib.fixedrecord("Memo", ["name", "age"])
+    B = rtlib.fixedrecord("Memo", ("name", "age"))
+    assert A is B
+    assert rtlib.fixedrecord.cache_info().hits == before.hits + 1
+    assert A.__slots__ == ["name", "age"]
+
+    assert rtlib.fixedrecord("Memo", ["age", "name"]) is not A
+    assert rtlib.fixedrecord("Memo", ["name", "age"], mixin=XMixin) is not A
+    assert rtlib.fixedrecord(
+        "Memo", ["name", "age"], mixin=[XMixin]
+    ) is rtlib.fixedrecord("Memo", ["name", "age"], mixin=(XMixin,))
+
+
+def test_client_table_classes():
+    columns = [("name", {"type": "text"}), ("age", {"type": "integer"})]
+    t1 = rtlib.ClientTable(columns, [["Joel", 40]])
+    t2 = rtlib.ClientTable(columns[:1] + [("age", {"type": "numeric"})], [["Ann", 3]])
+    assert t1.DataRow.__bases__ == t2.DataRow.__bases__
+    assert t1.DataRow.model_columns["age"].type_ == "integer"
+    assert t2.DataRow.model_columns["age"].type_ == "numeric"
+    assert t1.model_columns is t1.DataRow.model_columns
+
+    # tables of the same columns share the class
+    t3 = rtlib.ClientTable(columns, [["Ann", 3]])
+    assert t3.DataRow is t1.DataRow
+
+
+def test_generated_methods():
+    Row = rtlib.fixedrecord("Row", ["a", "b", "c"])
+
+    x = Row(1, 2, 3)
+    assert x._as_tuple() == (1, 2, 3)
+    assert x._as_dict() == {"a": 1, "b": 2, "c": 3}
+
+    # unassigned slots read as None and keyword arguments are set last
+    y = Row(1, c=5, extra="e")
+    assert not hasattr(y, "b")
+    assert y._as_tuple() == (1, None, 5)
+    assert y._as_dict() == {"a": 1, "b": None, "c": 5}
+    assert y.extra == "e"
+    assert repr(y) == "Row(a=1, b=unassigned, c=5)"
+
+    assert Row(1, 2, 3, 4)._as_tuple() == (1, 2, 3)
+    assert Row(1, 2, 3, a=4)._as_tuple() == (4, 2, 3)
+
+
+class InitMixin:
+    def _rtlib_init_(self):
+        self.total = self.a + self.b
+
+    def __setattr__(self, name, value):
+        if not getattr(self, "_init_block", False) and name == "a":
+            value = value * 10
+        super().__setattr__(name, value)
+
+
+def test_generated_init_hooks():
+    columns = [("a", {"type": "integer"}), ("b", {"type": "integer"})]
+    table = rtlib.ClientTable(columns, [[1, 2]], mixin=InitMixin)
+    row = table.rows[0]
+    assert row._as_tuple() == (10, 2)
+    assert row.total == 12
+
+    candidate = table.candidate_row()
+    assert candidate._as_dict() == {"a": None, "b": None}
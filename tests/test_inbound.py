@@ -0,0 +1,95 @@
+import io
+import json
+import pytest
+import yenot.backend.misc as misc
+
+
+def stream_of(payload, batch_rows=2, **kwargs):
+    file = io.BytesIO(json.dumps(payload).encode("utf8"))
+    return misc.InboundStream(file, batch_rows=batch_rows, **kwargs)
+
+
+def test_json_members():
+    payload = {
+        "columns": ["id", "name"],
+        "deleted": [[7]],
+        "data": [[1, "one"], [22222, "two é\\"], [3, None]],
+        "tags:scope": [1, 2],
+    }
+    # a tiny read size to split values and characters across reads
+    file = io.BytesIO(json.dumps(payload, ensure_ascii=False).encode("utf8"))
+    members = list(misc._tab2_members(misc._JsonReader(file, chunk_size=7)))
+    assert members == [
+        ("columns", ["id", "name"]),
+        ("deleted", [[7]]),
+        ("data", [1, "one"]),
+        ("data", [22222, "two é\\"]),
+        ("data", [3, None]),
+        ("tags:scope", [1, 2]),
+    ]
+
+    file = io.BytesIO(b'{"columns": ["id"], "data": [[1], [2}')
+    with pytest.raises(RuntimeError):
+        list(misc._tab2_members(misc._JsonReader(file, chunk_size=7)))
+
+
+def test_json_long_members():
+    payload = {
+        "columns": ["id"],
+        "deleted": [[i] for i in range(5000)],
+        "note": "x" * 20000,
+        "data": [[1]],
+    }
+    text = json.dumps(payload).encode("utf8")
+    reader = misc._JsonReader(io.BytesIO(text), chunk_size=64)
+    decoder = reader.json
+    scanned = []
+
+    class Counting:
+        def raw_decode(self, buffer, pos):
+            scanned.append(len(buffer) - pos)
+            return decoder.raw_decode(buffer, pos)
+
+    reader.json = Counting()
+    members = dict(misc._tab2_members(reader))
+    assert members["deleted"] == payload["deleted"]
+    assert members["note"] == payload["note"]
+    # each value is parsed from the text of a few reads, not the whole
+    assert sum(scanned) < 10 * len(text)
+
+
+def test_stream_batches():
+    payload = {
+        "columns": ["id", "name"],
+        "data": [{"id": i, "name": f"row {i}"} for i in range(5)],
+    }
+    stream = stream_of(payload, required=["id"], options=["name"], amendments=["x"])
+    batches = list(stream.batches())
+    assert [len(b.rows) for b in batches] == [2, 2, 1]
+    assert batches[0].DataRow.__slots__ == ["id", "name", "x"]
+    assert batches[2].rows[0]._as_tuple() == (4, "row 4", None)
+
+    with pytest.raises(RuntimeError, match="Extra fields"):
+        stream_of(payload, required=["id"])
+    with pytest.raises(RuntimeError, match="Required fields"):
+        stream_of(payload, required=["id", "price"], allow_extra=True)
+
+
+def test_stream_matrix():
+    payload = {
+        "columns": ["id", "tags"],
+        "data": [[1, None], [2, {"add": [5]}], [3, {"set": [5]}], [4, None]],
+        "deleted": [[9]],
+        "tags:scope": [5, 6],
+    }
+    stream = stream_of(payload, batch_rows=1, required=["id", "tags"], matrix=["tags"])
+    batches = list(stream.batches())
+    # rows setting the matrix wait for the scope which follows the data
+    assert [len(b.rows) for b in batches] == [1, 1, 2]
+    assert batches[-1].matrices == {"tags": {"scope": [5, 6]}}
+    assert batches[-1].deleted_keys == [[9]]
+
+    payload["data"].append([5, {"add": [1], "set": [2]}])
+    stream = stream_of(payload, required=["id", "tags"], matrix=["tags"], name="x")
+    with pytest.raises(misc.UserError):
+        list(stream.batches())
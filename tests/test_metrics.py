@@ -0,0 +1,37 @@
+import math
+import pytest
+from yenot.backend import metrics
+
+
+def test_render():
+    registry = metrics.Registry()
+    count = registry.register(metrics.Counter("t_total", "Things", labels=("kind",)))
+    hist = registry.register(metrics.Histogram("t_seconds", "Time", buckets=(0.1, 1)))
+    registry.register(
+        metrics.Collected("t_open", "Open", lambda: [({"name": 'a"b'}, 2)], ("name",))
+    )
+
+    count.inc(kind="x")
+    count.inc(3, kind="x")
+    hist.observe(0.05)
+    hist.observe(0.5)
+    hist.observe(7)
+    with pytest.raises(ValueError):
+        count.inc(other="y")
+
+    assert registry.render().splitlines() == [
+        "# HELP t_total Things",
+        "# TYPE t_total counter",
+        't_total{kind="x"} 4',
+        "# HELP t_seconds Time",
+        "# TYPE t_seconds histogram",
+        't_seconds_bucket{le="0.1"} 1',
+        't_seconds_bucket{le="1"} 2',
+        't_seconds_bucket{le="+Inf"} 3',
+        "t_seconds_sum 7.55",
+        "t_seconds_count 3",
+        "# HELP t_open Open",
+        "# TYPE t_open gauge",
+        't_open{name="a\\"b"} 2',
+    ]
+    assert metrics._number(math.inf) == "+Inf"
@@ -0,0 +1,264 @@
+import gzip
+import zlib
+import wsgiref.util
+import wsgiref.headers
+import bottle
+import yenot.backend.plugins as plugins
+
+
+def make_app(*outer):
+    app = bottle.Bottle()
+    for plugin in outer:
+        app.install(plugin)
+    app.install(plugins.CompressResponse(min_size=100))
+
+    @app.get("/small")
+    def small():
+        return "tiny"
+
+    @app.get("/big")
+    def big():
+        return "x" * 5000
+
+    @app.get("/stream")
+    def stream():
+        bottle.response.content_type = "application/json; charset=UTF-8"
+        for i in range(50):
+            yield f"chunk {i};".encode()
+
+    return app
+
+
+def call(app, path, accept_encoding=None, environ=None):
+    environ = dict(environ or {}, PATH_INFO=path, REQUEST_METHOD="GET")
+    if accept_encoding != None:
+        environ["HTTP_ACCEPT_ENCODING"] = accept_encoding
+    wsgiref.util.setup_testing_defaults(environ)
+
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = status
+        started["headers"] = wsgiref.headers.Headers(headers)
+
+    body = b"".join(app(environ, start_response))
+    return started["status"], started["headers"], body
+
+
+def test_compress_negotiation():
+    app = make_app()
+
+    status, headers, body = call(app, "/big", "gzip, deflate")
+    assert headers["Content-Encoding"] == "gzip"
+    assert headers["Vary"] == "Accept-Encoding"
+    assert int(headers["Content-Length"]) == len(body)
+    assert gzip.decompress(body) == b"x" * 5000
+
+    status, headers, body = call(app, "/big", "gzip;q=0, deflate")
+    assert headers["Content-Encoding"] == "deflate"
+    assert zlib.decompress(body) == b"x" * 5000
+
+    status, headers, body = call(app, "/big", "br")
+    assert "Content-Encoding" not in headers
+    assert body == b"x" * 5000
+
+    status, headers, body = call(app, "/big")
+    assert "Content-Encoding" not in headers
+
+    status, headers, body = call(app, "/small", "gzip")
+    assert "Content-Encoding" not in headers
+    assert body == b"tiny"
+
+
+def test_compress_stream():
+    app = make_app()
+    expected = "".join(f"chunk {i};" for i in range(50)).encode()
+
+    status, headers, body = call(app, "/stream", "gzip")
+    assert headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in headers
+    assert gzip.decompress(body) == expected
+
+    status, headers, body = call(app, "/stream")
+    assert "Content-Encoding" not in headers
+    assert body == expected
+
+
+def test_response_cache():
+    app = bottle.Bottle()
+    user = ["user-a"]
+    app.request_user_id = lambda: user[0]
+    cache = plugins.ResponseCache(max_entries=2, max_bytes=1000)
+    app.install(cache)
+    calls = []
+
+    @app.get("/counted/<name>", cache={"ttl": 60})
+    def counted(name):
+        calls.append(name)
+        return f"{name} {len(calls)}"
+
+    @app.get("/uncached")
+    def uncached():
+        return "plain"
+
+    assert call(app, "/counted/a")[2] == b"a 1"
+    status, headers, body = call(app, "/counted/a")
+    assert (headers["X-Yenot-Cache"], body) == ("hit", b"a 1")
+    assert call(app, "/uncached")[1].get("X-Yenot-Cache") == None
+
+    # the user is part of the key
+    user[0] = "user-b"
+    assert call(app, "/counted/a")[2] == b"a 2"
+
+    # least recently used entries are evicted
+    call(app, "/counted/b")
+    assert len(cache.entries) == 2
+    user[0] = "user-a"
+    assert call(app, "/counted/a")[2] == b"a 4"
+    assert cache.size == sum(len(e.body) for e in cache.entries.values())
+
+    # invalidation drops entries listing the channel
+    key = next(iter(cache.entries))
+    cache.entries[key] = cache.entries[key]._replace(channels=("items",))
+    cache.invalidate("items")
+    assert key not in cache.entries
+    assert cache.generations["items"] == 1
+
+
+class FakeListener:
+    def __init__(self):
+        self.subscribers = []
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+
+def test_response_cache_channels():
+    cache = plugins.ResponseCache()
+    listener = FakeListener()
+    listener.subscribers.append(cache.invalidate)
+    cache.listeners["items"] = listener
+
+    # an entry and a request in progress rely on the channel
+    body = b"x"
+    cache._retain(("items",))
+    cache._store("k", plugins.CacheEntry(1e12, ("items",), body, []), [0])
+    cache._release(("items",))
+    assert listener.subscribers == [cache.invalidate]
+
+    # unsubscribed with the last entry
+    cache.clear()
+    assert listener.subscribers == []
+    assert "items" not in cache.listeners and cache.channel_users == {}
+
+
+def test_conditional_get():
+    app = bottle.Bottle()
+    app.install(plugins.CompressResponse(min_size=100))
+    app.install(plugins.ConditionalGet())
+
+    @app.get("/big")
+    def big():
+        return "x" * 5000
+
+    status, headers, body = call(app, "/big")
+    etag = headers["ETag"]
+    assert etag == plugins.body_etag(b"x" * 5000)
+
+    environ = {"HTTP_IF_NONE_MATCH": f'"other", {etag}'}
+    status, headers, body = call(app, "/big", environ=environ)
+    assert status.startswith("304") and body == b""
+    assert headers["ETag"] == etag
+
+    # the compressed representation has its own tag
+    status, headers, body = call(app, "/big", "gzip")
+    gzip_etag = headers["ETag"]
+    assert gzip_etag == etag[:-1] + '-gzip"'
+    environ = {"HTTP_IF_NONE_MATCH": gzip_etag}
+    status, headers, body = call(app, "/big", "gzip", environ=environ)
+    assert status.startswith("304") and body == b""
+    assert headers["ETag"] == gzip_etag
+    assert "Content-Encoding" not in headers
+
+    environ = {"HTTP_IF_NONE_MATCH": '"stale"'}
+    status, headers, body = call(app, "/big", environ=environ)
+    assert status.startswith("200") and body == b"x" * 5000
+
+
+def test_conditional_get_version():
+    app = bottle.Bottle()
+    app.install(plugins.ConditionalGet())
+    version = [1]
+    calls = []
+
+    @app.get("/items/<name>", etag=lambda name: version[0])
+    def items(name):
+        calls.append(name)
+        return f"{name} {version[0]}"
+
+    status, headers, body = call(app, "/items/a")
+    etag = headers["ETag"]
+    assert body == b"a 1" and etag != plugins.body_etag(body)
+    assert call(app, "/items/b")[1]["ETag"] != etag
+
+    # answered before the route runs
+    environ = {"HTTP_IF_NONE_MATCH": etag}
+    status, headers, body = call(app, "/items/a", environ=environ)
+    assert status.startswith("304") and body == b""
+    assert calls == ["a", "b"]
+
+    # a new version or format is another representation
+    environ["HTTP_X_YENOT_FORMAT"] = "compact"
+    assert call(app, "/items/a", environ=environ)[0].startswith("200")
+    del environ["HTTP_X_YENOT_FORMAT"]
+    version[0] = 2
+    status, headers, body = call(app, "/items/a", environ=environ)
+    assert status.startswith("200") and body == b"a 2"
+
+    # without a version the body is hashed
+    version[0] = None
+    assert call(app, "/items/a")[1]["ETag"] == plugins.body_etag(b"a None")
+
+
+def test_route_readonly():
+    app = bottle.Bottle()
+    seen = []
+
+    def authorize(callback):
+        # as an authentication plugin around the route
+        def wrapper(*args, **kwargs):
+            seen.append(("plugin", plugins._route_readonly()))
+            return callback(*args, **kwargs)
+
+        return wrapper
+
+    app.install(authorize)
+    app.install(plugins.ArgumentShim())
+
+    @app.get("/read", readonly=True)
+    def read():
+        seen.append(("route", plugins._route_readonly()))
+        return "ok"
+
+    call(app, "/read")
+    assert seen == [("plugin", False), ("route", True)]
+
+    replicas = plugins.create_replicas(["postgresql://replica.invalid/db"])
+    assert replicas.pools[0]._kwargs["connect_timeout"] > 0
+
+
+def test_request_metrics():
+    app = make_app(plugins.RequestMetrics())
+    before = dict(plugins.metrics.RESPONSE_BYTES.values)
+
+    call(app, "/big", "gzip")
+    call(app, "/stream")
+    sent = plugins.metrics.RESPONSE_BYTES.values
+    assert sent[("/big",)] - before.get(("/big",), 0) < 5000
+    expected = len("".join(f"chunk {i};" for i in range(50)))
+    assert sent[("/stream",)] - before.get(("/stream",), 0) == expected
+
+    text = plugins.metrics.render()
+    assert (
+        'yenot_request_seconds_count{route="/stream",method="GET",status="200"}' in text
+    )
@@ -0,0 +1,50 @@
+import json
+import datetime
+import decimal
+import bottle
+import rtlib
+import yenot.backend.api as api
+
+
+def sample_results():
+    results = api.Results()
+    results.key_labels += "Sample"
+    results.keys["scalar"] = 23
+    columns = [("id", {"type": "integer"}), ("name", {}), ("when", {"type": "date"})]
+    rows = [(i, f"name {i}", datetime.date(2020, 1, 1 + i % 28)) for i in range(2500)]
+    results.tables["data", True] = columns, rows
+    results.tables["extra"] = [("amount", None)], [(decimal.Decimal("1.25"),)]
+    return results
+
+
+def test_json_stream_matches():
+    bottle.response.bind()
+    whole = rtlib.serialize(sample_results().plain_old_python()).encode("utf-8")
+    assert sample_results().json_out() == whole
+    chunks = list(sample_results().json_out(stream=True))
+    assert len(chunks) > 3
+    assert b"".join(chunks) == whole
+
+
+def test_json_stream_empty():
+    bottle.response.bind()
+    assert b"".join(api.Results().json_out(stream=True)) == api.Results().json_out()
+
+    results = api.Results()
+    results.tables["empty", True] = [("id", None)], []
+    whole = results.json_out()
+    results = api.Results()
+    results.tables["empty", True] = [("id", None)], []
+    assert b"".join(results.json_out(stream=True)) == whole
+
+
+def test_json_compact():
+    bottle.response.bind()
+    whole = sample_results().json_out(compact=True)
+    pyobj = sample_results().plain_old_python(compact=True)
+    assert rtlib.serialize(pyobj).encode("utf-8") == whole
+    assert b"".join(sample_results().json_out(stream=True, compact=True)) == whole
+    assert bottle.response.get_header("X-Yenot-Format") == "compact"
+
+    payload = json.loads(whole)
+    assert payload["data"]["data"][0] == [0, "name 0", "2020-01-01"]
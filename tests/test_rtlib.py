@@ -28,3 +28,10 @@ def test_rttable():
     t2 = table.as_tab2()
     assert len(t2[0]) == 2  # 2 columns
     assert len(t2[1]) == 1  # 1 row
+
+
+def test_client_table_row_formats():
+    columns = [("name", None), ("age", {"type": "integer"})]
+    keyed = rtlib.ClientTable(columns, [{"age": 40, "name": "Joel"}])
+    compact = rtlib.ClientTable(columns, [["Joel", 40]])
+    assert keyed.rows[0]._as_tuple() == compact.rows[0]._as_tuple() == ("Joel", 40)
@@ -0,0 +1,109 @@
+import json
+import datetime
+import decimal
+import pytest
+import rtlib
+
+
+@pytest.fixture(params=["json", "orjson"], autouse=True)
+def backend(request):
+    previous = rtlib.json_backend()
+    try:
+        yield rtlib.set_json_backend(request.param)
+    except ImportError:
+        pytest.skip(f"{request.param} not installed")
+    finally:
+        rtlib.set_json_backend(previous.name)
+
+
+COLUMNS = [
+    ("id", {"type": "integer"}),
+    ("amount", {"type": "numeric"}),
+    ("day", {"type": "date"}),
+    ("stamp", {"type": "datetime"}),
+    ("flag", {"type": "boolean"}),
+    ("name", {"max_length": 20}),
+    ("extra", None),
+]
+
+ROWS = [
+    (
+        1,
+        decimal.Decimal("12.50"),
+        datetime.date(2020, 2, 29),
+        datetime.datetime(2020, 1, 1, 12, 30, 5, 123),
+        True,
+        'café "quoted"\n',
+        {"nested": [1, 2]},
+    ),
+    (None, None, None, None, None, None, None),
+    # values not matching the declared column types
+    (True, 3, "2020-01-01", datetime.time(8, 15), 0, 7, [decimal.Decimal("1.5")]),
+    (2**70, float("nan"), datetime.datetime(2020, 1, 1), None, False, "", 1.5),
+]
+
+
+def test_row_encoder_matches_serialize():
+    names = [c for c, _ in COLUMNS]
+    encode = rtlib.row_encoder(COLUMNS)
+    compact = rtlib.row_encoder(COLUMNS, compact=True)
+    for row in ROWS:
+        assert encode(row) == rtlib.serialize(dict(zip(names, row)))
+        assert compact(row) == rtlib.serialize(list(row))
+
+    encode_rows = rtlib.rows_encoder(COLUMNS)
+    data = [dict(zip(names, row)) for row in ROWS]
+    assert b"[" + encode_rows(ROWS) + b"]" == rtlib.serialize_bytes(data)
+
+
+def test_row_encoder_odd_shapes():
+    columns = [("a", {"type": "integer"}), ("b", None), ("a", {"type": "date"})]
+    encode = rtlib.row_encoder(columns)
+    row = (1, "x", datetime.date(2021, 5, 6))
+    assert encode(row) == rtlib.serialize(dict(zip(["a", "b", "a"], row)))
+    # short rows are encoded as zip would pair them
+    assert encode((1,)) == rtlib.serialize({"a": 1})
+    assert rtlib.row_encoder([])(()) == "{}"
+
+
+def test_backends_agree():
+    names = [c for c, _ in COLUMNS]
+    data = [dict(zip(names, row)) for row in ROWS[:3]]
+    text = rtlib.serialize(data)
+    assert rtlib.deserialize(text) == json.loads(
+        json.dumps(data, cls=rtlib.DateTimeEncoder)
+    )
+    # dates and decimals are rendered by the same conversions
+    for fragment in [
+        '"2020-01-01T12:30:05.000123"',
+        '"2020-02-29"',
+        "12.5",
+        '"08:15:00"',
+    ]:
+        assert fragment in text
+
+
+def test_non_finite_numbers(backend):
+    data = {"a": float("nan"), "b": [float("inf"), decimal.Decimal("-Infinity")]}
+    if backend.name == "json":
+        # as json.dumps has always written them
+        assert rtlib.serialize(data) == json.dumps(data, cls=rtlib.DateTimeEncoder)
+    else:
+        assert json.loads(rtlib.serialize(data)) == {"a": None, "b": [None, None]}
+        # the same from the fallback for values orjson refuses
+        data["c"] = 2**70
+        assert rtlib.serialize(data) == '{"a":null,"b":[null,null],"c":%d}' % 2**70
+
+
+def test_fallback_bytes(backend):
+    # a value orjson refuses does not change the separators or escapes
+    data = {"a": [1, "é"], "b": 2**70}
+    if backend.name == "orjson":
+        assert rtlib.serialize(data) == '{"a":[1,"é"],"b":%d}' % 2**70
+    else:
+        assert rtlib.serialize(data) == json.dumps(data)
+
+
+def test_default_backend(monkeypatch):
+    monkeypatch.delenv("RTLIB_JSON_BACKEND", raising=False)
+    assert rtlib.set_json_backend().name == "json"
@@ -1,5 +1,6 @@
 import os
 import datetime
+import itertools
 import pytz
 from bottle import request, response, static_file
 import rtlib
@@ -7,17 +8,24 @@ from . import sqlread
 from . import sqlwrite
 from . import sqllisten
 from . import misc
+from . import metrics
+from . import dbpool
 
 # expose api.static_file from import above
 
 sql_tab2 = sqlread.sql_tab2
+sql_tab2_stream = sqlread.sql_tab2_stream
 sql_1row = sqlread.sql_1row
 sql_1object = sqlread.sql_1object
 sql_rows = sqlread.sql_rows
 sql_void = sqlread.sql_void
+named_rows = sqlread.named_rows
 writeblock = sqlwrite.writeblock
+flush_table_metadata = sqlwrite.flush_table_metadata
+mark_session_dirty = dbpool.mark_dirty
 table_from_tab2 = misc.table_from_tab2
 InboundTable = misc.InboundTable
+InboundStream = misc.InboundStream
 
 UserError = misc.UserError
 UnauthorizedError = misc.UnauthorizedError
@@ -41,6 +49,15 @@ poll_listener = sqllisten.poll_listener
 notify_listener = sqllisten.notify_listener
 
 
+def metrics_out():
+    """
+    Set the bottle response content type and return the server metrics in
+    the Prometheus text format (see :mod:`yenot.backend.metrics`).
+    """
+    response.content_type = metrics.CONTENT_TYPE
+    return metrics.render()
+
+
 def get_global_app():
     from . import plugins
 
@@ -58,6 +75,32 @@ def get_request_today():
     return datetime.datetime.now(get_request_timezone()).date()
 
 
+# media type requesting positional (array) rows in tab2 data
+COMPACT_MEDIA_TYPE = "application/vnd.yenot.compact+json"
+
+
+def get_request_compact():
+    """
+    Return True if the client asked for the compact table format -- data rows
+    as positional arrays rather than objects -- with either the
+    X-Yenot-Format header or the Accept header.
+    """
+    if request.headers.get("X-Yenot-Format", "").lower() == "compact":
+        return True
+    return COMPACT_MEDIA_TYPE in request.headers.get("Accept", "")
+
+
+def sql_tab2_json(conn, stmt, mogrify_params=None, column_map=None, compact=None):
+    """
+    Return a table with the rows aggregated to JSON by PostgreSQL (see
+    :func:`sqlread.sql_tab2_json`) in the row format the client requested
+    unless compact is given.
+    """
+    if compact == None:
+        compact = get_request_compact()
+    return sqlread.sql_tab2_json(conn, stmt, mogrify_params, column_map, compact)
+
+
 app_init_functions = []
 data_init_functions = []
 
@@ -138,9 +181,24 @@ class Results:
 
     def finalize(self):
         if "summary" not in self.keys and self._main_name != None:
-            self.keys["summary"] = f"{len(self._t[self._main_name][1]):,} rows"
-
-    def plain_old_python(self):
+            rows = self._t[self._main_name][1]
+            # a streamed table does not know its length up front
+            if hasattr(rows, "__len__"):
+                self.keys["summary"] = f"{len(rows):,} rows"
+
+    def _check_url_keys(self):
+        for tname, tab2 in self._t.items():
+            columns = tab2[0]
+            collist = [x[0] for x in columns]
+            for attr, meta in columns:
+                url_key = meta.get("url_key", None) if meta else None
+                if url_key and url_key not in collist:
+                    print(
+                        f"unknown {url_key} found in url_key of column {attr} in table {tname}",
+                        flush=True,
+                    )
+
+    def plain_old_python(self, compact=False):
         self.finalize()
 
         assert (
@@ -150,16 +208,7 @@ class Results:
         tables = self._t.copy()
 
         if os.environ.get("YENOT_DEBUG"):
-            for tname, tab2 in tables.items():
-                columns = tab2[0]
-                collist = [x[0] for x in columns]
-                for attr, meta in columns:
-                    url_key = meta.get("url_key", None) if meta else None
-                    if url_key and url_key not in collist:
-                        print(
-                            f"unknown {url_key} found in url_key of column {attr} in table {tname}",
-                            flush=True,
-                        )
+            self._check_url_keys()
 
         def dictify(columns, row):
             # The ordered list of columns has dict keys
@@ -167,10 +216,11 @@ class Results:
 
         keys = self.keys.copy()
         for tname, tab2 in tables.items():
-            keys[tname] = {
-                "columns": tab2[0],
-                "data": [dictify(tab2[0], row) for row in tab2[1]],
-            }
+            if compact:
+                data = list(tab2[1])
+            else:
+                data = [dictify(tab2[0], row) for row in tab2[1]]
+            keys[tname] = {"columns": tab2[0], "data": data}
         if self._main_name:
             keys["__main_table__"] = self._main_name
         return keys
@@ -178,7 +228,79 @@ class Results:
     def set_cookie(self, cookie, value, **kwargs):
         self.cookies.append((cookie, value, kwargs.copy()))
 
-    def json_out(self):
+    # rows per chunk when streaming a table which is not a RowStream
+    STREAM_BATCH = 1000
+
+    def _row_batches(self, rows):
+        if hasattr(rows, "batches"):
+            yield from rows.batches()
+            return
+
+        rows = iter(rows)
+        while True:
+            batch = list(itertools.islice(rows, self.STREAM_BATCH))
+            if len(batch) == 0:
+                break
+            yield batch
+
+    def json_chunks(self, compact=False):
+        """
+        Generate the Yenot JSON of :meth:`plain_old_python` as a sequence of
+        utf-8 encoded chunks.  The keys are written first and then each table
+        with its columns and its data in row batches.  The rows are encoded by
+        :func:`rtlib.rows_encoder` compiled for the table's column types; the
+        concatenated chunks equal serializing :meth:`plain_old_python`.  The
+        JSON array of a table from :func:`sql_tab2_json` is written verbatim.
+        """
+        self.finalize()
+
+        assert (
+            len(set(self.keys).intersection(set(self._t))) == 0
+        ), "table names & key names cannot overlap"
+
+        if os.environ.get("YENOT_DEBUG"):
+            self._check_url_keys()
+
+        # Each fragment is serialized as a single member object and the
+        # braces are sliced off to guarantee the exact formatting of the
+        # JSON backend.
+        def member(key, value):
+            return rtlib.serialize_bytes({key: value})[1:-1]
+
+        comma = rtlib.json_backend().separator.encode("utf-8")
+
+        yield b"{"
+        sep = b""
+        for key, value in self.keys.items():
+            yield sep + member(key, value)
+            sep = comma
+        for tname, (columns, rows) in self._t.items():
+            # strip the trailing ']}' to leave the data array open
+            head = sep + member(tname, {"columns": columns, "data": []})[:-2]
+            sep = comma
+
+            if isinstance(rows, sqlread.JsonRows) and rows.compact == compact:
+                # PostgreSQL built the array; splice it in verbatim
+                yield head[:-1]
+                yield rows.payload
+                yield b"}"
+                metrics.ROWS_SERIALIZED.inc(rows.count)
+                continue
+
+            yield head
+            encode_rows = rtlib.rows_encoder(columns, compact=compact)
+            rowsep = b""
+            for batch in self._row_batches(rows):
+                if len(batch) > 0:
+                    metrics.ROWS_SERIALIZED.inc(len(batch))
+                    yield rowsep + encode_rows(batch)
+                    rowsep = comma
+            yield b"]}"
+        if self._main_name:
+            yield sep + member("__main_table__", self._main_name)
+        yield b"}"
+
+    def json_out(self, stream=False, compact=None):
         """
         Set the bottle response header content type and flatten the values in
         this object to the Yenot JSON format.  Typically this is used as the
@@ -188,12 +310,41 @@ class Results:
 
             results = api.Results()
             return results.json_out()
+
+        With stream=True the return value is a generator of byte chunks (see
+        :meth:`json_chunks`) which bottle sends as they are produced.  A table
+        from :func:`sql_tab2_stream` needs its connection until the last
+        chunk, so such an end-point returns a generator holding the connection:
+
+        .. code-block:: python
+
+            def stream():
+                results = api.Results()
+                with app.dbconn() as conn:
+                    results.tables["big", True] = api.sql_tab2_stream(conn, select)
+                    yield from results.json_out(stream=True)
+
+            return stream()
+
+        Bottle pulls the first chunk before sending the headers, so the
+        headers set here are still effective from inside the generator.
+
+        The data rows are objects keyed by column name unless compact is True
+        (by default when the client requested it, see
+        :func:`get_request_compact`) in which case they are positional arrays.
         """
+        if compact == None:
+            compact = get_request_compact()
+
         response.content_type = "application/json; charset=UTF-8"
+        if compact:
+            response.set_header("X-Yenot-Format", "compact")
         for cookie, value, kwargs in self.cookies:
             response.set_cookie(cookie, value, **kwargs)
-        pyobj = self.plain_old_python()
-        return rtlib.serialize(pyobj).encode("utf-8")
+        chunks = self.json_chunks(compact=compact)
+        if stream:
+            return chunks
+        return b"".join(chunks)
 
 
 class ColumnGenerator:
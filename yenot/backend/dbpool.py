@@ -0,0 +1,376 @@
+import os
+import time
+import threading
+import collections
+import weakref
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+
+# connections opened at start and most open at once
+POOL_MIN = int(os.environ.get("YENOT_POOL_MIN", 3))
+POOL_MAX = int(os.environ.get("YENOT_POOL_MAX", 6))
+# seconds getconn waits for a connection before raising PoolError
+POOL_TIMEOUT = float(os.environ.get("YENOT_POOL_TIMEOUT", 5))
+# seconds a connection is used before it is replaced
+POOL_MAX_LIFETIME = float(os.environ.get("YENOT_POOL_MAX_LIFETIME", 3600))
+# seconds a connection beyond the minimum may sit idle before it is closed
+POOL_MAX_IDLE = float(os.environ.get("YENOT_POOL_MAX_IDLE", 600))
+# seconds idle after which a connection is pinged before it is handed out
+POOL_PING_IDLE = float(os.environ.get("YENOT_POOL_PING_IDLE", 30))
+
+# seconds a replica which failed to connect is left out of the rotation
+REPLICA_RETRY = float(os.environ.get("YENOT_REPLICA_RETRY", 30))
+# seconds a connection to a replica may take (libpq connect_timeout)
+REPLICA_CONNECT_TIMEOUT = int(os.environ.get("YENOT_REPLICA_CONNECT_TIMEOUT", 2))
+
+# session state left by a request which the next one should not see; the
+# prepared statements (see sqlprepare) are kept
+RESET_SESSION = "reset all; unlisten *; discard temp"
+
+# connections with session state to reset when returned; see mark_dirty
+_dirty = weakref.WeakSet()
+
+
+def mark_dirty(conn):
+    """
+    Note that the session of conn has state which outlives its transaction --
+    settings changed by SET outside a transaction block or committed, LISTEN
+    channels or temporary objects -- so that the pool resets the session
+    when conn is returned.  Other connections are only rolled back.
+    """
+    _dirty.add(conn)
+
+
+class _Waiter:
+    def __init__(self, lock):
+        self.condition = threading.Condition(lock)
+        self.conn = None
+        # granted the right to open a connection of its own
+        self.open = False
+
+
+class ConnectionPool:
+    """
+    A thread safe pool of up to `maxconn` psycopg2 connections (`minconn`
+    opened at the start).  When all are in use, :meth:`getconn` waits in
+    line; :meth:`putconn` hands the connection to the longest waiting thread
+    directly so that waiters are served first come, first served and
+    without delay.  A wait longer than `timeout` seconds raises PoolError
+    "connection pool exhausted" as did psycopg2's pools.
+
+    Connections are looked after through their life:
+
+    * a connection idle for `ping_idle` seconds is pinged before it is
+      handed out and replaced if the ping fails (e.g. after a server
+      restart),
+    * a connection older than `max_lifetime` seconds is replaced,
+    * connections beyond `minconn` idle for `max_idle` seconds are closed,
+    * a returned connection is rolled back, its isolation level, read-only
+      & autocommit restored and, if marked with :func:`mark_dirty`, its
+      session reset (settings, LISTEN channels & temporary tables).
+    """
+
+    def __init__(
+        self,
+        minconn=None,
+        maxconn=None,
+        timeout=None,
+        max_lifetime=None,
+        max_idle=None,
+        ping_idle=None,
+        **kwargs,
+    ):
+        self.minconn = POOL_MIN if minconn == None else minconn
+        self.maxconn = max(1, POOL_MAX if maxconn == None else maxconn)
+        self.timeout = POOL_TIMEOUT if timeout == None else timeout
+        self.max_lifetime = POOL_MAX_LIFETIME if max_lifetime == None else max_lifetime
+        self.max_idle = POOL_MAX_IDLE if max_idle == None else max_idle
+        self.ping_idle = POOL_PING_IDLE if ping_idle == None else ping_idle
+        self.closed = False
+        # waits ended by the timeout
+        self.exhausted = 0
+
+        self._kwargs = kwargs
+        self._lock = threading.Lock()
+        # (connection, idle since) with the most recently returned last
+        self._idle = collections.deque()
+        self._used = {}
+        self._born = {}
+        self._opening = 0
+        self._waiters = collections.deque()
+
+        for _ in range(min(self.minconn, self.maxconn)):
+            conn = self._connect()
+            self._born[id(conn)] = time.monotonic()
+            self._idle.append((conn, time.monotonic()))
+
+    def _connect(self):
+        return psycopg2.connect(**self._kwargs)
+
+    def _size(self):
+        return len(self._idle) + len(self._used) + self._opening
+
+    def getconn(self, timeout=None):
+        """
+        Return a connection, waiting up to timeout seconds (the pool timeout
+        by default) for one to be returned if all are in use.
+        """
+        timeout = self.timeout if timeout == None else timeout
+        with self._lock:
+            if self.closed:
+                raise PoolError("connection pool is closed")
+            stale = self._reap()
+            since = None
+            if self._idle and not self._waiters:
+                conn, since = self._idle.pop()
+                self._used[id(conn)] = conn
+            elif not self._waiters and self._size() < self.maxconn:
+                self._opening += 1
+                conn = None
+            else:
+                conn = None
+                try:
+                    conn = self._wait(timeout)
+                finally:
+                    _close_quietly(stale)
+                    stale = []
+
+        _close_quietly(stale)
+        if conn == None:
+            return self._open()
+        if self._usable(conn, since):
+            return conn
+
+        # replace it in the same slot
+        with self._lock:
+            del self._used[id(conn)]
+            self._born.pop(id(conn), None)
+            self._opening += 1
+        _close_quietly([conn])
+        return self._open()
+
+    def _wait(self, timeout):
+        # called with the lock held; returns the connection handed over or
+        # None when granted a slot to open one (counted in _opening)
+        waiter = _Waiter(self._lock)
+        self._waiters.append(waiter)
+        deadline = time.monotonic() + timeout
+        while waiter.conn == None and not waiter.open:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self.closed:
+                self._waiters.remove(waiter)
+                if self.closed:
+                    raise PoolError("connection pool is closed")
+                if timeout > 0:
+                    # not counting a probe with getconn(timeout=0)
+                    self.exhausted += 1
+                raise PoolError("connection pool exhausted")
+            waiter.condition.wait(remaining)
+        return waiter.conn
+
+    def _open(self):
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._lock:
+                self._opening -= 1
+                self._grant()
+            raise
+        with self._lock:
+            self._opening -= 1
+            self._used[id(conn)] = conn
+            self._born[id(conn)] = time.monotonic()
+        return conn
+
+    def _expired(self, conn):
+        born = self._born.get(id(conn), time.monotonic())
+        return time.monotonic() - born > self.max_lifetime
+
+    def _usable(self, conn, since):
+        # validate a connection taken from the idle list
+        if conn.closed or self._expired(conn):
+            return False
+        status = conn.info.transaction_status
+        if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if since != None and time.monotonic() - since >= self.ping_idle:
+            try:
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute("select 1")
+                conn.autocommit = False
+            except psycopg2.Error:
+                return False
+        return True
+
+    def _reset(self, conn):
+        # return the session of conn to its defaults; False if it is unusable
+        try:
+            status = conn.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                # server connection lost
+                return False
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                # connection in error or in transaction
+                conn.rollback()
+            if conn in _dirty:
+                _dirty.discard(conn)
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(RESET_SESSION)
+            # these only take effect with the next transaction; no round trip
+            conn.set_session(
+                isolation_level="DEFAULT",
+                readonly="DEFAULT",
+                deferrable="DEFAULT",
+                autocommit=False,
+            )
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _grant(self):
+        # called with the lock held when a connection slot is free
+        if self._waiters and self._size() < self.maxconn:
+            waiter = self._waiters.popleft()
+            waiter.open = True
+            self._opening += 1
+            waiter.condition.notify()
+
+    def _reap(self):
+        # called with the lock held; returns idle connections to be closed
+        stale = []
+        cutoff = time.monotonic() - self.max_idle
+        while len(self._idle) > self.minconn and self._idle[0][1] < cutoff:
+            conn, _ = self._idle.popleft()
+            self._born.pop(id(conn), None)
+            stale.append(conn)
+        return stale
+
+    def putconn(self, conn, close=False):
+        """
+        Return conn to the pool (or close it) and serve the first waiter.
+        """
+        if not close and not conn.closed and not self.closed:
+            close = self._expired(conn) or not self._reset(conn)
+
+        with self._lock:
+            if self._used.pop(id(conn), None) is None:
+                raise PoolError("trying to put unkeyed connection")
+            if self.closed or close or conn.closed:
+                self._born.pop(id(conn), None)
+                stale = [conn]
+                self._grant()
+            elif self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.conn = conn
+                self._used[id(conn)] = conn
+                waiter.condition.notify()
+                stale = self._reap()
+            else:
+                self._idle.append((conn, time.monotonic()))
+                stale = self._reap()
+        _close_quietly(stale)
+
+    def closeall(self):
+        with self._lock:
+            if self.closed:
+                raise PoolError("connection pool is closed")
+            self.closed = True
+            idle = [conn for conn, _ in self._idle]
+            _close_quietly(idle + list(self._used.values()))
+            self._idle.clear()
+            self._born.clear()
+            for waiter in self._waiters:
+                waiter.condition.notify()
+
+    def stats(self):
+        """
+        Return the counts of connections in use and idle and of waiters.
+        """
+        with self._lock:
+            return {
+                "in_use": len(self._used),
+                "idle": len(self._idle),
+                "waiting": len(self._waiters),
+            }
+
+
+class ReplicaPools:
+    """
+    Connection pools of read replicas checked out in turn.  A replica is
+    only used when it has a connection at hand -- there is no waiting in
+    line for a busy replica -- and a replica which fails to connect is left
+    out of the rotation for `retry` seconds.  :meth:`getconn` returns None
+    when no replica is available and the caller falls back to the primary.
+    """
+
+    def __init__(self, pools, retry=None):
+        self.pools = list(pools)
+        self.retry = REPLICA_RETRY if retry == None else retry
+        # checkouts which found no replica available
+        self.fallbacks = 0
+
+        self._lock = threading.Lock()
+        self._next = 0
+        self._down_until = [0.0] * len(self.pools)
+        self._owner = {}
+
+    def _candidates(self):
+        with self._lock:
+            now = time.monotonic()
+            count = len(self.pools)
+            order = [(self._next + i) % count for i in range(count)]
+            self._next = (self._next + 1) % max(1, count)
+            return [i for i in order if self._down_until[i] <= now]
+
+    def getconn(self):
+        for index in self._candidates():
+            pool = self.pools[index]
+            try:
+                conn = pool.getconn(timeout=0)
+            except psycopg2.OperationalError:
+                with self._lock:
+                    self._down_until[index] = time.monotonic() + self.retry
+                continue
+            except PoolError:
+                # busy
+                continue
+            with self._lock:
+                self._owner[id(conn)] = pool
+            return conn
+
+        with self._lock:
+            self.fallbacks += 1
+        return None
+
+    def putconn(self, conn, close=False):
+        with self._lock:
+            pool = self._owner.pop(id(conn), None)
+        if pool == None:
+            raise PoolError("trying to put unkeyed connection")
+        pool.putconn(conn, close)
+
+    def closeall(self):
+        for pool in self.pools:
+            if not pool.closed:
+                pool.closeall()
+
+    def stats(self):
+        """
+        Return the :meth:`ConnectionPool.stats` of each replica with whether
+        it is in the rotation.
+        """
+        with self._lock:
+            now = time.monotonic()
+            healthy = [until <= now for until in self._down_until]
+        return [dict(pool.stats(), healthy=h) for pool, h in zip(self.pools, healthy)]
+
+
+def _close_quietly(connections):
+    for conn in connections:
+        try:
+            conn.close()
+        except Exception:
+            pass
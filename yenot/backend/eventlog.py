@@ -0,0 +1,147 @@
+import os
+import sys
+import queue
+import time
+import datetime
+import threading
+import psycopg2.extras as extras
+import rtlib
+
+# entries waiting to be written; more are dropped (and counted)
+QUEUE_SIZE = int(os.environ.get("YENOT_EVENTLOG_QUEUE_SIZE", 1000))
+# seconds an entry may wait for others to be written with it
+FLUSH_SECONDS = float(os.environ.get("YENOT_EVENTLOG_FLUSH_SECONDS", 1.0))
+# most entries in one insert
+BATCH_SIZE = 100
+
+INSERT_EVENTS = """
+insert into yenotsys.eventlog (logtype, logtime, descr, logdata)
+values %s"""
+
+
+class EventLogWriter:
+    """
+    Write yenotsys.eventlog entries from a background thread on a connection
+    of its own so that reporting an error never waits for the database or
+    the connection pool.  Entries are queued by :meth:`put` and inserted in
+    batches of those arriving within `flush_seconds`.  When the queue is full
+    the entry is dropped and counted in `dropped`.
+    """
+
+    def __init__(self, connect, queue_size=None, flush_seconds=None):
+        self.connect = connect
+        self.flush_seconds = FLUSH_SECONDS if flush_seconds == None else flush_seconds
+        self.queue = queue.Queue(QUEUE_SIZE if queue_size == None else queue_size)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.conn = None
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def put(self, ltype, ldescr, ldata):
+        """
+        Queue an entry time-stamped now; return False if it was dropped.
+        """
+        self._start()
+        now = datetime.datetime.now(datetime.timezone.utc)
+        try:
+            self.queue.put_nowait((ltype, now, ldescr, ldata))
+            return True
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return False
+
+    def flush(self, timeout=None):
+        """
+        Wait (up to timeout seconds) for the entries queued so far to be
+        written.  Return True if they were.
+        """
+        if self.thread == None:
+            return True
+        done = threading.Event()
+        try:
+            self.queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def stop(self, timeout=None):
+        """
+        Write the queued entries and stop the writer thread.
+        """
+        if self.thread == None:
+            return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self.thread.join(timeout)
+
+    def _start(self):
+        with self.lock:
+            if self.thread == None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self._run, name="yenot-eventlog", daemon=True
+                )
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            entries = []
+            markers = []
+            item = self.queue.get()
+            deadline = time.monotonic() + self.flush_seconds
+            while True:
+                if item == None or isinstance(item, threading.Event):
+                    markers.append(item)
+                    break
+                entries.append(item)
+                remaining = deadline - time.monotonic()
+                if len(entries) >= BATCH_SIZE or remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if entries:
+                self._write(entries)
+            for marker in markers:
+                if marker == None:
+                    self._close()
+                    return
+                marker.set()
+
+    def _write(self, entries):
+        rows = [
+            (ltype, logtime, ldescr, extras.Json(ldata, dumps=rtlib.serialize))
+            for ltype, logtime, ldescr, ldata in entries
+        ]
+        try:
+            if self.conn == None:
+                self.conn = self.connect()
+            with self.conn.cursor() as cursor:
+                extras.execute_values(cursor, INSERT_EVENTS, rows, page_size=BATCH_SIZE)
+            self.conn.commit()
+            with self.lock:
+                self.written += len(entries)
+        except Exception as e:
+            print(
+                f"Event log entries lost ({len(entries)}): {str(e)}",
+                file=sys.stderr,
+                flush=True,
+            )
+            with self.lock:
+                self.failed += len(entries)
+            # reconnect for the next batch
+            self._close()
+
+    def _close(self):
+        if self.conn != None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
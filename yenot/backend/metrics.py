@@ -0,0 +1,195 @@
+import math
+import threading
+
+# upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    value = str(value)
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _sample(name, labels, value):
+    if labels:
+        inner = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+        return f"{name}{{{inner}}} {_number(value)}"
+    return f"{name} {_number(value)}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes the labels {self.labels}")
+        return tuple(labels[k] for k in self.labels)
+
+    def samples(self):
+        raise NotImplementedError()
+
+    def render(self):
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for name, labels, value in self.samples():
+            yield _sample(name, labels, value)
+
+
+class Counter(_Metric):
+    """
+    A count which only goes up, by label values.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, doc, labels=()):
+        super().__init__(name, doc, labels)
+        if not self.labels:
+            self.values[()] = 0
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = list(self.values.items())
+        for key, value in values:
+            yield self.name, list(zip(self.labels, key)), value
+
+
+class Histogram(_Metric):
+    """
+    Observations counted in cumulative buckets with their sum and count, by
+    label values.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        if not self.labels:
+            self.values[()] = [0] * len(self.buckets) + [0.0]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts == None:
+                # a count per bucket then the sum
+                counts = self.values[key] = [0] * len(self.buckets) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            counts[-1] += value
+
+    def samples(self):
+        with self.lock:
+            values = [(key, counts[:]) for key, counts in self.values.items()]
+        for key, counts in values:
+            labels = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f"{self.name}_bucket", labels + [
+                    ("le", _number(bound))
+                ], cumulative
+            yield f"{self.name}_sum", labels, counts[-1]
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Collected(_Metric):
+    """
+    Values read when the metrics are rendered (a gauge or a counter kept
+    elsewhere); `collect` returns a list of (labels dict, value) pairs.
+    """
+
+    def __init__(self, name, doc, collect, labels=(), kind="gauge"):
+        super().__init__(name, doc, labels)
+        self.collect = collect
+        self.kind = kind
+
+    def samples(self):
+        for labels, value in self.collect():
+            yield self.name, [(k, labels[k]) for k in self.labels], value
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def register(self, metric):
+        with self.lock:
+            # a module imported again replaces its metrics
+            self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, doc, labels=()):
+    return REGISTRY.register(Counter(name, doc, labels))
+
+
+def histogram(name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, doc, labels, buckets))
+
+
+def collected(name, doc, collect, labels=(), kind="gauge"):
+    return REGISTRY.register(Collected(name, doc, collect, labels, kind))
+
+
+def render():
+    return REGISTRY.render()
+
+
+POOL_WAIT = histogram(
+    "yenot_pool_wait_seconds", "Seconds waited for a pooled database connection"
+)
+REQUEST_SECONDS = histogram(
+    "yenot_request_seconds",
+    "Seconds spent on a request until its response is sent",
+    labels=("route", "method", "status"),
+)
+RESPONSE_BYTES = counter(
+    "yenot_response_bytes_total",
+    "Bytes of response bodies sent",
+    labels=("route",),
+)
+# includes the rows of sql_tab2_json tables serialized by PostgreSQL
+ROWS_SERIALIZED = counter(
+    "yenot_rows_serialized_total", "Table rows written to Yenot JSON responses"
+)
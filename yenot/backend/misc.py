@@ -1,8 +1,11 @@
+import re
 import json
+import codecs
 import collections
 import rtlib
 from bottle import request, HTTPError
 import psycopg2.extras as extras
+from . import sqlread
 from . import sqlwrite
 
 
@@ -31,11 +34,9 @@ def write_event_entry(conn, ltype, ldescr, ldata):
 insert into yenotsys.eventlog (logtype, logtime, descr, logdata)
 values (%(lt)s, current_timestamp, %(ld)s, %(lj)s)
 returning id, logtype, logtime;"""
-    dumps = lambda x: json.dumps(x, cls=rtlib.DateTimeEncoder)
+    lj = extras.Json(ldata, dumps=rtlib.serialize)
     with conn.cursor(cursor_factory=extras.NamedTupleCursor) as cursor:
-        cursor.execute(
-            ins, {"lt": ltype, "ld": ldescr, "lj": extras.Json(ldata, dumps=dumps)}
-        )
+        cursor.execute(ins, {"lt": ltype, "ld": ldescr, "lj": lj})
         row = list(cursor.fetchall())[0]
     return row.id, row.logtype, row.logtime
 
@@ -87,20 +88,29 @@ def tab2_rows_transform(colrows, columns_target, transform):
         :meth:`tab2_columns_transform`
     :param transform: callable taking two parameters -- (oldrow, row);
         this is called once per row in the `colrows` parameter.
+
+    The rows may be plain tuples (e.g. from `sql_tab2(..., lean=True)`) in
+    which case `oldrow` is given attribute access for the transform and the
+    returned rows are plain tuples as well.
     """
     source_attrs = [a for a, _ in colrows[0]]
     target_attrs = [a for a, _ in columns_target]
-    overlap = set(source_attrs).intersection(target_attrs)
+    overlap = [(a, i) for i, a in enumerate(source_attrs) if a in target_attrs]
 
     RecordType = rtlib.fixedrecord("RecordType", target_attrs)
     RowType = collections.namedtuple("RowType", target_attrs)
+    OldRowType = sqlread._row_type(tuple(source_attrs))
 
     rows = []
     for oldrow in colrows[1]:
-        assign = {a: getattr(oldrow, a) for a in overlap}
+        assign = {a: oldrow[i] for a, i in overlap}
         row = RecordType(**assign)
-        transform(oldrow, row)
-        rows.append(RowType(**row._as_dict()))
+        if type(oldrow) is tuple:
+            transform(OldRowType._make(oldrow), row)
+            rows.append(row._as_tuple())
+        else:
+            transform(oldrow, row)
+            rows.append(RowType(**row._as_dict()))
     return rows
 
 
@@ -139,7 +149,12 @@ def table_from_tab2(
     options=None,
     allow_extra=False,
     matrix=None,
+    stream=False,
 ):
+    """
+    Return the tab2/tab3 upload `name` as an :class:`InboundTable` or, with
+    stream, as an :class:`InboundStream` to be read in batches.
+    """
     if name not in request.files:
         if default_missing == "none":
             return None
@@ -152,21 +167,284 @@ def table_from_tab2(
                 "required-collection",
                 f"Required tabular input {name} missing.",
             )
+    kwargs = {
+        "encoding": "utf8",
+        "required": required,
+        "amendments": amendments,
+        "options": options,
+        "matrix": matrix,
+        "allow_extra": allow_extra,
+    }
     try:
-        return InboundTable.from_file(
-            request.files[name].file,
-            encoding="utf8",
-            required=required,
-            amendments=amendments,
-            options=options,
-            matrix=matrix,
-            allow_extra=allow_extra,
-        )
+        if stream:
+            return InboundStream(request.files[name].file, name=name, **kwargs)
+        return InboundTable.from_file(request.files[name].file, **kwargs)
     except RuntimeError as e:
-        raise UserError(
-            "invalid-collection",
-            f'Post file "{name}" contains incorrect data.  {str(e)}',
+        raise _invalid_collection(name, e)
+
+
+def _invalid_collection(name, e):
+    return UserError(
+        "invalid-collection",
+        f'Post file "{name}" contains incorrect data.  {str(e)}',
+    )
+
+
+def _inbound_fields(fields, required, amendments, options, allow_extra):
+    # validate the upload columns and return the columns of the DataRow
+    clfields = list(fields)
+    allowed = set(options) if options != None else set()
+    if required == None:
+        required = []
+    if required != None:
+        allowed = allowed.union(required)
+    if amendments != None:
+        allowed = allowed.union(amendments)
+
+    if not allow_extra and not set(fields).issubset(allowed):
+        raise RuntimeError(
+            f"Extra fields given:  {' '.join(set(fields).difference(allowed))}"
+        )
+    if not set(required).issubset(fields):
+        raise RuntimeError(
+            "Required fields not given:  {}".format(
+                " ".join(set(required).difference(fields))
+            )
+        )
+    if amendments != None:
+        clfields += set(amendments).difference(fields)
+    return clfields
+
+
+def _inbound_row_factory(dr, fields):
+    def make_row(r):
+        # rows are objects keyed by field or positional arrays (compact)
+        if isinstance(r, dict):
+            return dr(**{attr: r[attr] for attr in fields})
+        return dr(**dict(zip(fields, r)))
+
+    return make_row
+
+
+def _check_matrix(row, matrix):
+    for attr in matrix:
+        v = getattr(row, attr)
+        if v is None:
+            # no change to the associations
+            continue
+        if not isinstance(v, dict):
+            raise RuntimeError(
+                f"Matrix field {attr} expecting dict; received {str(type(v))}"
+            )
+
+        # must be either add/remove (x)or set and no other keys
+        vkeys = list(v.keys())
+        if vkeys == ["set"]:
+            pass
+        elif not set(vkeys).difference(["add", "remove"]):
+            pass
+        else:
+            raise RuntimeError(
+                f"Matrix field {attr} expecting 'add'/'remove' or 'set'; received {vkeys}"
+            )
+
+
+class _JsonReader:
+    """
+    Read JSON values one at a time from a binary file, holding only the text
+    not yet parsed.
+    """
+
+    WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+    def __init__(self, file, encoding="utf8", chunk_size=1 << 16):
+        self.file = file
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.chunk_size = chunk_size
+        self.json = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _more(self, size=None):
+        chunk = self.file.read(size or self.chunk_size)
+        self.eof = len(chunk) == 0
+        self.buffer = self.buffer[self.pos :] + self.decoder.decode(
+            chunk, final=self.eof
         )
+        self.pos = 0
+
+    def peek(self):
+        # the next character other than whitespace (None at the end)
+        while True:
+            self.pos = self.WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                return None
+            self._more()
+
+    def expect(self, chars):
+        c = self.peek()
+        if c == None or c not in chars:
+            raise RuntimeError(f"Malformed JSON; expecting one of {chars}")
+        self.pos += 1
+        return c
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.json.raw_decode(self.buffer, self.pos)
+                # a value at the end of the buffer may be cut short (e.g. 12|34)
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise RuntimeError(f"Malformed JSON; {e}")
+            # Read as much again as is held so that the attempts to parse a
+            # long value add up to linear time.
+            self._more(max(self.chunk_size, len(self.buffer) - self.pos))
+
+    def elements(self):
+        # the values of an array, parsed one at a time
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                break
+
+
+def _tab2_members(reader):
+    """
+    Generate the (key, value) members of the tab2/tab3 object of reader with
+    one ("data", row) member for each element of the data array.
+    """
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        key = reader.value()
+        reader.expect(":")
+        if key == "data":
+            for row in reader.elements():
+                yield key, row
+        elif reader.peek() == "[":
+            # e.g. a long deleted list
+            yield key, list(reader.elements())
+        else:
+            yield key, reader.value()
+        if reader.expect(",}") == "}":
+            break
+
+
+class InboundStream:
+    """
+    A tab2/tab3 upload parsed incrementally from file.  The members ahead
+    of the data (columns, deleted and matrix scopes; rtlib.ClientTable
+    writes them first) are read and the fields validated on construction.
+    The rows are parsed, validated and handed out as InboundTable batches
+    by :meth:`batches` so that only one batch is held at a time::
+
+        items = api.table_from_tab2("items", required=["id"], stream=True)
+        with api.writeblock(conn) as w:
+            w.upsert_batches("items", items.batches())
+
+    Members which follow the data are only known at the end:  deleted keys
+    come in a final batch and rows setting a matrix without its scope are
+    held until the scope arrives.
+    """
+
+    def __init__(
+        self,
+        file,
+        encoding="utf8",
+        required=None,
+        amendments=None,
+        options=None,
+        matrix=None,
+        allow_extra=False,
+        batch_rows=1000,
+        name=None,
+    ):
+        self.name = name
+        self.batch_rows = batch_rows
+        self._members = _tab2_members(_JsonReader(file, encoding))
+        self._pending = []
+        self.keys = {}
+        for key, value in self._members:
+            if key == "data":
+                self._pending.append(value)
+                break
+            self.keys[key] = value
+        self._header = set(self.keys)
+
+        if "columns" not in self.keys:
+            raise RuntimeError("Columns must be given ahead of the data")
+        fields = self.keys["columns"]
+        clfields = _inbound_fields(fields, required, amendments, options, allow_extra)
+
+        self.columns = [(c, None) for c in clfields]
+        self.DataRow = rtlib.fixedrecord("DataRow", clfields)
+        self.matrix = set(matrix or []).intersection(clfields)
+        self._make_row = _inbound_row_factory(self.DataRow, fields)
+
+    def _rows(self):
+        pending, self._pending = self._pending, []
+        for r in pending:
+            yield self._make_row(r)
+        for key, value in self._members:
+            if key == "data":
+                yield self._make_row(value)
+            else:
+                self.keys[key] = value
+
+    def _awaits_scope(self, row):
+        for attr in self.matrix:
+            v = getattr(row, attr)
+            if isinstance(v, dict) and "set" in v and f"{attr}:scope" not in self.keys:
+                return True
+        return False
+
+    def _batch(self, rows, deleted):
+        batch = InboundTable(self.columns, [])
+        batch.DataRow = self.DataRow
+        batch.rows = rows
+        batch.deleted_keys = deleted
+        batch.matrices = {
+            attr: {"scope": self.keys.get(f"{attr}:scope")} for attr in self.matrix
+        }
+        return batch
+
+    def batches(self):
+        """
+        Generate InboundTable batches of up to batch_rows rows; the deleted
+        keys are in the first batch (or the last if they follow the data).
+        """
+        try:
+            deleted = self.keys.get("deleted", [])
+            rows = []
+            held = False
+            for row in self._rows():
+                _check_matrix(row, self.matrix)
+                rows.append(row)
+                held = held or self._awaits_scope(row)
+                if len(rows) >= self.batch_rows and not held:
+                    yield self._batch(rows, deleted)
+                    rows, deleted = [], []
+
+            if "deleted" not in self._header:
+                deleted = deleted + self.keys.get("deleted", [])
+            if rows or deleted:
+                yield self._batch(rows, deleted)
+        except RuntimeError as e:
+            if self.name == None:
+                raise
+            raise _invalid_collection(self.name, e)
 
 
 class InboundTable:
@@ -188,36 +466,20 @@ class InboundTable:
         matrix=None,
         allow_extra=False,
     ):
-        intable = json.loads(file.read().decode(encoding))
+        content = file.read()
+        if codecs.lookup(encoding).name != "utf-8":
+            # the JSON backends read utf-8 bytes directly
+            content = content.decode(encoding)
+        intable = rtlib.deserialize(content)
         keys = intable.copy()
         fields = keys.pop("columns")
         rows = keys.pop("data")
 
-        clfields = list(fields)
-        allowed = set(options) if options != None else set()
-        if required == None:
-            required = []
-        if required != None:
-            allowed = allowed.union(required)
-        if amendments != None:
-            allowed = allowed.union(amendments)
-
-        if not allow_extra and not set(fields).issubset(allowed):
-            raise RuntimeError(
-                f"Extra fields given:  {' '.join(set(fields).difference(allowed))}"
-            )
-        if not set(required).issubset(fields):
-            raise RuntimeError(
-                "Required fields not given:  {}".format(
-                    " ".join(set(required).difference(fields))
-                )
-            )
-        if amendments != None:
-            clfields += set(amendments).difference(fields)
-
+        clfields = _inbound_fields(fields, required, amendments, options, allow_extra)
         dr = rtlib.fixedrecord("DataRow", clfields)
-        rows = [dr(**{attr: r[attr] for attr in fields}) for r in rows]
-        # rows = [dr(**dict(zip(fields, r))) for r in rows]
+        make_row = _inbound_row_factory(dr, fields)
+
+        rows = [make_row(r) for r in rows]
         self = cls([(c, None) for c in clfields], rows)
         self.deleted_keys = keys.get("deleted", [])
         matrix = matrix or []
@@ -226,26 +488,16 @@ class InboundTable:
 
         # validate matrix inbound elements
         for row in rows:
-            for attr in matrix:
-                v = getattr(row, attr)
-                if not isinstance(v, dict):
-                    raise RuntimeError(
-                        f"Matrix field {attr} expecting dict; received {str(type(v))}"
-                    )
-
-                # must be either add/remove (x)or set and no other keys
-                vkeys = list(v.keys())
-                if vkeys == ["set"]:
-                    pass
-                elif not set(vkeys).difference(["add", "remove"]):
-                    pass
-                else:
-                    raise RuntimeError(
-                        f"Matrix field {attr} expecting 'add'/'remove' or 'set'; received {vkeys}"
-                    )
+            _check_matrix(row, matrix)
 
         return self
 
+    def batches(self):
+        """
+        The table as its only batch (as for :meth:`InboundStream.batches`).
+        """
+        yield self
+
     @classmethod
     def empty_table(cls, required, amendments, options):
         if not required:
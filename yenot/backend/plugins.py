@@ -7,18 +7,22 @@ import contextlib
 import urllib.parse
 import traceback
 import time
-import random
 import threading
 import queue
+import zlib
+import hashlib
+import collections
 import psycopg2
 import psycopg2.extensions
 import psycopg2.extras
-import psycopg2.pool
 import bottle
 from bottle import request, response
 from paste import httpserver
 from paste.translogger import TransLogger
 from . import misc
+from . import eventlog
+from . import dbpool
+from . import metrics
 
 
 class CancelQueue(queue.SimpleQueue):
@@ -59,23 +63,51 @@ def cancel_queue(self):
             self.unregister_connection(ctoken, conn)
 
 
+def _route_readonly():
+    # Only connections of the route itself follow its readonly option; the
+    # plugins around it (e.g. session & authorization lookups) use the
+    # primary.  ArgumentShim marks the route's start.
+    try:
+        if not request.environ.get("yenot.in_route"):
+            return False
+        return bool(request.route.config.get("readonly", False))
+    except RuntimeError:
+        # not serving a request
+        return False
+
+
+def _checkout(app, readonly=False):
+    # waits in line up to the pool timeout; see dbpool.ConnectionPool;
+    # returns the pool to put the connection back to and the connection
+    started = time.monotonic()
+    try:
+        conn = None
+        if readonly and app.replicas != None:
+            pool = app.replicas
+            conn = pool.getconn()
+        if conn == None:
+            pool = app.pool
+            conn = pool.getconn()
+        if readonly:
+            # reset when it is put back
+            conn.readonly = True
+        return pool, conn
+    finally:
+        metrics.POOL_WAIT.observe(time.monotonic() - started)
+
+
 # to become a method of app
 @contextlib.contextmanager
-def dbconn(self):
-    for index in range(15):
-        if index > 3:
-            print(
-                f"Attempt #{index} to get a connection from the connection pool",
-                flush=True,
-            )
-        try:
-            conn = self.pool.getconn()
-            break
-        except psycopg2.pool.PoolError as e:
-            if index < 14 and str(e) == "connection pool exhausted":
-                time.sleep(random.random() * 0.5 + 0.1)
-            else:
-                raise
+def dbconn(self, readonly=None):
+    """
+    Check out a connection for the current request.  A readonly connection
+    (by default when called from a route with the readonly=True option, but
+    not from the plugins around it) is read-only and comes from a read
+    replica when there is one available.
+    """
+    if readonly == None:
+        readonly = _route_readonly()
+    pool, conn = _checkout(self, readonly)
     ctoken = getattr(request, "cancel_token", None)
     try:
         if ctoken != None:
@@ -84,17 +116,17 @@ def dbconn(self):
     finally:
         if ctoken != None:
             self.unregister_connection(ctoken, conn)
-        self.pool.putconn(conn)
+        pool.putconn(conn)
 
 
 # to become a method of app
 @contextlib.contextmanager
-def background_dbconn(self):
-    conn = self.pool.getconn()
+def background_dbconn(self, readonly=False):
+    pool, conn = _checkout(self, readonly)
     try:
         yield conn
     finally:
-        self.pool.putconn(conn)
+        pool.putconn(conn)
 
 
 def register_connection(self, ctoken, conn):
@@ -140,7 +172,7 @@ def create_connection(dburl):
     return psycopg2.connect(**kwargs)
 
 
-def create_pool(dburl):
+def _pool_kwargs(dburl):
     result = urllib.parse.urlsplit(dburl)
 
     kwargs = {"dbname": result.path[1:]}
@@ -153,13 +185,22 @@ def create_pool(dburl):
     if result.password != None:
         kwargs["password"] = result.password
     kwargs["cursor_factory"] = psycopg2.extras.NamedTupleCursor
+    return kwargs
+
+
+def create_pool(dburl, minconn=None, maxconn=None, timeout=None):
+    """
+    Return a :class:`dbpool.ConnectionPool` for dburl; the sizes and timeout
+    default to YENOT_POOL_MIN, YENOT_POOL_MAX and YENOT_POOL_TIMEOUT.
+    """
+    kwargs = _pool_kwargs(dburl)
 
     # retry on connection refused
     retries = 0
     while True:
         try:
             print(f"Connecting to db {kwargs['dbname']} (retry {retries})")
-            return psycopg2.pool.ThreadedConnectionPool(3, 6, **kwargs)
+            return dbpool.ConnectionPool(minconn, maxconn, timeout, **kwargs)
         except psycopg2.OperationalError as e:
             print(str(e))
             # if str(e).find("Connection refused") < 0:
@@ -169,10 +210,33 @@ def create_pool(dburl):
             time.sleep(1)
 
 
+def create_replicas(replica_urls, maxconn=None, timeout=None):
+    """
+    Return a :class:`dbpool.ReplicaPools` for the read replica urls or None
+    without any.  Replica connections are opened as they are needed so that a
+    replica down at start does not hold up the server, and give up after
+    YENOT_REPLICA_CONNECT_TIMEOUT seconds so that an unreachable one does
+    not hold up requests.
+    """
+    if not replica_urls:
+        return None
+    pools = []
+    for url in replica_urls:
+        kwargs = _pool_kwargs(url)
+        kwargs["connect_timeout"] = dbpool.REPLICA_CONNECT_TIMEOUT
+        pools.append(dbpool.ConnectionPool(0, maxconn, timeout, **kwargs))
+    return dbpool.ReplicaPools(pools)
+
+
 def delayed_shutdown(self):
     def make_it_stop():
         time.sleep(0.3)
+        # the LISTEN loops exit at their next poll
+        self.stopping.set()
+        self.event_log.stop(timeout=2)
         self.pool.closeall()
+        if self.replicas != None:
+            self.replicas.closeall()
         self._paste_server.stop()
 
     self.stop_thread = threading.Thread(target=make_it_stop)
@@ -194,6 +258,9 @@ global_app = None
 
 class DerivedBottle(bottle.Bottle):
     def after_modules_finalize(self):
+        # inside any authentication plugin installed by the modules
+        self.install(ConditionalGet())
+        self.install(ResponseCache())
         self.install(ArgumentShim())
 
 
@@ -214,7 +281,9 @@ class PasteServer(bottle.ServerAdapter):
         self.paste.server_close()
 
 
-def init_application(dburl):
+def init_application(
+    dburl, pool_min=None, pool_max=None, pool_timeout=None, replica_urls=None
+):
     global global_app
 
     DerivedBottle.dbconn = dbconn
@@ -235,11 +304,24 @@ def init_application(dburl):
     app.request_user_id = lambda: None
     app.request_session_id = lambda: None
 
-    app.pool = create_pool(dburl)
+    app.pool = create_pool(dburl, pool_min, pool_max, pool_timeout)
+    # read-only connections; see dbconn
+    app.replicas = create_replicas(replica_urls, pool_max, pool_timeout)
     app.dbconn_register = {}
+    # connections of their own apart from the pool for long running
+    # background work (the event log writer and sqllisten listeners)
+    app.dedicated_dbconn = lambda: create_connection(dburl)
+    app.stopping = threading.Event()
+    # error reports are written apart from the pool
+    app.event_log = eventlog.EventLogWriter(app.dedicated_dbconn)
 
     app.sitevars = {}
 
+    _collect_metrics(app)
+
+    # outermost to time the whole request and count the bytes sent
+    app.install(RequestMetrics())
+    app.install(CompressResponse())
     app.install(InterpretReverseProxy())
     app.install(RequestCancelTracker())
     app.install(ExceptionTrapper())
@@ -258,6 +340,117 @@ def init_application(dburl):
     return app
 
 
+def _collect_metrics(app):
+    metrics.collected(
+        "yenot_pool_connections",
+        "Pooled database connections in use, idle and requests waiting for one",
+        lambda: [({"state": k}, v) for k, v in app.pool.stats().items()],
+        labels=("state",),
+    )
+    metrics.collected(
+        "yenot_pool_exhausted_total",
+        "Requests which timed out waiting for a pooled database connection",
+        lambda: [({}, app.pool.exhausted)],
+        kind="counter",
+    )
+    metrics.collected(
+        "yenot_replica_fallbacks_total",
+        "Read-only checkouts sent to the primary for want of a replica",
+        lambda: [({}, app.replicas.fallbacks if app.replicas else 0)],
+        kind="counter",
+    )
+    metrics.collected(
+        "yenot_replica_connections",
+        "Read replica connections in use, idle and requests waiting for one",
+        lambda: [
+            ({"replica": str(index), "state": state}, stats[state])
+            for index, stats in enumerate(app.replicas.stats() if app.replicas else [])
+            for state in ("in_use", "idle", "waiting")
+        ],
+        labels=("replica", "state"),
+    )
+    metrics.collected(
+        "yenot_replica_healthy",
+        "Read replicas in the rotation (1) or left out after a failure (0)",
+        lambda: [
+            ({"replica": str(index)}, int(stats["healthy"]))
+            for index, stats in enumerate(app.replicas.stats() if app.replicas else [])
+        ],
+        labels=("replica",),
+    )
+    metrics.collected(
+        "yenot_eventlog_entries_total",
+        "Error reports written, dropped on a full queue or failed to write",
+        lambda: [
+            ({"outcome": outcome}, getattr(app.event_log, outcome))
+            for outcome in ("written", "dropped", "failed")
+        ],
+        labels=("outcome",),
+        kind="counter",
+    )
+
+
+class RequestMetrics:
+    """
+    Record the seconds taken by each request -- until the last chunk of a
+    streamed body -- and the bytes of its body by route (see
+    :mod:`metrics`).
+    """
+
+    name = "yenot-metrics"
+    api = 2
+
+    def setup(self, app):
+        self.app = app
+
+    def observe(self, route_key, started, status, size):
+        metrics.RESPONSE_BYTES.inc(size, route=route_key)
+        metrics.REQUEST_SECONDS.observe(
+            time.monotonic() - started,
+            route=route_key,
+            method=request.method,
+            status=status,
+        )
+
+    def count_stream(self, chunks, route_key, started):
+        size = 0
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode(response.charset)
+                size += len(chunk)
+                yield chunk
+        finally:
+            close = getattr(chunks, "close", None)
+            if close != None:
+                close()
+            self.observe(route_key, started, response.status_code, size)
+
+    def apply(self, callback, route):
+        route_key = route.name or route.rule
+
+        def wrapper(*args, **kwargs):
+            started = time.monotonic()
+            try:
+                out = callback(*args, **kwargs)
+            except bottle.HTTPResponse as e:
+                self.observe(route_key, started, e.status_code, 0)
+                raise
+            except Exception:
+                self.observe(route_key, started, 500, 0)
+                raise
+
+            if hasattr(out, "__next__") and not hasattr(out, "read"):
+                return self.count_stream(out, route_key, started)
+            if isinstance(out, str):
+                out = out.encode(response.charset)
+            size = len(out) if isinstance(out, bytes) else 0
+            self.observe(route_key, started, response.status_code, size)
+            return out
+
+        return wrapper
+
+
 class ArgumentShim:
     name = "yenot-args"
     api = 2
@@ -279,6 +472,8 @@ class ArgumentShim:
             if include_response:
                 kwargs["response"] = response
 
+            # see _route_readonly
+            request.environ["yenot.in_route"] = True
             return callback(*args, **kwargs)
 
         return wrapper
@@ -347,6 +542,434 @@ class InterpretReverseProxy:
         return wrapper
 
 
+class CompressResponse:
+    """
+    Compress response bodies with gzip or deflate as negotiated by the
+    Accept-Encoding request header.  Bodies shorter than min_size bytes
+    (default YENOT_COMPRESS_MIN_SIZE or 1024) are sent as is.  A streamed
+    (generator) body is buffered until it reaches min_size and then each
+    chunk is compressed and flushed as it arrives.
+    """
+
+    name = "yenot-compress"
+    api = 2
+
+    # wbits for zlib.compressobj by content-coding in order of preference
+    WBITS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+    def __init__(self, min_size=None, level=6):
+        if min_size == None:
+            min_size = int(os.environ.get("YENOT_COMPRESS_MIN_SIZE", 1024))
+        self.min_size = min_size
+        self.level = level
+
+    def setup(self, app):
+        pass
+
+    def negotiate(self):
+        accepted = {}
+        for item in request.headers.get("Accept-Encoding", "").split(","):
+            coding, _, params = item.strip().partition(";")
+            quality = 1.0
+            if params.strip().startswith("q="):
+                try:
+                    quality = float(params.strip()[2:])
+                except ValueError:
+                    quality = 0.0
+            accepted[coding.strip().lower()] = quality
+
+        for coding in self.WBITS:
+            if accepted.get(coding, accepted.get("*", 0.0)) > 0.0:
+                return coding
+        return None
+
+    def compressor(self, coding):
+        response.set_header("Content-Encoding", coding)
+        if "Content-Length" in response:
+            del response["Content-Length"]
+        # a strong validator must differ for each content-coding
+        etag = response.get_header("ETag")
+        if etag != None and not etag.startswith("W/"):
+            response.set_header("ETag", f'{etag[:-1]}-{coding}"')
+        return zlib.compressobj(self.level, zlib.DEFLATED, self.WBITS[coding])
+
+    def compress_stream(self, chunks, coding):
+        try:
+            buffered = []
+            size = 0
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode(response.charset)
+                buffered.append(chunk)
+                size += len(chunk)
+                if size >= self.min_size:
+                    break
+            else:
+                # the whole stream fit under the threshold
+                yield b"".join(buffered)
+                return
+
+            zobj = self.compressor(coding)
+            yield zobj.compress(b"".join(buffered)) + zobj.flush(zlib.Z_SYNC_FLUSH)
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode(response.charset)
+                yield zobj.compress(chunk) + zobj.flush(zlib.Z_SYNC_FLUSH)
+            yield zobj.flush()
+        finally:
+            # release whatever the inner generator holds (e.g. a connection)
+            close = getattr(chunks, "close", None)
+            if close != None:
+                close()
+
+    def apply(self, callback, route):
+        def wrapper(*args, **kwargs):
+            out = callback(*args, **kwargs)
+
+            if request.method == "HEAD" or "Content-Encoding" in response:
+                return out
+            if response.status_code in (204, 304):
+                return out
+            streamed = hasattr(out, "__next__") and not hasattr(out, "read")
+            if not isinstance(out, (str, bytes)) and not streamed:
+                return out
+
+            response.add_header("Vary", "Accept-Encoding")
+            coding = self.negotiate()
+            if coding == None:
+                return out
+
+            if streamed:
+                return self.compress_stream(out, coding)
+            if isinstance(out, str):
+                out = out.encode(response.charset)
+            if len(out) < self.min_size:
+                return out
+            zobj = self.compressor(coding)
+            return zobj.compress(out) + zobj.flush()
+
+        return wrapper
+
+
+def body_etag(body):
+    """
+    Return a strong entity tag for the response body bytes.
+    """
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+class ConditionalGet:
+    """
+    Give the body of a GET response a strong ETag and answer a request with a
+    matching If-None-Match header with 304 Not Modified and no body.
+
+    A route may declare a cheap validator with the etag option -- a function
+    of the route arguments returning a version of the data behind the body,
+    e.g. a change counter of the tables it reads:
+
+    .. code-block:: python
+
+        def items_version(**kwargs):
+            with app.dbconn() as conn:
+                return api.sql_1row(conn, "select version from items_version")
+
+        @app.get("/api/items", name="get_api_items", etag=items_version)
+
+    The tag then hashes the version with the route, the path and query
+    parameters, the requesting user and the request headers selecting the
+    format, and a matching request is answered before the route runs.  A
+    version of None falls back to the tag of the body:  a hash of the body
+    unless an inner plugin (e.g. :class:`ResponseCache`) already set one.
+    Such a route still runs and its body is serialized and hashed before the
+    304 is sent (unless served from the response cache); only the transfer
+    of the body is saved.
+    """
+
+    name = "yenot-etag"
+    api = 2
+
+    VARY_HEADERS = ("Accept", "X-Yenot-Format", "X-Yenot-Timezone")
+    # suffixes added to the tag by CompressResponse
+    CODING_SUFFIXES = tuple(f'-{coding}"' for coding in CompressResponse.WBITS)
+
+    def setup(self, app):
+        self.app = app
+
+    def version_etag(self, route, version):
+        """
+        Return the strong tag of this request's representation of version.
+        """
+        user_id = getattr(self.app, "request_user_id", lambda: None)()
+        key = (
+            route.name or route.rule,
+            request.path,
+            sorted(request.query.allitems()),
+            user_id,
+            [request.headers.get(h) for h in self.VARY_HEADERS],
+            str(version),
+        )
+        return body_etag(repr(key).encode("utf-8"))
+
+    def matching_tag(self, etag):
+        """
+        Return the tag of the If-None-Match header matching etag or None.
+        """
+        for held in request.headers.get("If-None-Match", "").split(","):
+            held = held.strip()
+            if held == "*":
+                return etag
+            # If-None-Match uses the weak comparison
+            tag = held[2:] if held.startswith("W/") else held
+            for suffix in self.CODING_SUFFIXES:
+                if tag.endswith(suffix):
+                    tag = tag[: -len(suffix)] + '"'
+                    break
+            if tag == etag:
+                return held
+        return None
+
+    def not_modified(self, matched):
+        # the tag the client holds names its coding of the body
+        response.set_header("ETag", matched)
+        response.status = 304
+        return b""
+
+    def apply(self, callback, route):
+        version_of = route.config.get("etag")
+
+        def wrapper(*args, **kwargs):
+            etag = None
+            if version_of != None and request.method == "GET":
+                version = version_of(*args, **kwargs)
+                if version != None:
+                    etag = self.version_etag(route, version)
+                    matched = self.matching_tag(etag)
+                    if matched != None:
+                        return self.not_modified(matched)
+
+            out = callback(*args, **kwargs)
+
+            if request.method != "GET" or response.status_code != 200:
+                return out
+            if isinstance(out, str):
+                out = out.encode(response.charset)
+            if not isinstance(out, bytes):
+                return out
+
+            if etag == None:
+                etag = response.get_header("ETag")
+            if etag == None:
+                etag = body_etag(out)
+            response.set_header("ETag", etag)
+            matched = self.matching_tag(etag)
+            if matched != None:
+                return self.not_modified(matched)
+            return out
+
+        return wrapper
+
+
+CacheEntry = collections.namedtuple(
+    "CacheEntry", ["expires", "channels", "body", "headers"]
+)
+
+
+class ResponseCache:
+    """
+    Cache the serialized body of GET routes declared with a cache option such
+    as:
+
+    .. code-block:: python
+
+        @app.get(
+            "/api/items",
+            name="get_api_items",
+            cache={"ttl": 60, "channels": ["items"]},
+        )
+
+    An entry is kept for ttl seconds (`cache=60` is short for `{"ttl": 60}`)
+    and keyed on the route, the path and query parameters, the requesting
+    user (`app.request_user_id`) and the request headers selecting the
+    format.  A NOTIFY on any of the channels (see :mod:`sqllisten`) drops the
+    entries listing it.  The least recently used entries are evicted beyond
+    max_entries or max_bytes of bodies (YENOT_CACHE_MAX_ENTRIES and
+    YENOT_CACHE_MAX_BYTES by default).
+    """
+
+    name = "yenot-cache"
+    api = 2
+
+    VARY_HEADERS = ("Accept", "X-Yenot-Format", "X-Yenot-Timezone")
+    KEEP_HEADERS = ("Content-Type", "X-Yenot-Format", "ETag")
+    # seconds the first request of a channel waits for its listener
+    LISTEN_WAIT = 1.0
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        if max_entries == None:
+            max_entries = int(os.environ.get("YENOT_CACHE_MAX_ENTRIES", 1000))
+        if max_bytes == None:
+            max_bytes = int(os.environ.get("YENOT_CACHE_MAX_BYTES", 64 * 2**20))
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        # bumped by each invalidation of a channel
+        self.generations = collections.Counter()
+        self.hits = 0
+        self.misses = 0
+        # subscribed listeners by channel and what relies on them
+        self.listeners = {}
+        self.channel_users = collections.Counter()
+
+    def setup(self, app):
+        self.app = app
+        app.response_cache = self
+
+    def invalidate(self, channel, payload=None):
+        with self.lock:
+            self.generations[channel] += 1
+            stale = [k for k, e in self.entries.items() if channel in e.channels]
+            for key in stale:
+                self._drop(key)
+
+    def clear(self):
+        with self.lock:
+            for channel in self.generations:
+                self.generations[channel] += 1
+            for key in list(self.entries):
+                self._drop(key)
+
+    def _drop(self, key):
+        entry = self.entries.pop(key)
+        self.size -= len(entry.body)
+        self._release(entry.channels)
+
+    def _retain(self, channels):
+        # called with the lock held; counts the entries and requests in
+        # progress relying on the invalidations of each channel
+        for channel in channels:
+            self.channel_users[channel] += 1
+
+    def _release(self, channels):
+        # called with the lock held; unsubscribes from channels nothing relies
+        # on any more
+        for channel in channels:
+            self.channel_users[channel] -= 1
+            if self.channel_users[channel] <= 0:
+                del self.channel_users[channel]
+                listener = self.listeners.pop(channel, None)
+                if listener != None:
+                    listener.unsubscribe(self.invalidate)
+
+    def _lookup(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry != None and entry.expires <= time.time():
+                self._drop(key)
+                entry = None
+            if entry == None:
+                self.misses += 1
+            else:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            return entry
+
+    def _store(self, key, entry, generation):
+        with self.lock:
+            if generation != [self.generations[c] for c in entry.channels]:
+                # invalidated while the body was produced
+                return
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = entry
+            self.size += len(entry.body)
+            self._retain(entry.channels)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+
+    def _subscribe(self, channels, until):
+        if len(channels) == 0:
+            return True
+        # imported here; sqllisten can only be loaded by way of the api module
+        from .api import sqllisten
+
+        for channel in channels:
+            listener = sqllisten.Listener.start_change_queue(None, channel)
+            # a new listener takes a moment to LISTEN
+            if not listener.listening.wait(self.LISTEN_WAIT):
+                return False
+            if not listener.subscribe(self.invalidate, until):
+                return False
+            with self.lock:
+                self.listeners[channel] = listener
+        return True
+
+    def _fill(self, key, channels, ttl, callback, args, kwargs):
+        expires = time.time() + ttl
+        # without a live listener no invalidation would arrive
+        listening = self._subscribe(channels, expires)
+        with self.lock:
+            generation = [self.generations[c] for c in channels]
+
+        out = callback(*args, **kwargs)
+
+        response.set_header("X-Yenot-Cache", "miss")
+        if isinstance(out, str):
+            out = out.encode(response.charset)
+        if (
+            listening
+            and isinstance(out, bytes)
+            and response.status_code == 200
+            and len(out) <= self.max_bytes
+            and "Set-Cookie" not in dict(response.headerlist)
+        ):
+            response.set_header("ETag", body_etag(out))
+            headers = [
+                (h, response.get_header(h)) for h in self.KEEP_HEADERS if h in response
+            ]
+            entry = CacheEntry(expires, channels, out, headers)
+            self._store(key, entry, generation)
+        return out
+
+    def apply(self, callback, route):
+        ttl = route.config.get("cache.ttl", route.config.get("cache"))
+        if not ttl:
+            return callback
+        channels = tuple(route.config.get("cache.channels", ()))
+        route_key = route.name or route.rule
+
+        def wrapper(*args, **kwargs):
+            if request.method != "GET":
+                return callback(*args, **kwargs)
+
+            key = (
+                route_key,
+                request.path,
+                tuple(sorted(request.query.allitems())),
+                self.app.request_user_id(),
+                tuple(request.headers.get(h) for h in self.VARY_HEADERS),
+            )
+            entry = self._lookup(key)
+            if entry != None:
+                for header, value in entry.headers:
+                    response.set_header(header, value)
+                response.set_header("X-Yenot-Cache", "hit")
+                return entry.body
+
+            with self.lock:
+                # subscribed before and until the body is stored
+                self._retain(channels)
+            try:
+                return self._fill(key, channels, ttl, callback, args, kwargs)
+            finally:
+                with self.lock:
+                    self._release(channels)
+
+        return wrapper
+
+
 class ExceptionTrapper:
     name = "yenot-exceptions"
     api = 2
@@ -356,21 +979,20 @@ class ExceptionTrapper:
         self.app = app
 
     def report(self, e, myresponse, keys):
-        with self.app.dbconn() as conn:
-            exc_type, exc_value, exc_traceback = sys.exc_info()
-            fsumm = [
-                (f.filename, f.lineno, f.name)
-                for f in traceback.extract_tb(exc_traceback, 15)
-            ]
-            details = {
-                "exc_type": exc_type.__name__,
-                "exception": str(exc_value),
-                "session": self.app.request_session_id(),
-                "frames": list(reversed(fsumm)),
-            }
-            des = f"HTTP {myresponse.status} - {keys.get('error-msg', None)}"
-            misc.write_event_entry(conn, "Yenot Server Error", des, details)
-            conn.commit()
+        exc_type, exc_value, exc_traceback = sys.exc_info()
+        fsumm = [
+            (f.filename, f.lineno, f.name)
+            for f in traceback.extract_tb(exc_traceback, 15)
+        ]
+        details = {
+            "exc_type": exc_type.__name__,
+            "exception": str(exc_value),
+            "session": self.app.request_session_id(),
+            "frames": list(reversed(fsumm)),
+        }
+        des = f"HTTP {myresponse.status} - {keys.get('error-msg', None)}"
+        # queued for the background writer; see eventlog.EventLogWriter
+        self.app.event_log.put("Yenot Server Error", des, details)
 
     def apply(self, callback, route):
         def wrapper(*args, **kwargs):
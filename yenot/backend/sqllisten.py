@@ -6,8 +6,32 @@ import psycopg2
 import psycopg2.extensions
 import yenot.backend.api as api
 import rtlib
+from . import metrics
 
 LISTENERS = {}
+LISTENERS_LOCK = threading.Lock()
+
+
+def _listener_stats():
+    with LISTENERS_LOCK:
+        listeners = list(LISTENERS.values())
+    for listener in listeners:
+        with listener.lock:
+            yield listener.channel, listener.waiters, len(listener.subscribers)
+
+
+metrics.collected(
+    "yenot_listener_waiters",
+    "Requests waiting for notifications by listened channel",
+    lambda: [({"channel": c}, w) for c, w, _ in _listener_stats()],
+    labels=("channel",),
+)
+metrics.collected(
+    "yenot_listener_subscribers",
+    "Callbacks subscribed to notifications by listened channel",
+    lambda: [({"channel": c}, s) for c, _, s in _listener_stats()],
+    labels=("channel",),
+)
 
 
 def _raise_valid_channel(channel):
@@ -28,6 +52,16 @@ class Listener:
 
         self.last_check = time.time()
 
+        # callbacks called with (channel, payload) on each notification and
+        # with (channel, None) when the listener stops
+        self.subscribers = []
+        self.keep_until = 0
+        self.stopped = False
+        # requests waiting in changes_since
+        self.waiters = 0
+        self.lock = threading.Lock()
+        self.listening = threading.Event()
+
         self.qthread = threading.Thread(target=self.change_queue_core)
         self.qthread.start()
 
@@ -36,51 +70,111 @@ class Listener:
         # TODO: remove key
         global LISTENERS
 
-        if channel in LISTENERS:
-            return LISTENERS[channel]
-        else:
-            new = Listener(channel)
-            LISTENERS[channel] = new
-            return new
+        with LISTENERS_LOCK:
+            if channel in LISTENERS:
+                return LISTENERS[channel]
+            else:
+                new = Listener(channel)
+                LISTENERS[channel] = new
+                return new
 
     @staticmethod
     def stop_change_queue(channel):
         global LISTENERS
-        del LISTENERS[channel]
+        with LISTENERS_LOCK:
+            del LISTENERS[channel]
+
+    def subscribe(self, callback, until):
+        """
+        Call callback(channel, payload) for each notification on this channel
+        and keep listening at least until the time `until`.  The callback is
+        called with a payload of None when the listener stops since later
+        notifications are missed.  Return False if this listener is already
+        stopping (start a new one with :meth:`start_change_queue`).
+        """
+        with self.lock:
+            if self.stopped:
+                return False
+            if callback not in self.subscribers:
+                self.subscribers.append(callback)
+            self.keep_until = max(self.keep_until, until)
+            return True
+
+    def unsubscribe(self, callback):
+        """
+        Stop calling callback; the listener keeps listening until the time
+        given to :meth:`subscribe`.
+        """
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def _keep_listening(self):
+        with self.lock:
+            now = time.time()
+            if now - self.last_check < 30 or now < self.keep_until:
+                return True
+            self.stopped = True
+            return False
+
+    def _publish(self, payload):
+        for callback in list(self.subscribers):
+            callback(self.channel, payload)
+
+    def _poll(self, conn, index):
+        if select.select([conn], [], [], 5) == ([], [], []):
+            return index  # print(f"nothing; iterate {self.channel}")
+
+        # print(f"poll it {self.channel}")
+        conn.poll()
+        while conn.notifies:
+            notify = conn.notifies.pop(0)
+
+            index += 1
+            node = (time.time(), index, notify.payload)
+            self.thislist.append(node)
+            self.event.set()
+            self.event.clear()
+            self._publish(notify.payload)
+        return index
 
     def change_queue_core(self):
         app = api.get_global_app()
 
-        index = 0
-        with app.background_dbconn() as conn:
+        conn = None
+        try:
+            index = 0
+            # A connection of its own rather than one of the pool since it is
+            # held as long as the listener runs.
+            conn = app.dedicated_dbconn()
             conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
 
             curs = conn.cursor()
             # The channel string shall not be quoted in this context.
             curs.execute(f"LISTEN {self.channel};")
-
-            while time.time() - self.last_check < 30:
-                if select.select([conn], [], [], 5) == ([], [], []):
-                    pass  # print(f"nothing; iterate {self.channel}")
-                else:
-                    # print(f"poll it {self.channel}")
-                    conn.poll()
-                    while conn.notifies:
-                        notify = conn.notifies.pop(0)
-
-                        index += 1
-                        node = (time.time(), index, notify.payload)
-                        self.thislist.append(node)
-                        self.event.set()
-                        self.event.clear()
+            self.listening.set()
+
+            while not app.stopping.is_set() and self._keep_listening():
+                try:
+                    index = self._poll(conn, index)
+                except (psycopg2.Error, OSError, ValueError):
+                    if app.stopping.is_set() or conn.closed:
+                        # the server is stopping or the connection was lost
+                        break
+                    raise
 
                 cutoff = time.time() - 60
                 for cut, chrow in enumerate(self.thislist):
                     if chrow[0] > cutoff:
                         self.thislist = self.thislist[cut:]
                         break
-
-        self.stop_change_queue(self.channel)
+        finally:
+            with self.lock:
+                self.stopped = True
+            self.stop_change_queue(self.channel)
+            self._publish(None)
+            if conn != None:
+                conn.close()
 
     def current_index(self):
         if len(self.thislist) > 0:
@@ -94,24 +188,30 @@ class Listener:
         wait_count = 10
         wait_length = 4
 
-        for i in range(wait_count):
-            self.last_check = time.time()
-
-            for chrow in self.thislist:
-                if chrow[1] > index:
-                    with changes.adding_row() as r2:
-                        r2.index = chrow[1]
-                        r2.payload = chrow[2]
-                    index = chrow[1]
-
-            if len(changes.rows) > 0:
-                break
-
-            if i < wait_count - 1:
-                self.event.wait(wait_length)
-                if not self.event.is_set():
-                    # give a chance for the cancel exception
-                    cancel.wait(0.01)
+        with self.lock:
+            self.waiters += 1
+        try:
+            for i in range(wait_count):
+                self.last_check = time.time()
+
+                for chrow in self.thislist:
+                    if chrow[1] > index:
+                        with changes.adding_row() as r2:
+                            r2.index = chrow[1]
+                            r2.payload = chrow[2]
+                        index = chrow[1]
+
+                if len(changes.rows) > 0:
+                    break
+
+                if i < wait_count - 1:
+                    self.event.wait(wait_length)
+                    if not self.event.is_set():
+                        # give a chance for the cancel exception
+                        cancel.wait(0.01)
+        finally:
+            with self.lock:
+                self.waiters -= 1
 
         return changes
 
@@ -0,0 +1,163 @@
+import os
+import re
+import itertools
+import threading
+import functools
+import collections
+import weakref
+import psycopg2.errors
+import psycopg2.extensions
+
+# prepared statements kept per connection (least recently used are dropped)
+PREPARED_CACHE_SIZE = int(os.environ.get("YENOT_PREPARED_CACHE_SIZE", 100))
+
+PLACEHOLDER_RE = re.compile(r"%%|%\((?P<name>[^)]+)\)s|%s")
+
+_statement_ids = itertools.count(1)
+
+
+@functools.lru_cache(maxsize=1024)
+def _parameterize(stmt, interpolate):
+    """
+    Convert the psycopg2 placeholders of stmt to PostgreSQL $n parameters.
+    Return the converted statement and the parameter names (for a mapping of
+    params) or the parameter count (for a sequence).
+    """
+    if not interpolate:
+        return stmt, 0
+
+    names = []
+    count = 0
+
+    def replace(m):
+        nonlocal count
+        if m.group(0) == "%%":
+            return "%"
+        if m.group("name") != None:
+            if m.group("name") not in names:
+                names.append(m.group("name"))
+            return f"${names.index(m.group('name')) + 1}"
+        count += 1
+        return f"${count}"
+
+    converted = PLACEHOLDER_RE.sub(replace, stmt)
+    if names and count:
+        raise ValueError("statement mixes named and positional placeholders")
+    return converted, tuple(names) if names else count
+
+
+class PreparedStatements:
+    """
+    The statements prepared in the session of one connection by SQL text.
+    The least recently used statement is deallocated when there are more
+    than `size`.
+    """
+
+    def __init__(self, size=None):
+        self.size = max(1, PREPARED_CACHE_SIZE if size == None else size)
+        self.statements = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def execute(self, cursor, stmt, params):
+        interpolate = params != None
+        converted, spec = _parameterize(stmt, interpolate)
+        if isinstance(spec, tuple):
+            values = [params[name] for name in spec]
+        else:
+            values = list(params) if interpolate else []
+            if len(values) != spec:
+                raise TypeError("parameter count does not match the statement")
+
+        key = (stmt, interpolate)
+        name = self.statements.get(key)
+        if name != None:
+            self.statements.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+            while len(self.statements) >= self.size:
+                _, stale = self.statements.popitem(last=False)
+                cursor.execute(f"deallocate {stale}")
+            name = f"yenot_stmt_{next(_statement_ids)}"
+            # no parameters so that psycopg2 leaves the text alone
+            cursor.execute(f"prepare {name} as {converted}")
+            self.statements[key] = name
+
+        args = f" ({', '.join(['%s'] * len(values))})" if values else ""
+        cursor.execute(f"execute {name}{args}", values)
+
+    def clear(self):
+        self.statements.clear()
+
+
+_connection_statements = weakref.WeakKeyDictionary()
+_connection_lock = threading.Lock()
+
+
+def prepared_statements(conn):
+    """
+    Return the :class:`PreparedStatements` of the connection (creating it on
+    first use).  A new connection, as replaces a broken one in the pool,
+    starts with an empty set and prepares again.
+    """
+    with _connection_lock:
+        prepared = _connection_statements.get(conn)
+        if prepared == None:
+            prepared = PreparedStatements()
+            _connection_statements[conn] = prepared
+        return prepared
+
+
+def forget_prepared(conn):
+    """
+    Forget the statements prepared on conn after its session state is
+    discarded (e.g. by DISCARD ALL).
+    """
+    with _connection_lock:
+        _connection_statements.pop(conn, None)
+
+
+def execute(cursor, stmt, params=None):
+    """
+    Execute stmt on the cursor as a prepared statement of the cursor's
+    connection.  The first execution on a connection prepares the statement
+    and later ones only send the parameter values with EXECUTE.  Parameter
+    types are inferred by PostgreSQL from the statement; add a cast where it
+    cannot (e.g. `select %(x)s::integer`).
+
+    Statements which cannot be prepared -- not a plain string or with tuple
+    values (as expanded for `in %s`) -- are executed as usual.
+
+    If the session lost its prepared statements (e.g. to DISCARD ALL) the
+    statement is prepared and executed again unless the failure aborted a
+    transaction with earlier work; then the error is raised and the next
+    transaction starts over.
+    """
+    if not isinstance(stmt, str) or _has_tuple(params):
+        cursor.execute(stmt, params)
+        return
+
+    conn = cursor.connection
+    status = conn.info.transaction_status
+    try:
+        prepared_statements(conn).execute(cursor, stmt, params)
+    except psycopg2.errors.InvalidSqlStatementName:
+        forget_prepared(conn)
+        if conn.autocommit:
+            pass
+        elif status == psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            # the failed statement began the transaction; nothing is lost
+            conn.rollback()
+        else:
+            raise
+        # drop any statements left so that all are known again
+        cursor.execute("deallocate all")
+        prepared_statements(conn).execute(cursor, stmt, params)
+
+
+def _has_tuple(params):
+    if params == None:
+        return False
+    values = params.values() if isinstance(params, dict) else params
+    return any(isinstance(v, tuple) for v in values)
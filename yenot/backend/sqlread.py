@@ -1,22 +1,80 @@
 import os
 import re
+import copy
+import itertools
+import threading
+import functools
+import collections
 import psycopg2.extensions as psyext
 import psycopg2.extras as extras
+import rtlib
 
 
-def sql_rows(conn, select, params=None):
+def _cursor_factory(lean):
+    return psyext.cursor if lean else extras.NamedTupleCursor
+
+
+def _execute(cursor, stmt, params, prepare):
+    if prepare:
+        # imported here so that this module still runs as a doctest script
+        from . import sqlprepare
+
+        sqlprepare.execute(cursor, stmt, params)
+    else:
+        cursor.execute(stmt, params)
+
+
+# characters replaced by "_" in field names as by psycopg2's NamedTupleCursor
+_FIELD_CLEAN_RE = re.compile(
+    "[" + re.escape(" !\"#$%&'()*+,-./:;<=>?@[\\]^`{|}~") + "]"
+)
+
+
+def _field_name(name):
+    name = _FIELD_CLEAN_RE.sub("_", name)
+    # an identifier cannot start with a digit nor a namedtuple field with "_"
+    if name[:1] == "_" or name[:1].isdigit():
+        name = "f" + name
+    return name
+
+
+@functools.lru_cache(maxsize=512)
+def _row_type(names):
+    # Names are sanitized as by NamedTupleCursor (e.g. "foo bar" is foo_bar)
+    # and what is still not a valid field (keywords, duplicates) is renamed
+    # to _0, _1, ... rather than refused.
+    fields = [_field_name(name) for name in names]
+    return collections.namedtuple("Record", fields, rename=True)
+
+
+def named_rows(columns, rows):
+    """
+    Give the plain tuple rows of a lean query attribute access.  The rows are
+    returned as namedtuples with the names of `columns` -- a tab2 column list
+    or a cursor description.  The namedtuple class is cached by the names.
+    """
+    RowType = _row_type(tuple(c[0] for c in columns))
+    return [RowType._make(row) for row in rows]
+
+
+def sql_rows(conn, select, params=None, lean=False, prepare=False):
+    """
+    Execute the select and return a list of rows as namedtuples or, with
+    lean=True, as plain tuples.  With prepare=True the select is executed as
+    a statement prepared once per connection.
+    """
     # The presence of non-none params in the call to execute causes psycopg2
     # interpolation.   This may or may not be desirable in general.
     if params == None:
         params = []
 
-    with conn.cursor(cursor_factory=extras.NamedTupleCursor) as cursor:
-        cursor.execute(select, params)
+    with conn.cursor(cursor_factory=_cursor_factory(lean)) as cursor:
+        _execute(cursor, select, params, prepare)
         rows = list(cursor.fetchall())
     return rows
 
 
-def sql_1row(conn, select, params=None):
+def sql_1row(conn, select, params=None, prepare=False):
     """
     Note that this function is designed to be always used with tuple unpacking
     for multiple columns and the single value is unpacked in the function.
@@ -31,7 +89,7 @@ def sql_1row(conn, select, params=None):
     # use simple tuple cursor no matter what the connection cursor_factory is.
     cursor = conn.cursor(cursor_factory=psyext.cursor)
 
-    cursor.execute(select, params)
+    _execute(cursor, select, params, prepare)
     results = list(cursor.fetchall())
     if len(results) == 0:
         row = (None,) * len(cursor.description)
@@ -46,7 +104,7 @@ def sql_1row(conn, select, params=None):
     return row[0] if len(row) == 1 else row
 
 
-def sql_1object(conn, select, params=None):
+def sql_1object(conn, select, params=None, prepare=False):
     """
     Similarly to :meth:`sql_1row` this function executes an SQL select that is
     expected to return exactly one row.   It returns an object whose
@@ -57,13 +115,14 @@ def sql_1object(conn, select, params=None):
     if params == None:
         params = []
 
-    with conn.cursor(cursor_factory=extras.NamedTupleCursor) as cursor:
-        cursor.execute(select, params)
+    # a plain cursor; only the single row gets attribute access
+    with conn.cursor(cursor_factory=psyext.cursor) as cursor:
+        _execute(cursor, select, params, prepare)
         results = list(cursor.fetchall())
         if len(results) == 0:
             row = None
         elif len(results) == 1:
-            row = results[0]
+            (row,) = named_rows(cursor.description, results)
         else:
             raise RuntimeError("Multiple row result in sql_1row")
 
@@ -83,7 +142,9 @@ def sql_void(conn, sql, params=None):
         cursor.execute(sql, params)
 
 
-def sql_tab2(conn, stmt, mogrify_params=None, column_map=None):
+def sql_tab2(
+    conn, stmt, mogrify_params=None, column_map=None, lean=False, prepare=False
+):
     """
     This convenience function executes an SQL statement and returns a standard
     (columns, rows) tuple prepared to be returned from a Yenot REST end-point.
@@ -95,12 +156,13 @@ def sql_tab2(conn, stmt, mogrify_params=None, column_map=None):
     :param str stmt: SQL statement to be executed (likely with placeholders for substitution)
     :param dict/tuple mogrify_params: tuple or dictionary to substitute in stmt
     :param dict column_map: a dictionary of column names to rtlib column declaration dictionaries
+    :param bool lean: return plain tuple rows rather than namedtuples; see
+        :func:`named_rows` to add attribute access afterward
+    :param bool prepare: execute as a statement prepared once per connection
+        (see :func:`sqlprepare.execute`)
     """
-    cursor = conn.cursor(cursor_factory=extras.NamedTupleCursor)
-    if mogrify_params != None:
-        cursor.execute(stmt, mogrify_params)
-    else:
-        cursor.execute(stmt)
+    cursor = conn.cursor(cursor_factory=_cursor_factory(lean))
+    _execute(cursor, stmt, mogrify_params, prepare)
     columns, rows = _sql_tab2_cursor(cursor, column_map)
     cursor.close()
     return columns, rows
@@ -114,39 +176,297 @@ def _sql_tab2_cursor(cursor, column_map=None):
     with values (no attribute names).  The index of the column in the first
     element maps to the index of the value in each row.
     """
+    rows = cursor.fetchall()
+    columns = _sql_tab2_columns(cursor.description, column_map)
+    return (columns, rows)
+
+
+def _pg_rtlib_types():
+    # The first match wins as in a chain of if/elif tests.
+    pairs = [
+        ("date", psyext.DATE.values),
+        # Uncertain if this also contains a time-only value
+        ("datetime", psyext.TIME.values + psyext.PYDATETIME.values),
+        ("integer", psyext.INTEGER.values + psyext.LONGINTEGER.values),
+        ("numeric", psyext.FLOAT.values + psyext.DECIMAL.values),
+        ("boolean", psyext.BOOLEAN.values),
+        ("binary", (17,)),  # psyext.BINARY.values
+    ]
+    types = {}
+    for rttype, oids in pairs:
+        for oid in oids:
+            types.setdefault(oid, rttype)
+    return types
+
+
+# PostgreSQL type oid to rtlib column type
+PG_RTLIB_TYPES = _pg_rtlib_types()
+PG_UNICODE_TYPES = frozenset(psyext.UNICODE.values)
+
+
+class ColumnMeta(dict):
+    """
+    A column declaration returned by :func:`sql_tab2` and friends.  These are
+    cached and shared between calls so they are read-only; `dict(meta)` (or
+    `meta.copy()`) gives a mutable copy.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("column metadata is shared; modify a copy from dict(meta)")
+
+    __setitem__ = _readonly
+    __delitem__ = _readonly
+    __ior__ = _readonly
+    clear = _readonly
+    pop = _readonly
+    popitem = _readonly
+    setdefault = _readonly
+    update = _readonly
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(dict(self), memo)
+
+    def __reduce__(self):
+        return (ColumnMeta, (dict(self),))
+
+
+COLUMN_CACHE_SIZE = 1024
+
+_column_cache = collections.OrderedDict()
+_column_cache_lock = threading.Lock()
+
+
+def _frozen(value):
+    if isinstance(value, dict):
+        return tuple((k, _frozen(v)) for k, v in sorted(value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_frozen(v) for v in value)
+    return value
+
+
+def _sql_tab2_columns(description, column_map=None):
+    """
+    Derive the rtlib column list from a DB-API cursor description refined by
+    the column_map.  The column declarations are memoized by the description
+    and the content of the column_map; the list is new on each call but the
+    :class:`ColumnMeta` declarations in it are shared.
+    """
     if column_map == None:
         column_map = {}
 
-    rows = cursor.fetchall()
-    columns = []
-    for pgcol in cursor.description:
-        rt = column_map.get(pgcol[0], {})
-        pgtype = pgcol.type_code
-        if "type" not in rt:
-            if pgtype in psyext.DATE.values:
-                rt["type"] = "date"
-            elif pgtype in psyext.TIME.values + psyext.PYDATETIME.values:
-                # Uncertain if this also contains a time-only value
-                rt["type"] = "datetime"
-            elif pgtype in psyext.INTEGER.values + psyext.LONGINTEGER.values:
-                rt["type"] = "integer"
-            elif pgtype in psyext.FLOAT.values + psyext.DECIMAL.values:
-                rt["type"] = "numeric"
-            elif pgtype in psyext.BOOLEAN.values:
-                rt["type"] = "boolean"
-            elif pgtype in (17,):  # psyext.BINARY.values:
-                rt["type"] = "binary"
-        if pgtype in psyext.UNICODE.values and pgcol.internal_size > 0:
-            rt["max_length"] = pgcol.internal_size
-        columns.append((pgcol[0], rt))
-
     if os.environ.get("YENOT_DEBUG"):
-        collist = [x[0] for x in columns]
+        collist = [pgcol[0] for pgcol in description]
         for attr, meta in column_map.items():
             if attr not in collist:
                 print(f"{attr} in column map; not found in column list", flush=True)
 
-    return (columns, rows)
+    signature = tuple((c[0], c.type_code, c.internal_size) for c in description)
+    try:
+        key = (signature, _frozen(column_map))
+        hash(key)
+    except TypeError:
+        # unhashable declaration values; build without the cache
+        return _build_tab2_columns(signature, column_map)
+
+    with _column_cache_lock:
+        columns = _column_cache.get(key)
+        if columns != None:
+            _column_cache.move_to_end(key)
+            return list(columns)
+
+    columns = _build_tab2_columns(signature, column_map)
+    with _column_cache_lock:
+        _column_cache[key] = tuple(columns)
+        if len(_column_cache) > COLUMN_CACHE_SIZE:
+            _column_cache.popitem(last=False)
+    return columns
+
+
+def _build_tab2_columns(signature, column_map):
+    columns = []
+    for name, pgtype, internal_size in signature:
+        rt = dict(column_map.get(name) or {})
+        if "type" not in rt and pgtype in PG_RTLIB_TYPES:
+            rt["type"] = PG_RTLIB_TYPES[pgtype]
+        if pgtype in PG_UNICODE_TYPES and internal_size > 0:
+            rt["max_length"] = internal_size
+        columns.append((name, ColumnMeta(rt)))
+    return columns
+
+
+# default number of rows fetched per round trip by sql_tab2_stream
+STREAM_ITERSIZE = 2000
+
+_stream_cursor_ids = itertools.count(1)
+
+
+class RowStream:
+    """
+    The rows of a server-side cursor as returned by :func:`sql_tab2_stream`.
+    Iterating yields the rows one at a time and :meth:`batches` yields lists
+    of at most `itersize` rows; either way only one batch is held in memory.
+    The stream can be consumed exactly once and the cursor is closed when it
+    is exhausted (or the iteration is abandoned).
+    """
+
+    def __init__(self, cursor, first_batch):
+        self.cursor = cursor
+        self._first = first_batch
+        self._consumed = False
+
+    def batches(self):
+        if self._consumed:
+            raise RuntimeError("a RowStream can only be iterated once")
+        self._consumed = True
+
+        batch, self._first = self._first, None
+        itersize = self.cursor.itersize
+        try:
+            while len(batch) > 0:
+                yield batch
+                if len(batch) < itersize:
+                    break
+                batch = self.cursor.fetchmany(itersize)
+        finally:
+            self.cursor.close()
+
+    def __iter__(self):
+        for batch in self.batches():
+            yield from batch
+
+
+def sql_tab2_stream(
+    conn, stmt, mogrify_params=None, column_map=None, itersize=None, lean=False
+):
+    """
+    This is the streaming sibling of :func:`sql_tab2`.  The statement is
+    executed with a named (server-side) cursor and the rows are pulled from
+    PostgreSQL `itersize` at a time while they are consumed.  The return value
+    is a (columns, rows) tuple where rows is a :class:`RowStream`.
+
+    The connection must remain checked out (and in the same transaction) until
+    the rows are consumed; see :meth:`Results.json_out` for returning such a
+    table to the client.
+
+    :param connection conn: a database connection object (not in autocommit mode)
+    :param str stmt: SQL statement to be executed (likely with placeholders for substitution)
+    :param dict/tuple mogrify_params: tuple or dictionary to substitute in stmt
+    :param dict column_map: a dictionary of column names to rtlib column declaration dictionaries
+    :param int itersize: number of rows per batch (default STREAM_ITERSIZE)
+    :param bool lean: stream plain tuple rows rather than namedtuples
+    """
+    if itersize == None:
+        itersize = STREAM_ITERSIZE
+
+    cursor = conn.cursor(
+        f"yenot_tab2_{next(_stream_cursor_ids)}",
+        cursor_factory=_cursor_factory(lean),
+    )
+    cursor.itersize = itersize
+    if mogrify_params != None:
+        cursor.execute(stmt, mogrify_params)
+    else:
+        cursor.execute(stmt)
+    # the description of a named cursor is only known after the first fetch
+    first = cursor.fetchmany(itersize)
+    columns = _sql_tab2_columns(cursor.description, column_map)
+    return columns, RowStream(cursor, first)
+
+
+class JsonRows:
+    """
+    The rows of a table as returned by :func:`sql_tab2_json`: a utf-8 encoded
+    JSON array produced by PostgreSQL.  :class:`Results` writes the payload
+    to the response as is when the row format matches (objects or positional
+    arrays per `compact`); iterating decodes the rows into tuples for any
+    other consumer.
+    """
+
+    def __init__(self, payload, count, compact):
+        self.payload = payload
+        self.count = count
+        self.compact = compact
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for row in rtlib.deserialize(self.payload):
+            yield tuple(row) if self.compact else tuple(row.values())
+
+
+def _json_row_expr(conn, description, escape):
+    names = [pgcol[0] for pgcol in description]
+    # json_build_array takes at most 100 arguments and needs unique names
+    if len(names) <= 100 and len(set(names)) == len(names):
+        members = ", ".join(
+            f"yenot_t.{psyext.quote_ident(name, conn)}" for name in names
+        )
+        if escape:
+            members = members.replace("%", "%%")
+        return f"json_build_array({members})"
+    return """(
+        select coalesce(json_agg(e.value), '[]')
+        from json_each(row_to_json(yenot_t.*)) e
+    )"""
+
+
+def sql_tab2_json(conn, stmt, mogrify_params=None, column_map=None, compact=False):
+    """
+    This is a sibling of :func:`sql_tab2` for read-only reports which leaves
+    building the JSON of the rows to PostgreSQL.  The statement is wrapped as
+    a sub-select aggregated to a JSON array of row objects (or positional
+    arrays when compact is True) and the rows never become Python objects.
+    The columns are derived from the statement's cursor description just as
+    :func:`sql_tab2` derives them.
+
+    The values are rendered by PostgreSQL's json functions (e.g. numeric
+    keeps its scale).  The rows are numbered as the statement returns them
+    and aggregated in that order so the order of an ordered statement is
+    kept.
+
+    The statement is sent twice:  first under `limit 0` for the cursor
+    description (planned, but the limit stops it before any row is produced)
+    and then inside the aggregate.  It must therefore be a plain query
+    without side effects (no data modifying CTE or volatile function with
+    effects).
+
+    :param connection conn: a database connection object
+    :param str stmt: SQL statement to be executed (likely with placeholders for substitution)
+    :param dict/tuple mogrify_params: tuple or dictionary to substitute in stmt
+    :param dict column_map: a dictionary of column names to rtlib column declaration dictionaries
+    :param bool compact: aggregate positional arrays rather than objects
+    """
+    stmt = stmt.strip().rstrip(";")
+    escape = mogrify_params != None
+    params = () if mogrify_params == None else (mogrify_params,)
+
+    with conn.cursor() as cursor:
+        # planned but not run; this only fetches the description
+        cursor.execute(f"select * from ({stmt}) as yenot_t limit 0", *params)
+        columns = _sql_tab2_columns(cursor.description, column_map)
+
+        if compact:
+            element = _json_row_expr(conn, cursor.description, escape)
+        else:
+            element = "row_to_json(yenot_t.*)"
+        select = f"""
+select count(*),
+    '[' || coalesce(string_agg(yenot_r.element, ',' order by yenot_r.ordinal), '') || ']'
+from (
+    select row_number() over () as ordinal, ({element})::text as element
+    from ({stmt}) as yenot_t
+) as yenot_r"""
+
+        # the aggregated text is fetched as bytes without decoding
+        psyext.register_type(psyext.BYTES, cursor)
+        cursor.execute(select, *params)
+        count, payload = cursor.fetchone()
+
+    return columns, JsonRows(payload, count, compact)
 
 
 def sanitize_fragment(text):
@@ -1,7 +1,21 @@
+import io
+import os
 import re
+import time
+import uuid
+import decimal
+import datetime
+import itertools
+import threading
 import contextlib
 from . import sqlread
 
+# rows in one persist above which they are staged with COPY instead of VALUES
+COPY_THRESHOLD = int(os.environ.get("YENOT_COPY_THRESHOLD", 1000))
+# VALUES lists are split to statements of at most these rows & (about) bytes
+PAGE_ROWS = int(os.environ.get("YENOT_PAGE_ROWS", 1000))
+PAGE_BYTES = int(os.environ.get("YENOT_PAGE_BYTES", 1024 * 1024))
+
 
 SELECT_PRIMARY_KEYS = """
 select array_agg(kcu.column_name::text)
@@ -55,13 +69,126 @@ order by c.contype, c.conname;
 SELECT_COLUMN_TYPE = """
 select tables.table_name, columns.column_name, columns.is_nullable,
 	columns.data_type, columns.character_maximum_length,
-	columns.numeric_precision, columns.numeric_precision_radix, columns.numeric_scale
+	columns.numeric_precision, columns.numeric_precision_radix, columns.numeric_scale,
+	columns.udt_schema, columns.udt_name,
+	columns.column_default, columns.is_identity, columns.is_generated
 from information_schema.tables
 join information_schema.columns on columns.table_name=tables.table_name and columns.table_schema=tables.table_schema
 where tables.table_schema=%(sname)s and tables.table_name=%(tname)s and tables.table_type='BASE TABLE'
 """
 
 
+class TableMetadata:
+    """
+    A process-wide cache of the catalog facts used by :class:`WriteChunk` --
+    column types, primary keys and matrix foreign keys -- by table.  Any DDL
+    committed to the database drops the whole cache by way of the
+    yenotsys_ddl_notify event trigger (see schema/core.sql) and a
+    :class:`sqllisten.Listener` on its channel.  The listener has a
+    connection of its own, apart from the pool, for the LISTEN_SECONDS it is
+    kept.  Nothing is cached unless the server is running, the event trigger
+    exists and the listener is live.
+
+    Call :meth:`flush` (or `api.flush_table_metadata`) after DDL run in the
+    same transaction as later writes since the notification only arrives on
+    commit.
+    """
+
+    CHANNEL = "yenotsys_ddl"
+    # keep listening this long after the last load
+    LISTEN_SECONDS = 600
+    # seconds the first load waits for a new listener
+    LISTEN_WAIT = 1.0
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        # bumped by each flush to reject loads which raced with it
+        self.generation = 0
+        self.trigger_exists = None
+        self.hits = 0
+        self.misses = 0
+
+    def flush(self, channel=None, payload=None):
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+            self.trigger_exists = None
+
+    def _listening(self, conn):
+        # imported here; sqllisten can only be loaded by way of the api module
+        from .api import get_global_app, sqllisten
+
+        if get_global_app() == None:
+            return False
+        if self.trigger_exists == None:
+            self.trigger_exists = sqlread.sql_1row(
+                conn,
+                "select count(*)>0 from pg_event_trigger where evtname=%(n)s",
+                {"n": "yenotsys_ddl_notify"},
+            )
+        if not self.trigger_exists:
+            return False
+
+        listener = sqllisten.Listener.start_change_queue(None, self.CHANNEL)
+        if not listener.listening.wait(self.LISTEN_WAIT):
+            return False
+        return listener.subscribe(self.flush, time.time() + self.LISTEN_SECONDS)
+
+    def _lookup(self, conn, kind, sx, tx, load):
+        key = (kind, sx, tx)
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+
+        listening = self._listening(conn)
+        with self.lock:
+            generation = self.generation
+        value = load()
+        if listening:
+            with self.lock:
+                if generation == self.generation:
+                    self.entries[key] = value
+        return value
+
+    def columns(self, conn, sx, tx):
+        """
+        Return the SELECT_COLUMN_TYPE rows of the table.
+        """
+        params = {"sname": sx, "tname": tx}
+        load = lambda: tuple(sqlread.sql_rows(conn, SELECT_COLUMN_TYPE, params))
+        return self._lookup(conn, "columns", sx, tx, load)
+
+    def primary_key(self, conn, sx, tx):
+        """
+        Return a list of the primary key columns of the table (or None).
+        """
+        params = {"sname": sx, "tname": tx}
+        load = lambda: sqlread.sql_1row(conn, SELECT_PRIMARY_KEYS, params)
+        keys = self._lookup(conn, "pkey", sx, tx, load)
+        return None if keys == None else list(keys)
+
+    def matrix_fkeys(self, conn, sx, tx):
+        """
+        Return the SELECT_MATRIX_FKEYS rows of the matrix table.
+        """
+        params = {"sname": sx, "tname": tx}
+        load = lambda: tuple(sqlread.sql_rows(conn, SELECT_MATRIX_FKEYS, params))
+        return self._lookup(conn, "matrix_fkeys", sx, tx, load)
+
+
+TABLE_METADATA = TableMetadata()
+
+
+def flush_table_metadata():
+    """
+    Drop all cached table metadata (see :class:`TableMetadata`).
+    """
+    TABLE_METADATA.flush()
+
+
 def split_table_name(tname):
     if tname.find(".") >= 0:
         sx, tx = tname.split(".")
@@ -77,6 +204,9 @@ def split_table_name(tname):
 
 
 class WriteChunk:
+    # see TableSaveMogrification.upsert
+    upsert = False
+
     def __init__(self, conn):
         self.conn = conn
 
@@ -120,10 +250,24 @@ class WriteChunk:
 
         return result
 
+    @staticmethod
+    def _column_type(schrow):
+        """
+        Return the full sql type of a column for casts the value must match
+        exactly (e.g. the array of an unnest compared to the column).
+
+        This parses the rows returned by SELECT_COLUMN_TYPE.
+        """
+        if schrow.data_type == "USER-DEFINED":
+            return f'"{schrow.udt_schema}"."{schrow.udt_name}"'
+        if schrow.data_type == "numeric" and schrow.numeric_precision != None:
+            return f"numeric({schrow.numeric_precision}, {schrow.numeric_scale})"
+        return schrow.data_type
+
     def update_rows(self, tname, table, matrix=None):
         # TODO: write this assuring only updates; however, for now just user upsert_rows
-        self.upsert_rows(tname, table, matrix=matrix)
         # TODO;  assert there is a row updated for each?
+        return self.upsert_rows(tname, table, matrix=matrix)
 
     def insert_rows(self, tname, table, matrix=None):
         if matrix:
@@ -135,22 +279,22 @@ class WriteChunk:
 
         sx, tx = split_table_name(tname)
 
-        insert_sql = """insert into {t} ({columns}) {v}"""
+        insert_sql = """insert into {t} ({columns}) values/*REPRESENTED*/"""
 
-        mog = TableSaveMogrification()
-        values = mog.as_values(self.conn, table, table.DataRow.__slots__)
         c = ", ".join(table.DataRow.__slots__)
-
+        insert_sql = insert_sql.format(t=tname, columns=c)
         with self.conn.cursor() as cursor:
-            cursor.execute(insert_sql.format(t=tname, columns=c, v=values))
+            pages = mogrify_pages(cursor, table.rows, table.DataRow.__slots__)
+            execute_pages(cursor, insert_sql, pages)
 
     def upsert_rows(self, tname, table, matrix=None):
+        """
+        Return the number of rows of table inserted or updated in tname.
+        """
         # TODO -- Perhaps this should be named "upserdel" since it inserts,
         # updates & deletes rows.
         sx, tx = split_table_name(tname)
 
-        from . import misc
-
         if not hasattr(table, "deleted_keys"):
             table.deleted_keys = []
 
@@ -172,9 +316,7 @@ class WriteChunk:
                 # optional matrix column not included; remove from matrix dict
                 del matrix[k]
 
-        cols = sqlread.sql_rows(
-            self.conn, SELECT_COLUMN_TYPE, {"sname": sx, "tname": tx}
-        )
+        cols = TABLE_METADATA.columns(self.conn, sx, tx)
         coltypes = {}
         for row in cols:
             if row.column_name in tosave:
@@ -182,36 +324,29 @@ class WriteChunk:
                 if cast_type:
                     coltypes[row.column_name] = cast_type
 
-        my_pkey = sqlread.sql_1row(
-            self.conn, SELECT_PRIMARY_KEYS, {"sname": sx, "tname": tx}
-        )
+        my_pkey = TABLE_METADATA.primary_key(self.conn, sx, tx)
 
         # extract primary keys for this table and cross-check with primary keys
         # of matrix table(s)
         for kmatrix, meta in matrix.items():
             sxm, txm = split_table_name(meta["table"])
 
-            primkeys = sqlread.sql_1row(
-                self.conn, SELECT_PRIMARY_KEYS, {"sname": sxm, "tname": txm}
-            )
+            primkeys = TABLE_METADATA.primary_key(self.conn, sxm, txm)
             if len(primkeys) != 2:
                 raise RuntimeError(
                     f"Expecting matrix table {meta['table']} to have 2 column composite primary key (each foreign key)"
                 )
-            matcols = sqlread.sql_rows(
-                self.conn, SELECT_COLUMN_TYPE, {"sname": sxm, "tname": txm}
-            )
+            matcols = TABLE_METADATA.columns(self.conn, sxm, txm)
             matcolmap = {mcol.column_name: mcol for mcol in matcols}
 
-            fkeys = sqlread.sql_rows(
-                self.conn, SELECT_MATRIX_FKEYS, {"sname": sxm, "tname": txm}
-            )
+            fkeys = TABLE_METADATA.matrix_fkeys(self.conn, sxm, txm)
             if len(fkeys) != 2:
                 raise RuntimeError(
                     f"Expecting matrix table {meta['table']} to have 2 foreign key references; found {fkeys}"
                 )
 
             casts = {}
+            keytypes = {}
             for fkey in fkeys:
                 if fkey.foreign_table_schema == sx and fkey.foreign_table_name == tx:
                     assert (
@@ -229,127 +364,149 @@ class WriteChunk:
                 cccast = self._column_cast(matcolmap[fkey.ordered_keys[0]])
                 if cccast:
                     casts[fkey.ordered_keys[0]] = cccast
+                keytypes[fkey.ordered_keys[0]] = self._column_type(
+                    matcolmap[fkey.ordered_keys[0]]
+                )
             meta["column_types"] = casts
+            meta["key_types"] = keytypes
 
             if not meta.get("column_self") or not meta.get("column_other"):
                 raise RuntimeError(
                     f"Expecting matrix table {meta['table']} to point to {sx}.{tx} primary key"
                 )
 
-        # run through deletes (first, to drop referencing)
+        # check the matrix values before writing anything
         for kmatrix, meta in matrix.items():
             tmatmeta = table.matrices[kmatrix]
-            sxm, txm = split_table_name(meta["table"])
-
-            columns = [(meta["column_self"], None), (meta["column_other"], None)]
-            tremove = misc.InboundTable(columns, [])
             for row in table.rows:
-                vmat = getattr(row, kmatrix)
-                mykey = getattr(row, my_pkey[0], None)
-
-                if mykey is None:
-                    # this is a new row; skip
+                # None leaves the associations as they are
+                vmat = getattr(row, kmatrix) or {}
+                if getattr(row, my_pkey[0], None) is None:
+                    # this is a new row; nothing to remove
                     if vmat.get("remove"):
                         raise RuntimeError("new rows cannot remove matrix associations")
-                    continue
-
-                # remove things marked for remove
-                for r in vmat.get("remove", []):
-                    tremove.rows.append(tremove.DataRow(mykey, r))
-                # remove things in the universe not in a 'set'
-                if "set" in vmat:
-                    if "scope" in tmatmeta:
-                        # TODO: verify that vmat['set'] is a subset of scope?
-                        removes = tmatmeta["scope"].difference(vmat["set"])
-                        for r in removes:
-                            tremove.rows.append(tremove.DataRow(mykey, r))
-                    else:
-                        # delete items not in 'set' ?
-                        raise RuntimeError(
-                            f"Expecting matrix table {meta['table']} to include a matrix scope to set the matrix values"
-                        )
-
-            if len(tremove.rows) > 0:
-                mat_mog = TableSaveMogrification()
-                mat_mog.column_types = meta["column_types"]
-                values = mat_mog.as_values(
-                    self.conn, tremove, tremove.DataRow.__slots__
-                )
-                c = ", ".join(tremove.DataRow.__slots__)
-
-                delete_sql = """delete from {t} where ({columns}) in ({v})"""
-                with self.conn.cursor() as cursor:
-                    cursor.execute(
-                        delete_sql.format(t=meta["table"], columns=c, v=values)
+                elif "set" in vmat and tmatmeta.get("scope") is None:
+                    raise RuntimeError(
+                        f"Expecting matrix table {meta['table']} to include a matrix scope to set the matrix values"
                     )
 
         mog = TableSaveMogrification()
         mog.primary_key = my_pkey
         mog.table = tname
         mog.column_types = coltypes
-        mog.persist(self.conn, table, collist=tosave)
-
-        # run through adds (after, to enable references)
+        mog.upsert = self.upsert
+        mog.required_columns = [
+            row.column_name
+            for row in cols
+            if row.is_nullable == "NO"
+            and row.column_default == None
+            and row.is_identity != "YES"
+            and row.is_generated == "NEVER"
+        ]
+        written = mog.persist(self.conn, table, collist=tosave)
+
+        # write the associations (after, to enable references)
         for kmatrix, meta in matrix.items():
-            tmatmeta = table.matrices[kmatrix]
-            sxm, txm = split_table_name(meta["table"])
+            self._write_matrix(table, kmatrix, meta, my_pkey[0])
 
-            columns = [(meta["column_self"], None), (meta["column_other"], None)]
-            tadd = misc.InboundTable(columns, [])
-            for row in table.rows:
-                vmat = getattr(row, kmatrix)
-                mykey = getattr(row, my_pkey[0])
-
-                if mykey is None:
-                    # this is a new row; skip
-                    continue
-
-                # remove things marked for remove
-                for r in vmat.get("add", []):
-                    tadd.rows.append(tadd.DataRow(mykey, r))
-                # remove things in the universe not in a 'set'
-                if "set" in vmat:
-                    # TODO: verify that vmat['set'] is a subset of scope?
-                    removes = vmat["set"]
-                    for r in removes:
-                        tadd.rows.append(tadd.DataRow(mykey, r))
-
-            if len(tadd.rows) > 0:
-                mat_mog = TableSaveMogrification()
-                mat_mog.column_types = meta["column_types"]
-                values = mat_mog.as_values(self.conn, tadd, tadd.DataRow.__slots__)
-                c = ", ".join(tadd.DataRow.__slots__)
-
-                insert_sql = """
-insert into {t} ({columns}) {v}
-on conflict ({cself}, {cother}) do nothing"""
-                with self.conn.cursor() as cursor:
-                    cursor.execute(
-                        insert_sql.format(
-                            t=meta["table"],
-                            columns=c,
-                            v=values,
-                            cself=meta["column_self"],
-                            cother=meta["column_other"],
-                        )
-                    )
+        return written
+
+    def _write_matrix(self, table, kmatrix, meta, pkey):
+        """
+        Apply the add, remove and set lists of the kmatrix column of table to
+        the matrix table with a single statement.  The lists are sent as
+        arrays of (self, other, operation) triples and the removals implied
+        by a set (the scope less the set) are computed by PostgreSQL.  As when
+        the removals were written ahead of the additions, a pair both removed
+        and added is left in place.
+        """
+        selves = []
+        others = []
+        ops = []
+        for row in table.rows:
+            vmat = getattr(row, kmatrix) or {}
+            mykey = getattr(row, pkey)
+            for op in ("add", "remove", "set"):
+                for r in vmat.get(op, []):
+                    selves.append(mykey)
+                    others.append(r)
+                    ops.append(op)
+            if "set" in vmat:
+                # the row is set even when the set is empty
+                selves.append(mykey)
+                others.append(None)
+                ops.append("set")
+        if not selves:
+            return
+
+        scope = table.matrices[kmatrix].get("scope")
+        types = meta["key_types"]
+        interpolations = {
+            "t": meta["table"],
+            "cself": meta["column_self"],
+            "cother": meta["column_other"],
+            "tself": types[meta["column_self"]],
+            "tother": types[meta["column_other"]],
+        }
+
+        update_sql = """
+with input(self_key, other_key, op) as (
+    select * from unnest(%(selves)s::{tself}[], %(others)s::{tother}[], %(ops)s::text[])
+), setting as (
+    select distinct self_key from input where op='set'
+), removing as (
+    select self_key, other_key from input where op='remove'
+    union
+    select setting.self_key, scope.other_key
+    from setting
+    cross join unnest(%(scope)s::{tother}[]) scope(other_key)
+), removed as (
+    delete from {t}
+    using removing
+    where {t}.{cself}=removing.self_key and {t}.{cother}=removing.other_key
+        and not exists (
+            select 1 from input
+            where input.op in ('add', 'set') and input.self_key=removing.self_key
+                and input.other_key=removing.other_key
+        )
+)
+insert into {t} ({cself}, {cother})
+select distinct self_key, other_key from input
+where op in ('add', 'set') and other_key is not null
+on conflict ({cself}, {cother}) do nothing""".format(
+            **interpolations
+        )
+
+        params = {
+            "selves": selves,
+            "others": others,
+            "ops": ops,
+            "scope": list(scope or []),
+        }
+        with self.conn.cursor() as cursor:
+            cursor.execute(update_sql, params)
+
+    def upsert_batches(self, tname, batches, matrix=None):
+        """
+        Upsert each table of batches (e.g. :meth:`InboundStream.batches`) as
+        it is produced.  Return the number of rows inserted or updated.
+        """
+        return sum(self.upsert_rows(tname, batch, matrix=matrix) for batch in batches)
 
     def delete_rows(self, tname, table):
         sx, tx = split_table_name(tname)
 
-        keys = sqlread.sql_1row(
-            self.conn, SELECT_PRIMARY_KEYS, {"sname": sx, "tname": tx}
-        )
+        keys = TABLE_METADATA.primary_key(self.conn, sx, tx)
         if list(sorted(keys)) != list(sorted(table.DataRow.__slots__)):
             raise RuntimeError("primary key must be exactly represented")
 
-        mog = TableSaveMogrification()
-        values = mog.as_values(self.conn, table, table.DataRow.__slots__)
         c = ", ".join(table.DataRow.__slots__)
 
-        delete_sql = """delete from {t} where ({columns}) in ({v})"""
+        delete_sql = """delete from {t} where ({columns}) in (values/*REPRESENTED*/)"""
+        delete_sql = delete_sql.format(t=tname, columns=c)
         with self.conn.cursor() as cursor:
-            cursor.execute(delete_sql.format(t=tname, columns=c, v=values))
+            pages = mogrify_pages(cursor, table.rows, table.DataRow.__slots__)
+            execute_pages(cursor, delete_sql, pages)
 
 
 @contextlib.contextmanager
@@ -357,7 +514,7 @@ def writeblock(conn):
     yield WriteChunk(conn)
 
 
-def _mogrify_values(cursor, rows, row2dict, columns, types):
+def _mogrify_rows(cursor, rows, row2dict, columns, types):
     if isinstance(types, dict):
         types = [types.get(cname, None) for cname in columns]
     elif types == None:
@@ -369,9 +526,27 @@ def _mogrify_values(cursor, rows, row2dict, columns, types):
         for cname, t in zip(columns, types)
     ]
     fragment = f"({', '.join(qualnames)})"
-    mogrifications = [cursor.mogrify(fragment, row2dict(r)) for r in rows]
+    encoding = cursor.connection.encoding
+    for r in rows:
+        yield cursor.mogrify(fragment, row2dict(r)).decode(encoding)
+
+
+def _mogrify_values(cursor, rows, row2dict, columns, types):
+    return ",\n\t".join(_mogrify_rows(cursor, rows, row2dict, columns, types))
+
 
-    return ",\n\t".join([x.decode(cursor.connection.encoding) for x in mogrifications])
+def _mogrify_pages(cursor, rows, row2dict, columns, types):
+    page = []
+    size = 0
+    for mogrified in _mogrify_rows(cursor, rows, row2dict, columns, types):
+        if page and (len(page) >= PAGE_ROWS or size + len(mogrified) > PAGE_BYTES):
+            yield ",\n\t".join(page)
+            page = []
+            size = 0
+        page.append(mogrified)
+        size += len(mogrified) + 3
+    if page:
+        yield ",\n\t".join(page)
 
 
 def mogrify_values(cursor, rows, columns, types=None):
@@ -384,6 +559,77 @@ def mogrify_values_anon(cursor, rows, columns, types=None):
     )
 
 
+def mogrify_pages(cursor, rows, columns, types=None):
+    """
+    Generate the mogrify_values lists of rows in pages of at most PAGE_ROWS
+    rows and (a single row excepted) PAGE_BYTES characters.  Rows are
+    mogrified as the pages are consumed.
+    """
+    return _mogrify_pages(cursor, rows, lambda r: r._as_dict(), columns, types)
+
+
+def mogrify_pages_anon(cursor, rows, columns, types=None):
+    return _mogrify_pages(cursor, rows, lambda r: dict(zip(columns, r)), columns, types)
+
+
+def execute_pages(cursor, template, pages, fetch=False):
+    """
+    Execute template with /*REPRESENTED*/ replaced by each of pages in turn
+    (on the cursor's connection and so in one transaction).  Return the sum
+    of the row counts or, with fetch, all the rows returned.
+    """
+    count = 0
+    fetched = []
+    for values in pages:
+        # no parameters so that psycopg2 leaves the mogrified text alone
+        cursor.execute(template.replace("/*REPRESENTED*/", values))
+        if fetch:
+            fetched += cursor.fetchall()
+        count += cursor.rowcount
+    return fetched if fetch else count
+
+
+COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\n": "\\n", "\r": "\\r", "\t": "\\t"})
+
+_staging_ids = itertools.count(1)
+
+
+class NotCopyable(Exception):
+    pass
+
+
+def _copy_field(value):
+    # the COPY text format of value; see the PostgreSQL COPY documentation
+    if value is None:
+        return "\\N"
+    if isinstance(value, str):
+        return value.translate(COPY_ESCAPES)
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (int, float, decimal.Decimal, uuid.UUID)):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "\\\\x" + bytes(value).hex()
+    raise NotCopyable(f"no COPY text form for {type(value).__name__}")
+
+
+def copy_text(rows, columns):
+    """
+    Return a file of the COPY text of rows with the row index as the first
+    column.  Raises NotCopyable for values other than None, str, bool,
+    numbers, uuids, dates & times and bytes.
+    """
+    lines = []
+    for index, row in enumerate(rows):
+        values = row._as_dict()
+        fields = [str(index)] + [_copy_field(values[c]) for c in columns]
+        lines.append("\t".join(fields))
+    lines.append("")
+    return io.StringIO("\n".join(lines))
+
+
 class TableSaveMogrification:
     """
     Consider starting the PG transaction block with::
@@ -392,10 +638,30 @@ class TableSaveMogrification:
         set constraints all deferred;
     """
 
+    # single statement INSERT ... ON CONFLICT rather than update & insert;
+    # note that it fires the insert triggers of rows which are updated
+    upsert = False
+
     def __init__(self):
         self.table = None
         self.primary_key = None
         self.column_types = None
+        # not null columns without a default (None if unknown)
+        self.required_columns = None
+        self.copy_threshold = COPY_THRESHOLD
+
+    def single_statement(self, collist):
+        """
+        Return True if rows with keys are written with INSERT ... ON CONFLICT.
+        PostgreSQL checks the not null constraints of the proposed insert row
+        before it finds the conflict so this requires that collist includes
+        every required column.
+        """
+        if not self.upsert:
+            return False
+        return self.required_columns == None or set(self.required_columns) <= set(
+            collist
+        )
 
     def as_values(self, conn, table, columns):
         result_template = """\
@@ -409,7 +675,35 @@ values/*REPRESENTED*/
 
         return result_template.replace("/*REPRESENTED*/", mogrifications)
 
+    def stage(self, cursor, rows, columns):
+        """
+        COPY rows to a new temporary table with the types of columns in
+        self.table (so the column_types casts are implied) and their index
+        in yenot_ordinal.  Return the staging table name or None if the rows
+        have values without a COPY text form.
+        """
+        if len(rows) < self.copy_threshold:
+            return None
+        try:
+            data = copy_text(rows, columns)
+        except NotCopyable:
+            return None
+
+        staging = f"yenot_staging_{next(_staging_ids)}"
+        colnames = ", ".join([f'"{c}"' for c in columns])
+        create = f"""
+create temporary table {staging} on commit drop as
+select 0 as yenot_ordinal, {colnames} from {self.table} with no data"""
+        cursor.execute(create)
+        cursor.copy_expert(f"copy {staging} from stdin", data)
+        return staging
+
     def persist(self, conn, table, collist=None):
+        """
+        Delete table.deleted_keys and write table.rows to self.table; rows
+        with a null (single column) primary key are inserted and given the
+        generated key.  Return the number of rows inserted or updated.
+        """
         if not collist:
             collist = table.DataRow.__slots__
 
@@ -422,15 +716,23 @@ values/*REPRESENTED*/
 
         colnames = ", ".join([f'"{c}"' for c in collist])
         colnames_no_pk = ", ".join([f'"{c}"' for c in cols_no_pk])
+        staging_cols = ", ".join([f'staging."{c}"' for c in collist])
         staging_no_pk = ", ".join([f'staging."{c}"' for c in cols_no_pk])
         colassign = ", ".join(['"{0}"=staging."{0}"'.format(c) for c in cols_no_pk])
+        if len(cols_no_pk) > 0:
+            excluded = ", ".join(['"{0}"=excluded."{0}"'.format(c) for c in cols_no_pk])
+            conflict = f"update set {excluded}"
+        else:
+            conflict = "nothing"
 
         interpolations = {
             "fqtn": self.table,
             "tn": self.table.rsplit(".", 1)[-1],
             "colnames": colnames,
             "colassign": colassign,
+            "conflict": conflict,
             "colnames_no_pk": colnames_no_pk,
+            "staging_cols": staging_cols,
             "staging_no_pk": staging_no_pk,
         }
 
@@ -457,6 +759,16 @@ insert into {fqtn} ({colnames})
             **interpolations
         )
 
+        upsert = """
+with staging({colnames}) as (
+    values/*REPRESENTED*/
+)
+insert into {fqtn} ({colnames})
+select staging.* from staging
+on conflict ({pkcs}) do {conflict}""".format(
+            **interpolations
+        )
+
         insert2 = """
 insert into {fqtn} ({colnames_no_pk})
 values/*REPRESENTED*/
@@ -475,6 +787,42 @@ where {pkm}""".format(
             **interpolations
         )
 
+        # the same from a COPY staging table; see stage
+        upsert_staged = """
+insert into {fqtn} ({colnames})
+select {staging_cols} from {{staging}} staging
+on conflict ({pkcs}) do {conflict}""".format(
+            **interpolations
+        )
+
+        insert_staged = """
+insert into {fqtn} ({colnames})
+(
+    select {staging_cols}
+    from {{staging}} staging
+    left outer join {fqtn} on {pkm}
+    where {pkn}
+)""".format(
+            **interpolations
+        )
+
+        insert2_staged = """
+insert into {fqtn} ({colnames_no_pk})
+select {staging_no_pk}
+from {{staging}} staging
+order by staging.yenot_ordinal
+returning {pkcs}
+""".format(
+            **interpolations
+        )
+
+        update_staged = """
+update {fqtn} set {colassign}
+from {{staging}} staging
+where {pkm}""".format(
+            **interpolations
+        )
+
         delete = """
 with staging({pknames}) as (
     values/*REPRESENTED*/
@@ -488,11 +836,10 @@ delete from {fqtn} where ({pknames}) in (select * from staging)""".format(
             # this raises questions about whether this just moves problems
             # around.  Hence we recommend "set constraints all deferred".
             if len(table.deleted_keys) > 0:
-                mogrifications = mogrify_values_anon(
+                pages = mogrify_pages_anon(
                     cursor, table.deleted_keys, pkey, self.column_types
                 )
-                my_delete = delete.replace("/*REPRESENTED*/", mogrifications)
-                cursor.execute(my_delete, {"keys": tuple(table.deleted_keys)})
+                execute_pages(cursor, delete, pages)
 
             if len(pkey) == 1 and pkey[0] not in table.DataRow.__slots__:
                 # the primary key is not even in the insert data; all inserts
@@ -506,32 +853,45 @@ delete from {fqtn} where ({pknames}) in (select * from staging)""".format(
                 # defaulting is not supported on composite primary key
                 rows1 = table.rows
                 rows2 = []
-            if len(rows1) > 0:
-                mogrifications = mogrify_values(
-                    cursor, rows1, collist, self.column_types
-                )
-
-                # TODO: consider using upsert
+            written = 0
+            single = self.single_statement(collist)
+            staging = self.stage(cursor, rows1, collist) if rows1 else None
+            if staging != None and single:
+                cursor.execute(upsert_staged.format(staging=staging))
+                written += cursor.rowcount
+            elif staging != None:
                 if len(cols_no_pk) > 0:
-                    # update
-                    my_update = update.replace("/*REPRESENTED*/", mogrifications)
-                    cursor.execute(my_update)
-                # insert
-                my_insert = insert.replace("/*REPRESENTED*/", mogrifications)
-                cursor.execute(my_insert)
+                    cursor.execute(update_staged.format(staging=staging))
+                    written += cursor.rowcount
+                cursor.execute(insert_staged.format(staging=staging))
+                written += cursor.rowcount
+            elif len(rows1) > 0:
+                pages = mogrify_pages(cursor, rows1, collist, self.column_types)
+
+                if single:
+                    written += execute_pages(cursor, upsert, pages)
+                else:
+                    for page in pages:
+                        if len(cols_no_pk) > 0:
+                            # update
+                            written += execute_pages(cursor, update, [page])
+                        # insert
+                        written += execute_pages(cursor, insert, [page])
 
             if len(rows2) > 0:
                 collist2 = list(collist)
                 for pk in pkey:
                     if pk in collist2:
                         collist2.remove(pk)
-                mogrifications = mogrify_values(
-                    cursor, rows2, collist2, self.column_types
-                )
-                # insert
-                my_insert = insert2.replace("/*REPRESENTED*/", mogrifications)
-                cursor.execute(my_insert)
-                pkey_inserted = cursor.fetchall()
+                staging = self.stage(cursor, rows2, collist2)
+                if staging != None:
+                    cursor.execute(insert2_staged.format(staging=staging))
+                    pkey_inserted = cursor.fetchall()
+                else:
+                    pages = mogrify_pages(cursor, rows2, collist2, self.column_types)
+                    # insert
+                    pkey_inserted = execute_pages(cursor, insert2, pages, fetch=True)
+                written += len(pkey_inserted)
 
                 # We trust that pkey_inserted is in the same order as rows, but
                 # this is a sketchy point.  See
@@ -547,3 +907,5 @@ delete from {fqtn} where ({pknames}) in (select * from staging)""".format(
                 for inserted, row in zip(pkey_inserted, rows2):
                     for pk in pkey:
                         setattr(row, pk, getattr(inserted, pk))
+
+        return written
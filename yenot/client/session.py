@@ -1,6 +1,8 @@
 import json
 import uuid
+import threading
 import functools
+import collections
 import requests
 import rtlib
 
@@ -13,13 +15,71 @@ class YenotServerError(YenotError):
     pass
 
 
+class ValidatorStore:
+    """
+    The bodies of GET responses with their ETag by full URL and the request
+    headers the representation depends on (see :meth:`key`).  The least
+    recently used are dropped beyond max_entries or max_bytes of text.
+    """
+
+    # request headers selecting a different representation of the same URL
+    VARY_HEADERS = ("Accept", "X-Yenot-Format", "X-Yenot-Timezone")
+
+    def __init__(self, max_entries=200, max_bytes=32 * 2**20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.size = 0
+
+    def key(self, url, headers):
+        return (url,) + tuple(headers.get(h) for h in self.VARY_HEADERS)
+
+    def lookup(self, key):
+        with self.lock:
+            held = self.entries.get(key)
+            if held != None:
+                self.entries.move_to_end(key)
+            return held
+
+    def save(self, key, etag, text):
+        with self.lock:
+            self.discard(key)
+            if len(text) > self.max_bytes:
+                return
+            self.entries[key] = (etag, text)
+            self.size += len(text)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self.discard(next(iter(self.entries)))
+
+    def discard(self, key):
+        held = self.entries.pop(key, None)
+        if held != None:
+            self.size -= len(held[1])
+
+
 class YenotSession(requests.Session):
-    def __init__(self, server_url):
+    """
+    Pass compact=True to request tables with positional rows rather than
+    objects keyed by column name; :class:`StdPayload` reads either.
+    Responses are requested gzip or deflate compressed and decoded
+    transparently by requests.
+
+    GET responses with an ETag are kept in a :class:`ValidatorStore` (unless
+    validators=False) and later requests for the same URL are conditional;
+    a 304 Not Modified answer reuses the kept body.
+    """
+
+    def __init__(self, server_url, compact=False, validators=True):
         super(YenotSession, self).__init__()
         self.server_url = server_url
         if not self.server_url.endswith("/"):
             self.server_url += "/"
         self.mount(self.server_url, requests.adapters.HTTPAdapter(max_retries=3))
+        self.headers["Accept-Encoding"] = "gzip, deflate"
+        if compact:
+            self.headers["X-Yenot-Format"] = "compact"
+        self.validators = ValidatorStore() if validators else None
 
     def prefix(self, tail):
         return self.server_url + tail
@@ -31,7 +91,7 @@ class YenotSession(requests.Session):
         return YenotClient(self, StdPayload)
 
     def json_client(self):
-        return YenotClient(self, json.loads)
+        return YenotClient(self, rtlib.deserialize)
 
 
 def exception_string(response, method):
@@ -62,14 +122,15 @@ def raise_exception_ex(response, method):
 
 class StdPayload:
     def __init__(self, rawpay):
-        self._pay = json.loads(rawpay)
+        self._pay = rtlib.deserialize(rawpay)
 
     @property
     def keys(self):
         return self._pay
 
     def named_table(self, name, mixin=None):
-        return rtlib.ClientTable(*self._pay[name], mixin=mixin)
+        table = self._pay[name]
+        return rtlib.ClientTable(table["columns"], table["data"], mixin=mixin)
 
     def main_table(self, mixin=None):
         mn = self._pay["__main_table__"]
@@ -115,7 +176,7 @@ class YenotClient:
     This class implements the following client-side functionality of the Yenot
     server:
 
-    - Unpacking the body of the response (currently json.loads)
+    - Unpacking the body of the response (currently rtlib.deserialize)
 
     It does so with-out any GUI toolkit dependency.  Errors and progress
     indications are implemented via exceptions and callbacks.  Background
@@ -125,7 +186,7 @@ class YenotClient:
     The star of this class is get which sends a REST request to the specified
     Yenot server via the Python requests library.  It notifies the user of errors
     by message box or exception as appropriate and configured by a callback
-    (?).  If no error occurs the response is parsed by json.loads and returned
+    (?).  If no error occurs the response is parsed by rtlib.deserialize and returned
     with-out further parsing.  Note that you should expect requests to
     potentially take a long time.
 
@@ -150,9 +211,20 @@ class YenotClient:
         if "cancel_token" in kwargs:
             headers["X-Yenot-CancelToken"] = kwargs["cancel_token"]
             del kwargs["cancel_token"]
+        held = None
+        if s.validators != None:
+            url = requests.Request("GET", s.prefix(tail), params=kwargs).prepare().url
+            key = s.validators.key(url, s.headers)
+            held = s.validators.lookup(key)
+            if held != None:
+                headers["If-None-Match"] = held[0]
         r = s.get(s.prefix(tail), headers=headers, params=kwargs)
+        if r.status_code == 304 and held != None:
+            return self.result_factory(held[1])
         if r.status_code != 200:
             raise raise_exception_ex(r, "GET")
+        if s.validators != None and "ETag" in r.headers:
+            s.validators.save(key, r.headers["ETag"], r.text)
         return self.result_factory(r.text)
 
     def post(self, tail, *args, **kwargs):
@@ -8,6 +8,11 @@ def ping():
     return "."
 
 
+@app.get("/api/metrics", name="get_api_metrics")
+def get_api_metrics():
+    return api.metrics_out()
+
+
 @app.put("/api/request/cancel", name="api_request_cancel")
 def api_request_cancel(request):
     token = request.query.get("token")
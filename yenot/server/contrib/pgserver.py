@@ -15,6 +15,7 @@ def get_api_database_stats():
     "/api/database/relation-sizes",
     name="get_api_database_relation_sizes",
     report_title="Relation Sizes on Disk",
+    readonly=True,
 )
 def get_api_database_relation_sizes():
     select = """
@@ -11,3 +11,15 @@ def post_api_test_changequeue(request):
         api.sql_void(conn, f"notify {channel}, 'my payload'")
         conn.commit()
     return api.Results().json_out()
+
+
+@app.get(
+    "/api/test/cached-sequence",
+    name="get_api_test_cached_sequence",
+    cache={"ttl": 60, "channels": ["test_cache"]},
+)
+def get_api_test_cached_sequence():
+    results = api.Results()
+    with app.dbconn() as conn:
+        results.keys["value"] = api.sql_1row(conn, "select clock_timestamp()::text")
+    return results.json_out()
@@ -38,6 +38,41 @@ select current_date as today,
     return results.json_out()
 
 
+@app.get("/api/test/stream-table", name="api_test_stream_table")
+def get_test_stream_table(request):
+    count = api.parse_int(request.query.get("count", "5000"))
+
+    select = """
+select g as num, 'row ' || g as label, current_date + g as day
+from generate_series(1, %(n)s) g
+"""
+
+    def stream():
+        results = api.Results()
+        with app.dbconn() as conn:
+            results.tables["data", True] = api.sql_tab2_stream(
+                conn, select, {"n": count}, itersize=500
+            )
+            yield from results.json_out(stream=True)
+
+    return stream()
+
+
+@app.get("/api/test/json-table", name="api_test_json_table")
+def get_test_json_table(request):
+    count = api.parse_int(request.query.get("count", "5000"))
+
+    select = """
+select g as num, 'row ' || g as label, current_date + g as day
+from generate_series(1, %(n)s) g
+"""
+
+    results = api.Results()
+    with app.dbconn() as conn:
+        results.tables["data", True] = api.sql_tab2_json(conn, select, {"n": count})
+    return results.json_out()
+
+
 @app.get("/api/test/parse-types", name="api_test_parse_types")
 def get_test_parse_types(request):
     myfloat = api.parse_float(request.query.get("myfloat"))
@@ -76,3 +111,24 @@ select 'Joel'::varchar(30) as name,
         results.tables["data"] = rawdata[0], rows
 
     return results.json_out()
+
+
+@app.get("/api/test/modify-table-lean", name="api_test_modify_table_lean")
+def get_test_modify_table_lean():
+    select = """
+select 'Joel'::varchar(30) as name,
+    40::integer as age
+"""
+
+    results = api.Results()
+    with app.dbconn() as conn:
+        rawdata = api.sql_tab2(conn, select, lean=True)
+
+        def xform_add_one(oldrow, row):
+            row.age += 1
+
+        rows = api.tab2_rows_transform(rawdata, rawdata[0], xform_add_one)
+
+        results.tables["data"] = rawdata[0], rows
+
+    return results.json_out()
@@ -17,3 +17,19 @@ def post_api_test_receive_table():
     results = api.Results()
     results.tables["outbound"] = out.as_tab2()
     return results.json_out()
+
+
+@app.post("/api/test/receive-table-stream", name="post_api_test_receive_table_stream")
+def post_api_test_receive_table_stream():
+    incoming = api.table_from_tab2("inbound", required=["id", "xint"], stream=True)
+
+    out = rtlib.simple_table(["id", "xint"])
+    for batch in incoming.batches():
+        for row in batch.rows:
+            with out.adding_row() as r2:
+                r2.id = row.id
+                r2.xint = row.xint + 1
+
+    results = api.Results()
+    results.tables["outbound"] = out.as_tab2()
+    return results.json_out()